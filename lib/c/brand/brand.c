@@ -5,6 +5,10 @@
 #include <string.h>
 #include <unistd.h>
 #include <signal.h>
+#include <time.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include "brand.h"
 
 //---------------------------------------------------------------------------
@@ -300,6 +304,175 @@ unsigned long get_graph_load_ts_long(const nx_json *json)
     }
 }
 
+//-------------------------------------------------------------------
+//-- Get the version of the latest parameter patch in the supergraph
+//-------------------------------------------------------------------
+long long get_parameters_version(const nx_json *json)
+{
+    const nx_json *object_version = nx_json_get(json, "parameters_version");
+    if (object_version->type == NX_JSON_INTEGER)
+    {
+        return object_version->num.s_value;
+    }
+    // supergraphs from older supervisors have no version
+    return 0;
+}
+
+//--------------------------------------------------------------
+// Stream retention policies
+//
+// Read a stream's retention policy from the supergraph once, then add
+// entries with xadd_with_retention, which trims the stream in the same
+// command. argv and argvlen hold the entry's field/value pairs, e.g.:
+//
+//     stream_retention retention;
+//     get_stream_retention(supergraph, "neural", &retention);
+//     const char *argv[2] = {"samples", (char *)samples};
+//     size_t argvlen[2] = {7, sizeof(samples)};
+//     reply = xadd_with_retention(c, "neural", &retention, 2, argv, argvlen);
+//--------------------------------------------------------------
+
+void get_stream_retention(const nx_json *json, const char *stream, stream_retention *retention) {
+    retention->maxlen = 0;
+    retention->window_s = 0;
+    const nx_json *policy = nx_json_get(nx_json_get(nx_json_get(json, "streams"), stream), "retention");
+    const nx_json *maxlen = nx_json_get(policy, "maxlen");
+    if (maxlen->type == NX_JSON_INTEGER)
+        retention->maxlen = maxlen->num.s_value;
+    const nx_json *window = nx_json_get(policy, "window");
+    if (window->type == NX_JSON_INTEGER || window->type == NX_JSON_DOUBLE)
+        retention->window_s = window->num.dbl_value;
+}
+
+redisReply *xadd_with_retention(redisContext *c, const char *stream, const stream_retention *retention, int argc, const char **argv, const size_t *argvlen) {
+
+    // XADD accepts a single trimming strategy, so streams with both a
+    // maxlen and a window are trimmed by age in the supervisor
+    char trim_value[32];
+    const char *trim_strategy = NULL;
+    if (retention->maxlen > 0) {
+        trim_strategy = "MAXLEN";
+        snprintf(trim_value, sizeof(trim_value), "%lld", retention->maxlen);
+    } else if (retention->window_s > 0) {
+        struct timespec now;
+        clock_gettime(CLOCK_REALTIME, &now);
+        long long min_ms = (long long)now.tv_sec * 1000 + now.tv_nsec / 1000000
+                           - (long long)(retention->window_s * 1000);
+        trim_strategy = "MINID";
+        snprintf(trim_value, sizeof(trim_value), "%lld-0", min_ms > 0 ? min_ms : 0);
+    }
+
+    int n_args = 0;
+    const char **cmd_argv = malloc(sizeof(char *) * (argc + 6));
+    size_t *cmd_argvlen = malloc(sizeof(size_t) * (argc + 6));
+    cmd_argv[n_args++] = "XADD";
+    cmd_argv[n_args++] = stream;
+    if (trim_strategy != NULL) {
+        cmd_argv[n_args++] = trim_strategy;
+        cmd_argv[n_args++] = "~";
+        cmd_argv[n_args++] = trim_value;
+    }
+    cmd_argv[n_args++] = "*";
+    for (int i = 0; i < n_args; i++)
+        cmd_argvlen[i] = strlen(cmd_argv[i]);
+    for (int i = 0; i < argc; i++) {
+        cmd_argv[n_args] = argv[i];
+        cmd_argvlen[n_args++] = argvlen[i];
+    }
+
+    redisReply *reply = redisCommandArgv(c, n_args, cmd_argv, cmd_argvlen);
+    free(cmd_argv);
+    free(cmd_argvlen);
+    return reply;
+}
+
+//--------------------------------------------------------------
+// Incremental parameter updates
+//
+// The supervisor publishes parameter changes as versioned patches on
+// <nickname>_parameters, and only periodically republishes the full
+// supergraph. Initialize a patch reader with the version from the
+// supergraph the node read, then call read_parameter_patch until it
+// returns 0 to apply newer patches, e.g.:
+//
+//     parameter_patch patch;
+//     parameter_patch_init(&patch, get_parameters_version(supergraph));
+//     while (read_parameter_patch(c, NICKNAME, &patch) == 1) {
+//         const nx_json *gain = nx_json_get(patch.json, "gain");
+//         if (gain->type != NX_JSON_NULL) ...
+//     }
+//--------------------------------------------------------------
+
+void parameter_patch_init(parameter_patch *patch, long long version) {
+    strcpy(patch->id, "0-0");
+    patch->version = version;
+    patch->text = NULL;
+    patch->json = NULL;
+}
+
+void parameter_patch_free(parameter_patch *patch) {
+    if (patch->json != NULL)
+        nx_json_free(patch->json);
+    free(patch->text);
+    patch->json = NULL;
+    patch->text = NULL;
+}
+
+// Returns 1 if a new patch was read into patch->json, 0 if there is no new
+// patch, and -1 on error. Patches already included in the supergraph
+// (version <= patch->version) are skipped.
+int read_parameter_patch(redisContext *c, const char *node_name, parameter_patch *patch) {
+
+    while (1) {
+        redisReply *reply = redisCommand(c, "XREAD COUNT 1 STREAMS %s_parameters %s", node_name, patch->id);
+        if (reply == NULL) {
+            printf("Error reading parameter patch: %s\n", c->errstr);
+            return -1;
+        }
+        if (reply->type == REDIS_REPLY_ERROR) {
+            printf("Error: %s\n", reply->str);
+            freeReplyObject(reply);
+            return -1;
+        }
+        if (reply->type == REDIS_REPLY_NIL || reply->elements == 0) {
+            freeReplyObject(reply);
+            return 0;
+        }
+
+        redisReply *entry = reply->element[0]->element[1]->element[0];
+        snprintf(patch->id, sizeof(patch->id), "%s", entry->element[0]->str);
+
+        const char *data = NULL;
+        long long version = 0;
+        redisReply *fields = entry->element[1];
+        for (size_t i = 0; i + 1 < fields->elements; i += 2) {
+            if (strcmp(fields->element[i]->str, "data") == 0)
+                data = fields->element[i + 1]->str;
+            else if (strcmp(fields->element[i]->str, "version") == 0)
+                version = strtoll(fields->element[i + 1]->str, NULL, 10);
+        }
+
+        if (data == NULL || (version != 0 && version <= patch->version)) {
+            freeReplyObject(reply);
+            continue;
+        }
+
+        parameter_patch_free(patch);
+        // nx_json parses in place, so keep a copy of the text with the patch
+        patch->text = strdup(data);
+        freeReplyObject(reply);
+        patch->json = nx_json_parse_utf8(patch->text);
+        if (patch->json == NULL || patch->json->type != NX_JSON_OBJECT) {
+            printf("Invalid parameter patch %s for %s\n", patch->id, node_name);
+            parameter_patch_free(patch);
+            return -1;
+        }
+        if (version > patch->version)
+            patch->version = version;
+        return 1;
+    }
+}
+
 //--------------------------------------------------------------
 // Emit node state
 //--------------------------------------------------------------
@@ -329,5 +502,260 @@ void emit_status(redisContext *c, const char *node_name, enum node_state state,
     freeReplyObject(reply);
 }
 
+//--------------------------------------------------------------
+// Performance instrumentation
+//--------------------------------------------------------------
+
+uint64_t monotonic_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000ULL + (uint64_t)ts.tv_nsec;
+}
+
+// Get the histogram bin for a duration in ns
+static int perf_bin_index(uint64_t value) {
+    if (value < 1)
+        return 0;
+    int msb = 63 - __builtin_clzll(value);
+    int frac = msb >= 3 ? (value >> (msb - 3)) & 7 : (value << (3 - msb)) & 7;
+    int bin = msb * PERF_BINS_PER_OCTAVE + frac;
+    return bin < PERF_N_BINS ? bin : PERF_N_BINS - 1;
+}
+
+static void perf_histogram_record(perf_histogram *hist, uint64_t value) {
+    hist->counts[perf_bin_index(value)]++;
+    hist->count++;
+    if (value > hist->max)
+        hist->max = value;
+}
+
+// Upper edge of the bin containing the percentile q (0-100), in ns
+static uint64_t perf_histogram_percentile(const perf_histogram *hist, double q) {
+    if (hist->count == 0)
+        return 0;
+    uint64_t rank = (uint64_t)(q / 100.0 * hist->count + 0.999999);
+    if (rank < 1)
+        rank = 1;
+    uint64_t cumsum = 0;
+    int bin;
+    for (bin = 0; bin < PERF_N_BINS - 1; bin++) {
+        cumsum += hist->counts[bin];
+        if (cumsum >= rank)
+            break;
+    }
+    int msb = bin / PERF_BINS_PER_OCTAVE;
+    int frac = bin % PERF_BINS_PER_OCTAVE;
+    uint64_t edge = (uint64_t)((PERF_BINS_PER_OCTAVE + frac + 1) * (double)(1ULL << msb) / PERF_BINS_PER_OCTAVE);
+    return edge < hist->max ? edge : hist->max;
+}
+
+void perf_init(node_perf *perf, double interval_s) {
+    memset(perf, 0, sizeof(node_perf));
+    perf->interval_ns = (uint64_t)(interval_s * 1e9);
+    perf->last_publish_ns = monotonic_ns();
+}
+
+void perf_work_start(node_perf *perf) {
+    perf->work_start_ns = monotonic_ns();
+}
+
+void perf_work_stop(node_perf *perf) {
+    perf_histogram_record(&perf->work, monotonic_ns() - perf->work_start_ns);
+}
+
+void perf_record_latency(node_perf *perf, uint64_t input_ns, uint64_t output_ns) {
+    perf_histogram_record(&perf->latency, output_ns - input_ns);
+}
+
+void perf_count_entries(node_perf *perf, uint64_t n_entries) {
+    perf->n_entries += n_entries;
+}
+
+//--------------------------------------------------------------
+// Publish a summary to <node_name>_perf once per interval
+// Returns 1 if a summary was published, 0 otherwise
+//--------------------------------------------------------------
+
+int perf_publish_if_due(redisContext *c, const char *node_name, node_perf *perf) {
+
+    uint64_t now = monotonic_ns();
+    uint64_t elapsed = now - perf->last_publish_ns;
+    if (elapsed < perf->interval_ns)
+        return 0;
+
+    double entries_per_sec = perf->n_entries * 1e9 / (elapsed > 0 ? elapsed : 1);
+
+    redisReply *reply;
+    reply = redisCommand(c,
+        "XADD %s_perf * interval_ns %llu iterations %llu "
+        "work_p50_ns %llu work_p99_ns %llu work_max_ns %llu "
+        "latency_count %llu latency_p50_ns %llu latency_p99_ns %llu latency_max_ns %llu "
+        "entries_per_sec %f",
+        node_name,
+        (unsigned long long)elapsed,
+        (unsigned long long)perf->work.count,
+        (unsigned long long)perf_histogram_percentile(&perf->work, 50),
+        (unsigned long long)perf_histogram_percentile(&perf->work, 99),
+        (unsigned long long)perf->work.max,
+        (unsigned long long)perf->latency.count,
+        (unsigned long long)perf_histogram_percentile(&perf->latency, 50),
+        (unsigned long long)perf_histogram_percentile(&perf->latency, 99),
+        (unsigned long long)perf->latency.max,
+        entries_per_sec);
+    if (reply == NULL) {
+        printf("[%s] Error publishing performance summary: %s\n", node_name, c->errstr);
+    } else {
+        freeReplyObject(reply);
+    }
+
+    memset(&perf->work, 0, sizeof(perf_histogram));
+    memset(&perf->latency, 0, sizeof(perf_histogram));
+    perf->n_entries = 0;
+    perf->last_publish_ns = now;
+    return 1;
+}
+
+//--------------------------------------------------------------
+// Shared-memory ring transport
+//--------------------------------------------------------------
+
+#define SHM_RING_MAGIC "BRANDSHM"
+#define SHM_RING_VERSION 1
+#define SHM_RING_HEADER_BYTES 64
+#define SHM_RING_SLOT_HEADER_BYTES 16
+#define SHM_RING_ALIGNMENT 64
+
+// header fields, as uint64 offsets from the start of the ring
+#define SHM_RING_VERSION_IDX 1
+#define SHM_RING_N_SLOTS_IDX 2
+#define SHM_RING_SLOT_BYTES_IDX 3
+#define SHM_RING_WRITE_SEQ_IDX 4
+
+static uint64_t shm_ring_stride(uint64_t slot_bytes) {
+    uint64_t size = SHM_RING_SLOT_HEADER_BYTES + slot_bytes;
+    return (size + SHM_RING_ALIGNMENT - 1) / SHM_RING_ALIGNMENT * SHM_RING_ALIGNMENT;
+}
+
+static uint64_t *shm_ring_slot(const shm_ring *ring, uint64_t seq) {
+    return (uint64_t *)(ring->mem + SHM_RING_HEADER_BYTES + (seq % ring->n_slots) * ring->stride);
+}
+
+//--------------------------------------------------------------
+// Open the ring for a stream at /dev/shm/brand_<stream>
+// If create is true, any existing ring is replaced (producer).
+// Otherwise, n_slots and slot_bytes are read from the ring (consumer).
+// Returns 0 on success and -1 on error.
+//--------------------------------------------------------------
+
+int shm_ring_open(shm_ring *ring, const char *stream, uint64_t n_slots, uint64_t slot_bytes, bool create) {
+
+    char path[512];
+    snprintf(path, sizeof(path), "/dev/shm/brand_%s", stream);
+
+    int fd;
+    if (create) {
+        ring->n_slots = n_slots;
+        ring->slot_bytes = slot_bytes;
+        ring->stride = shm_ring_stride(slot_bytes);
+        ring->size = SHM_RING_HEADER_BYTES + n_slots * ring->stride;
+        // unlink first so consumers of a previous ring keep their mapping
+        unlink(path);
+        fd = open(path, O_RDWR | O_CREAT | O_EXCL, 0666);
+        if (fd == -1 || ftruncate(fd, ring->size) == -1) {
+            printf("Could not create shared-memory ring %s\n", path);
+            if (fd != -1)
+                close(fd);
+            return -1;
+        }
+    } else {
+        struct stat st;
+        fd = open(path, O_RDWR);
+        if (fd == -1 || fstat(fd, &st) == -1) {
+            printf("Could not open shared-memory ring %s\n", path);
+            if (fd != -1)
+                close(fd);
+            return -1;
+        }
+        ring->size = st.st_size;
+    }
+
+    ring->mem = (uint8_t *)mmap(NULL, ring->size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (ring->mem == MAP_FAILED) {
+        printf("Could not map shared-memory ring %s\n", path);
+        return -1;
+    }
+
+    uint64_t *header = (uint64_t *)ring->mem;
+    if (create) {
+        memset(ring->mem, 0, SHM_RING_HEADER_BYTES);
+        header[SHM_RING_VERSION_IDX] = SHM_RING_VERSION;
+        header[SHM_RING_N_SLOTS_IDX] = n_slots;
+        header[SHM_RING_SLOT_BYTES_IDX] = slot_bytes;
+        __atomic_thread_fence(__ATOMIC_RELEASE);
+        memcpy(ring->mem, SHM_RING_MAGIC, 8);
+    } else {
+        if (memcmp(ring->mem, SHM_RING_MAGIC, 8) != 0 || header[SHM_RING_VERSION_IDX] != SHM_RING_VERSION) {
+            printf("%s is not a version %d BRAND ring\n", path, SHM_RING_VERSION);
+            munmap(ring->mem, ring->size);
+            return -1;
+        }
+        ring->n_slots = header[SHM_RING_N_SLOTS_IDX];
+        ring->slot_bytes = header[SHM_RING_SLOT_BYTES_IDX];
+        ring->stride = shm_ring_stride(ring->slot_bytes);
+    }
+    ring->write_seq = header[SHM_RING_WRITE_SEQ_IDX];
+    return 0;
+}
+
+//--------------------------------------------------------------
+// Write a payload to the next slot
+// Returns the sequence number to send in the shm_seq field
+//--------------------------------------------------------------
+
+uint64_t shm_ring_write(shm_ring *ring, const void *data, uint64_t n_bytes) {
 
+    if (n_bytes > ring->slot_bytes) {
+        printf("Payload of %llu bytes does not fit in %llu-byte slots\n",
+               (unsigned long long)n_bytes, (unsigned long long)ring->slot_bytes);
+        exit(1);
+    }
+    uint64_t seq = ring->write_seq;
+    uint64_t *slot = shm_ring_slot(ring, seq);
+    __atomic_store_n(&slot[0], 2 * seq + 1, __ATOMIC_RELAXED);
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+    memcpy((uint8_t *)slot + SHM_RING_SLOT_HEADER_BYTES, data, n_bytes);
+    slot[1] = n_bytes;
+    __atomic_store_n(&slot[0], 2 * seq + 2, __ATOMIC_RELEASE);
+    ring->write_seq = seq + 1;
+    __atomic_store_n((uint64_t *)ring->mem + SHM_RING_WRITE_SEQ_IDX, ring->write_seq, __ATOMIC_RELEASE);
+    return seq;
+}
 
+//--------------------------------------------------------------
+// Copy the payload with sequence number seq into output
+// Returns the size of the payload, or -1 if the slot was overwritten
+// or the payload is larger than max_bytes
+//--------------------------------------------------------------
+
+int64_t shm_ring_read(const shm_ring *ring, uint64_t seq, void *output, uint64_t max_bytes) {
+
+    uint64_t *slot = shm_ring_slot(ring, seq);
+    uint64_t state = __atomic_load_n(&slot[0], __ATOMIC_ACQUIRE);
+    if (state != 2 * seq + 2)
+        return -1;
+    uint64_t n_bytes = slot[1];
+    if (n_bytes > max_bytes)
+        return -1;
+    memcpy(output, (uint8_t *)slot + SHM_RING_SLOT_HEADER_BYTES, n_bytes);
+    __atomic_thread_fence(__ATOMIC_ACQUIRE);
+    if (__atomic_load_n(&slot[0], __ATOMIC_RELAXED) != state)
+        return -1;
+    return (int64_t)n_bytes;
+}
+
+void shm_ring_close(shm_ring *ring) {
+    if (ring->mem != NULL && ring->mem != MAP_FAILED)
+        munmap(ring->mem, ring->size);
+    ring->mem = NULL;
+}
@@ -1,6 +1,7 @@
 /* Utilities for working with BRAND in Redis */
 
 #include  <stdbool.h>
+#include  <stdint.h>
 #include  <hiredis.h>
 #include  "nxjson.h"
 
@@ -23,9 +24,89 @@ unsigned long get_graph_load_ts_long(const nx_json *json);
 //void get_parameter_float(const nx_json *json, const char *node, const char *parameter, float *output);
 //void get_parameter_bool(const nx_json *json, const char *node, const char *parameter, bool *output);
 
+//--------------------------------------------------------------
+// Incremental parameter updates from <nickname>_parameters
+//--------------------------------------------------------------
+
+typedef struct parameter_patch {
+    char id[64];            // ID of the last entry read from the stream
+    long long version;      // version of the latest patch applied
+    char *text;             // JSON text of the current patch (parsed in place)
+    const nx_json *json;    // current patch: parameter names mapped to values
+} parameter_patch;
+
+long long get_parameters_version(const nx_json *json);
+void parameter_patch_init(parameter_patch *patch, long long version);
+int read_parameter_patch(redisContext *c, const char *node_name, parameter_patch *patch);
+void parameter_patch_free(parameter_patch *patch);
+
+//--------------------------------------------------------------
+// Stream retention policies (see StreamSchema in brand/schema.py)
+//--------------------------------------------------------------
+
+typedef struct stream_retention {
+    long long maxlen;       // approximate maximum number of entries, 0 if unbounded
+    double window_s;        // maximum age of entries in seconds, 0 if unbounded
+} stream_retention;
+
+void get_stream_retention(const nx_json *json, const char *stream, stream_retention *retention);
+redisReply *xadd_with_retention(redisContext *c, const char *stream, const stream_retention *retention, int argc, const char **argv, const size_t *argvlen);
+
 //--------------------------------------------------------------
 // Emit node state
 //--------------------------------------------------------------
 
 enum node_state {NODE_STARTED, NODE_READY, NODE_SHUTDOWN, NODE_FATAL_ERROR, NODE_WARNING, NODE_SUPERGRAPH_UPDATE, NODE_INFO};
 void emit_status(redisContext *c, const char *node_name, enum node_state state, const char *node_message);
+
+//--------------------------------------------------------------
+// Performance instrumentation
+//--------------------------------------------------------------
+
+// Histograms split each power of two (in ns) into PERF_BINS_PER_OCTAVE
+// linearly spaced bins, matching brand.perf in Python
+#define PERF_BINS_PER_OCTAVE 8
+#define PERF_N_BINS (40 * PERF_BINS_PER_OCTAVE)
+
+typedef struct perf_histogram {
+    uint64_t counts[PERF_N_BINS];
+    uint64_t count;
+    uint64_t max;
+} perf_histogram;
+
+typedef struct node_perf {
+    perf_histogram work;        // durations of the node's main loop work
+    perf_histogram latency;     // output time minus consumed input time
+    uint64_t n_entries;         // entries processed since the last summary
+    uint64_t interval_ns;       // time between summaries
+    uint64_t last_publish_ns;
+    uint64_t work_start_ns;
+} node_perf;
+
+uint64_t monotonic_ns(void);
+void perf_init(node_perf *perf, double interval_s);
+void perf_work_start(node_perf *perf);
+void perf_work_stop(node_perf *perf);
+void perf_record_latency(node_perf *perf, uint64_t input_ns, uint64_t output_ns);
+void perf_count_entries(node_perf *perf, uint64_t n_entries);
+int perf_publish_if_due(redisContext *c, const char *node_name, node_perf *perf);
+
+//--------------------------------------------------------------
+// Shared-memory ring transport (layout documented in brand/shm.py)
+//--------------------------------------------------------------
+
+#define SHM_RING_SEQ_FIELD "shm_seq"
+
+typedef struct shm_ring {
+    uint8_t *mem;           // mapped ring, starting with the header
+    size_t size;            // size of the mapping in bytes
+    uint64_t n_slots;
+    uint64_t slot_bytes;    // maximum payload size of each slot
+    uint64_t stride;        // bytes between the start of consecutive slots
+    uint64_t write_seq;     // next sequence number to write (producer only)
+} shm_ring;
+
+int shm_ring_open(shm_ring *ring, const char *stream, uint64_t n_slots, uint64_t slot_bytes, bool create);
+uint64_t shm_ring_write(shm_ring *ring, const void *data, uint64_t n_bytes);
+int64_t shm_ring_read(const shm_ring *ring, uint64_t seq, void *output, uint64_t max_bytes);
+void shm_ring_close(shm_ring *ring);
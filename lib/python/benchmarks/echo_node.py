@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Reference node for benchmarks: copies each entry of its input stream to its
+output stream, adding the input's time as 'input_ts' and its own monotonic
+time as 'ts'
+"""
+import time
+
+import numpy as np
+
+from brand import BRANDNode
+
+
+class EchoNode(BRANDNode):
+
+    def __init__(self):
+        super().__init__()
+        self.input_stream = self.parameters['input_stream']
+        self.output_stream = self.parameters['output_stream']
+        self.count = self.parameters.get('count', 100)
+        # the benchmark starts from an empty database
+        self.last_id = '0-0'
+
+    def work(self):
+        replies = self.r.xread({self.input_stream: self.last_id},
+                               count=self.count,
+                               block=1000)
+        if not replies:
+            return
+        entries = replies[0][1]
+        self.last_id = entries[-1][0]
+        p = self.r.pipeline(transaction=False)
+        for _, entry in entries:
+            p.xadd(
+                self.output_stream, {
+                    'samples': entry[b'samples'],
+                    'sync': entry[b'sync'],
+                    'input_ts': entry[b'ts'],
+                    'ts': np.uint64(time.monotonic_ns()).tobytes()
+                })
+        p.execute()
+        self.count_entries(len(entries))
+
+
+if __name__ == '__main__':
+    node = EchoNode()
+    node.run()
@@ -0,0 +1,392 @@
+"""
+Shared pieces of the BRAND benchmarks: a private redis-server on a unix
+socket, synthetic producers, and timing and allocation measurements
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import redis
+
+PERCENTILES = (50, 90, 99)
+
+
+class RedisServer():
+    """
+    redis-server that only listens on a unix socket in a temporary
+    directory, without persistence
+
+    Attributes
+    ----------
+    socket_path : str
+        Path of the unix socket
+    r : redis.Redis
+        Connection to the server
+    """
+
+    def __init__(self, redis_server='redis-server', timeout=10):
+        """
+        Parameters
+        ----------
+        redis_server : str, optional
+            redis-server executable, by default 'redis-server'
+        timeout : float, optional
+            Seconds to wait for the server to accept connections
+        """
+        self.redis_server = redis_server
+        self.timeout = timeout
+        self.directory = None
+        self.socket_path = None
+        self.proc = None
+        self.r = None
+
+    def start(self):
+        """
+        Start the server and connect to it
+        """
+        self.directory = tempfile.mkdtemp(prefix='brand_bench_')
+        self.socket_path = os.path.join(self.directory, 'redis.sock')
+        self.proc = subprocess.Popen([
+            self.redis_server, '--port', '0', '--unixsocket',
+            self.socket_path, '--unixsocketperm', '700', '--dir',
+            self.directory, '--save', '', '--appendonly', 'no'
+        ],
+                                     stdout=subprocess.DEVNULL)
+        self.r = redis.Redis(unix_socket_path=self.socket_path)
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError('redis-server exited with code '
+                                   f'{self.proc.returncode}')
+            try:
+                if self.r.ping():
+                    return
+            except redis.exceptions.ConnectionError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError('Timed out waiting for redis-server')
+
+    def stop(self):
+        """
+        Stop the server and remove its directory
+        """
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def version(self) -> str:
+        """
+        Get the version of the server
+
+        Returns
+        -------
+        str
+            redis_version from INFO
+        """
+        return self.r.info('server')['redis_version']
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def make_samples(n_channels, dtype, samp_per_entry=1, seed=0) -> bytes:
+    """
+    Make a payload of random samples
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels
+    dtype : str
+        NumPy data type of the samples
+    samp_per_entry : int, optional
+        Number of samples per entry, by default 1
+    seed : int, optional
+        Seed of the random number generator
+
+    Returns
+    -------
+    bytes
+        Encoded samples
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((samp_per_entry, n_channels)) * 100
+    return data.astype(dtype).tobytes()
+
+
+def make_entry(i, samples) -> dict:
+    """
+    Make a synthetic stream entry. Entries carry the sample counter both as
+    a binary 'i' field (for xread_sync and SyncReader) and as a 'sync'
+    label (see doc/DataSyncGuidelines.md), and the monotonic time of the
+    write in 'ts'.
+
+    Parameters
+    ----------
+    i : int
+        Sample counter
+    samples : bytes
+        Payload
+
+    Returns
+    -------
+    dict
+        Entry data
+    """
+    return {
+        'samples': samples,
+        'i': np.uint32(i).tobytes(),
+        'sync': json.dumps({'synth_clock': i}),
+        'ts': np.uint64(time.monotonic_ns()).tobytes()
+    }
+
+
+def prefill(r, stream, n_entries, samples, start=0, batch=1000):
+    """
+    Add synthetic entries to a stream as fast as possible
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+    stream : str
+        Name of the stream
+    n_entries : int
+        Number of entries to add
+    samples : bytes
+        Payload of each entry
+    start : int, optional
+        Counter of the first entry, by default 0
+    batch : int, optional
+        Number of XADDs per pipeline, by default 1000
+    """
+    p = r.pipeline(transaction=False)
+    for i in range(start, start + n_entries):
+        p.xadd(stream, make_entry(i, samples))
+        if (i - start + 1) % batch == 0:
+            p.execute()
+    p.execute()
+
+
+def produce(socket_path, stream, rate, duration, samples):
+    """
+    Add synthetic entries to a stream at a fixed rate. Run in a separate
+    process, e.g. with multiprocessing.Process.
+
+    Parameters
+    ----------
+    socket_path : str
+        Unix socket of the redis-server
+    stream : str
+        Name of the stream
+    rate : float
+        Entries per second
+    duration : float
+        Seconds to produce for
+    samples : bytes
+        Payload of each entry
+    """
+    r = redis.Redis(unix_socket_path=socket_path)
+    period_ns = int(1e9 / rate)
+    n_entries = int(rate * duration)
+    t_start = time.monotonic_ns()
+    for i in range(n_entries):
+        # absolute deadlines, so late writes do not shift later ones
+        delay = t_start + i * period_ns - time.monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        r.xadd(stream, make_entry(i, samples))
+
+
+def summarize_ns(durations_ns) -> dict:
+    """
+    Summarize a set of durations
+
+    Parameters
+    ----------
+    durations_ns : array_like
+        Durations in nanoseconds
+
+    Returns
+    -------
+    dict
+        Count, mean, maximum, and percentiles in microseconds
+    """
+    durations_us = np.asarray(durations_ns, dtype=np.float64) / 1e3
+    if durations_us.size == 0:
+        return {'n': 0}
+    summary = {
+        'n': int(durations_us.size),
+        'mean_us': float(durations_us.mean()),
+        'max_us': float(durations_us.max())
+    }
+    for q, value in zip(PERCENTILES, np.percentile(durations_us,
+                                                   PERCENTILES)):
+        summary[f'p{q}_us'] = float(value)
+    return summary
+
+
+def time_calls(func, n_calls, n_warmup=10, setup=None) -> dict:
+    """
+    Measure the duration of each call to a function
+
+    Parameters
+    ----------
+    func : callable
+        Function to call without arguments
+    n_calls : int
+        Number of measured calls
+    n_warmup : int, optional
+        Number of calls made before measuring, by default 10
+    setup : callable, optional
+        Function called before each call, outside of the measurement
+
+    Returns
+    -------
+    dict
+        Summary from `summarize_ns`, plus the number of calls per second
+    """
+    for _ in range(n_warmup):
+        if setup is not None:
+            setup()
+        func()
+    durations = np.empty(n_calls, dtype=np.int64)
+    for i in range(n_calls):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        func()
+        durations[i] = time.perf_counter_ns() - start
+    summary = summarize_ns(durations)
+    summary['calls_per_s'] = float(n_calls / (durations.sum() / 1e9))
+    return summary
+
+
+def measure_allocations(func, n_calls, setup=None) -> dict:
+    """
+    Measure the memory allocated by calls to a function with tracemalloc.
+    This is done separately from `time_calls`, since tracing slows down
+    allocations.
+
+    Parameters
+    ----------
+    func : callable
+        Function to call without arguments
+    n_calls : int
+        Number of calls
+    setup : callable, optional
+        Function called before each call, outside of the measurement
+
+    Returns
+    -------
+    dict
+        Peak traced memory during a call (on Python 3.8, the peak since the
+        first call), and the number of allocated blocks and bytes that were
+        still alive after each call (averaged)
+    """
+    # ignore the snapshots themselves
+    _filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    peak = 0
+    n_blocks = 0
+    n_bytes = 0
+    try:
+        for _ in range(n_calls):
+            if setup is not None:
+                setup()
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+                tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot().filter_traces(_filters)
+            current, _ = tracemalloc.get_traced_memory()
+            result = func()
+            _, call_peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(_filters)
+            del result
+            peak = max(peak, call_peak - current)
+            for stat in after.compare_to(before, 'filename'):
+                n_blocks += stat.count_diff
+                n_bytes += stat.size_diff
+    finally:
+        tracemalloc.stop()
+    return {
+        'peak_bytes': int(peak),
+        'retained_blocks_per_call': n_blocks / n_calls,
+        'retained_bytes_per_call': n_bytes / n_calls
+    }
+
+
+def get_metadata(server=None) -> dict:
+    """
+    Describe the environment of a benchmark run
+
+    Parameters
+    ----------
+    server : RedisServer, optional
+        Server used by the benchmarks
+
+    Returns
+    -------
+    dict
+        Date, host, and versions of Python, NumPy, redis-py, and Redis
+    """
+    meta = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'redis-py': redis.__version__
+    }
+    try:
+        meta['git_hash'] = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    if server is not None and server.r is not None:
+        meta['redis'] = server.version()
+    return meta
+
+
+def compare_results(baseline, results) -> str:
+    """
+    Compare two benchmark runs
+
+    Parameters
+    ----------
+    baseline : dict
+        Results of the earlier run, as saved by run_benchmarks.py
+    results : dict
+        Results of the later run
+
+    Returns
+    -------
+    str
+        Table with the median call duration of each benchmark in both runs
+        and their ratio (values below 1 mean the later run is faster)
+    """
+    lines = [f'{"benchmark":<56} {"base p50":>10} {"new p50":>10} '
+             f'{"ratio":>6}']
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None or 'p50_us' not in base.get('timing', {}):
+            continue
+        old = base['timing']['p50_us']
+        new = result['timing']['p50_us']
+        ratio = new / old if old else float('nan')
+        lines.append(f'{name:<56} {old:>10.1f} {new:>10.1f} {ratio:>6.2f}')
+    return '\n'.join(lines)
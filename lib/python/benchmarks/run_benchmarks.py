@@ -0,0 +1,297 @@
+"""
+Benchmarks for the brand stream helpers and a reference echo node. Each
+benchmark runs against a private redis-server on a unix socket, and the
+results are saved as JSON so runs can be compared.
+
+Usage:
+    python run_benchmarks.py [--output results.json] [--compare old.json]
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from brand.process import redis_time_id, wait_for_nodes_ready
+from brand.redis import SyncReader, xread_count, xread_sync
+from brand.timing import (timespecs_to_array, timespecs_to_timestamps,
+                          timevals_to_array, timevals_to_timestamps)
+
+from harness import (RedisServer, compare_results, get_metadata,
+                     make_samples, measure_allocations, prefill, produce,
+                     summarize_ns, time_calls)
+
+ECHO_NODE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'echo_node.py')
+
+
+def bench_timing(args) -> dict:
+    """
+    Benchmark the conversion of packed timevals and timespecs
+    """
+    results = {}
+    for count in args.counts:
+        t = np.zeros((count, 2), dtype=np.int64)
+        t[:, 0] = 1650000000 + np.arange(count)
+        t[:, 1] = np.arange(count) % 1000000
+        vals = t.tobytes()
+        for func in (timevals_to_timestamps, timespecs_to_timestamps,
+                     timevals_to_array, timespecs_to_array):
+            call = functools.partial(func, vals)
+            results[f'{func.__name__}[n={count}]'] = {
+                'params': {
+                    'n': count
+                },
+                'timing': time_calls(call, args.calls),
+                'alloc': measure_allocations(call, args.alloc_calls),
+                'entries_per_call': count
+            }
+    return results
+
+
+def _reader_benchmark(r, name, params, count, call, args) -> dict:
+    timing = time_calls(call, args.calls)
+    timing['entries_per_s'] = timing['calls_per_s'] * count
+    result = {
+        'params': params,
+        'timing': timing,
+        'alloc': measure_allocations(call, args.alloc_calls),
+        'entries_per_call': count
+    }
+    r.flushdb()
+    return {name: result}
+
+
+def bench_readers(server, args) -> dict:
+    """
+    Benchmark xread_count, xread_sync, and SyncReader on pre-filled streams
+    """
+    r = server.r
+    results = {}
+    # entries consumed by warmup, timed, and allocation calls
+    n_calls = 10 + args.calls + args.alloc_calls
+    for n_channels in args.channels:
+        for dtype in args.dtypes:
+            samples = make_samples(n_channels, dtype)
+            for count in args.counts:
+                params = {
+                    'channels': n_channels,
+                    'dtype': dtype,
+                    'count': count
+                }
+                suffix = f'[ch={n_channels},dtype={dtype},count={count}]'
+                n_entries = count * n_calls
+
+                prefill(r, 'a', n_entries, samples)
+                state = {'id': 0}
+
+                def read_count():
+                    out = xread_count(r, 'a', count, startid=state['id'])
+                    state['id'] = out[0][1][-1][0]
+
+                results.update(
+                    _reader_benchmark(r, 'xread_count' + suffix, params,
+                                      count, read_count, args))
+
+                prefill(r, 'a', n_entries, samples)
+                prefill(r, 'b', n_entries, samples)
+                ids = {'a': 0, 'b': 0}
+
+                def read_sync():
+                    out = xread_sync(r, ids, b'i', count=count)
+                    for name, entries in out:
+                        ids[name] = entries[-1][0]
+
+                results.update(
+                    _reader_benchmark(r, 'xread_sync' + suffix, params,
+                                      count, read_sync, args))
+
+                prefill(r, 'a', n_entries, samples)
+                prefill(r, 'b', n_entries, samples)
+                reader = SyncReader(r, {'a': 0, 'b': 0}, b'i', count=count)
+                results.update(
+                    _reader_benchmark(r, 'SyncReader.read' + suffix, params,
+                                      count, reader.read, args))
+    return results
+
+
+def bench_echo_node(server, args) -> dict:
+    """
+    Benchmark a reference node that copies a synthetic stream at a fixed
+    rate, measuring throughput and the latency from the producer's XADD to
+    the node's XADD
+    """
+    r = server.r
+    results = {}
+    for n_channels in args.channels:
+        for dtype in args.dtypes:
+            samples = make_samples(n_channels, dtype)
+            for rate in args.rates:
+                r.flushdb()
+                supergraph = {
+                    'graph_name': 'benchmark',
+                    'nodes': {
+                        'echo': {
+                            'nickname': 'echo',
+                            'parameters': {
+                                'input_stream': 'synth',
+                                'output_stream': 'echo_out',
+                                'log': 'WARNING'
+                            }
+                        }
+                    }
+                }
+                r.xadd('supergraph_stream', {'data': json.dumps(supergraph)})
+                start_id = redis_time_id(r)
+                node = subprocess.Popen([
+                    sys.executable, ECHO_NODE, '-n', 'echo', '-i',
+                    'localhost', '-p', '0', '-s', server.socket_path
+                ])
+                try:
+                    if not wait_for_nodes_ready(r, ['echo'], start_id, 10):
+                        raise RuntimeError('Echo node did not start')
+                    producer = multiprocessing.Process(
+                        target=produce,
+                        args=(server.socket_path, 'synth', rate,
+                              args.duration, samples))
+                    t_start = time.monotonic()
+                    producer.start()
+                    producer.join()
+                    elapsed = time.monotonic() - t_start
+                    # let the node catch up
+                    time.sleep(0.5)
+                finally:
+                    node.send_signal(signal.SIGINT)
+                    node.wait()
+
+                latencies = []
+                for _, entry in r.xrange('echo_out'):
+                    latencies.append(
+                        int(np.frombuffer(entry[b'ts'], np.uint64)[0]) -
+                        int(np.frombuffer(entry[b'input_ts'], np.uint64)[0]))
+                n_produced = r.xlen('synth')
+                results[f'echo_node[ch={n_channels},dtype={dtype},'
+                        f'rate={rate}]'] = {
+                            'params': {
+                                'channels': n_channels,
+                                'dtype': dtype,
+                                'rate': rate,
+                                'duration': args.duration
+                            },
+                            'timing': summarize_ns(latencies),
+                            'produced_per_s': n_produced / elapsed,
+                            'echoed_per_s': len(latencies) / elapsed,
+                            'n_dropped': n_produced - len(latencies)
+                        }
+    r.flushdb()
+    return results
+
+
+BENCHMARKS = {
+    'timing': lambda server, args: bench_timing(args),
+    'readers': bench_readers,
+    'echo_node': bench_echo_node
+}
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(
+        description='Benchmark the brand stream helpers')
+    ap.add_argument('-o',
+                    '--output',
+                    type=str,
+                    default=None,
+                    help='path of the JSON results file (default: '
+                    'bench_<date>.json)')
+    ap.add_argument('--compare',
+                    type=str,
+                    default=None,
+                    help='JSON results of an earlier run to compare with')
+    ap.add_argument('--only',
+                    type=str,
+                    nargs='+',
+                    choices=list(BENCHMARKS),
+                    default=list(BENCHMARKS),
+                    help='benchmarks to run (default: all)')
+    ap.add_argument('--channels',
+                    type=int,
+                    nargs='+',
+                    default=[96, 256],
+                    help='channel counts of the synthetic streams')
+    ap.add_argument('--dtypes',
+                    type=str,
+                    nargs='+',
+                    default=['int16', 'float32'],
+                    help='data types of the synthetic streams')
+    ap.add_argument('--counts',
+                    type=int,
+                    nargs='+',
+                    default=[1, 100],
+                    help='entries read per call')
+    ap.add_argument('--rates',
+                    type=float,
+                    nargs='+',
+                    default=[1000],
+                    help='entries per second sent to the echo node')
+    ap.add_argument('--duration',
+                    type=float,
+                    default=5,
+                    help='seconds to run the echo node benchmark for')
+    ap.add_argument('--calls',
+                    type=int,
+                    default=1000,
+                    help='timed calls per benchmark')
+    ap.add_argument('--alloc-calls',
+                    type=int,
+                    default=20,
+                    help='calls traced with tracemalloc per benchmark')
+    ap.add_argument('--redis-server',
+                    type=str,
+                    default='redis-server',
+                    help='redis-server executable')
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = args.output or f'bench_{datetime.now():%y%m%dT%H%M%S}.json'
+
+    results = {'benchmarks': {}}
+    server = RedisServer(args.redis_server)
+    # the timing benchmarks do not use Redis
+    if set(args.only) - {'timing'}:
+        server.start()
+    try:
+        results['meta'] = get_metadata(server)
+        results['meta']['args'] = vars(args)
+        for name in args.only:
+            print(f'Running {name} benchmarks')
+            results['benchmarks'].update(BENCHMARKS[name](server, args))
+    finally:
+        server.stop()
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Saved results to {output}')
+
+    for name, result in results['benchmarks'].items():
+        timing = result['timing']
+        if 'p50_us' in timing:
+            print(f"{name:<56} p50 {timing['p50_us']:>10.1f} us  "
+                  f"p99 {timing['p99_us']:>10.1f} us")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print(compare_results(baseline, results))
+
+
+if __name__ == '__main__':
+    main()
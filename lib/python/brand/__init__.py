@@ -1,14 +1,36 @@
 from .tools import (get_node_parameter_value, get_parameter_value,
                          initializeRedisFromYAML, get_node_parameter_dump,
                          get_redis_info, main, get_node_io, unpack_string,
-                         node_stage)
+                         node_stage, GraphIndex, load_graph_index)
 
-from .node import BRANDNode 
+from .exceptions import (GraphError, NodeError, 
+                        BooterError, DerivativeError, 
+                        CommandError, RedisError,
+                        ShmError)
 
-from .supervisor import Supervisor
+import importlib
 
-from .booter import Booter
+# BRANDNode, Supervisor, and Booter import redis, NumPy, and more, so their
+# modules are only imported when these names are first used. This keeps
+# `python -m brand.tools`, which scripts call many times, fast.
+_LAZY_ATTRIBUTES = {
+    'BRANDNode': 'node',
+    'Supervisor': 'supervisor',
+    'Booter': 'booter',
+}
 
-from .exceptions import (GraphError, NodeError, 
-                        BooterError, DerivativeError, 
-                        CommandError, RedisError)
\ No newline at end of file
+__all__ = [
+    'get_node_parameter_value', 'get_parameter_value',
+    'initializeRedisFromYAML', 'get_node_parameter_dump', 'get_redis_info',
+    'main', 'get_node_io', 'unpack_string', 'node_stage', 'GraphIndex',
+    'load_graph_index', 'GraphError', 'NodeError', 'BooterError',
+    'DerivativeError', 'CommandError', 'RedisError', 'ShmError'
+] + list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(f'.{_LAZY_ATTRIBUTES[name]}',
+                                         __name__)
+        return getattr(module, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
\ No newline at end of file
@@ -11,15 +11,21 @@ from sh import git
 import signal
 import subprocess
 import sys
+import time
 import traceback
 
 import coloredlogs
 import redis
 
+from .connection import (DEFAULT_REDIS_HOST, DEFAULT_REDIS_PORT, connect,
+                         get_socket_path)
 from .exceptions import (GraphError, NodeError, CommandError)
+from .process import stop_processes
+from .timesync import DEFAULT_SYNC_INTERVAL, ClockSync
+from .warmpool import WarmPool, is_python_node
+from .watchdog import Watchdog
 
-DEFAULT_REDIS_IP = '127.0.0.1'
-DEFAULT_REDIS_PORT = 6379
+DEFAULT_REDIS_IP = DEFAULT_REDIS_HOST
 
 
 class Booter():
@@ -39,7 +45,11 @@ class Booter():
                  machine,
                  host=DEFAULT_REDIS_IP,
                  port=DEFAULT_REDIS_PORT,
-                 log_level=logging.INFO) -> None:
+                 socket=None,
+                 log_level=logging.INFO,
+                 warm_pool=0,
+                 warm_pool_preload=None,
+                 time_sync_interval=DEFAULT_SYNC_INTERVAL) -> None:
         """
         Booter starts and stops nodes according to commands received from
         the Supervisor via Redis
@@ -54,8 +64,22 @@ class Booter():
             Redis IP address, by default DEFAULT_REDIS_IP
         port : int, optional
             Redis port, by default DEFAULT_REDIS_PORT
+        socket : str, optional
+            Redis unix socket. By default, the socket is used if Redis runs
+            on this machine (see brand.connection).
         log_level : int, optional
             Logging level, by default logging.INFO
+        warm_pool : int, optional
+            Number of pre-started Python workers to keep ready for launching
+            Python nodes (see brand.warmpool). By default 0, which launches
+            every node as a new process.
+        warm_pool_preload : str, optional
+            Comma-separated modules that warm workers import in addition to
+            NumPy, redis, and brand
+        time_sync_interval : float, optional
+            Seconds between time sync pings to the supervisor (see
+            brand.timesync), by default DEFAULT_SYNC_INTERVAL. 0 disables
+            time sync.
         """
         self.host = host
         self.port = port
@@ -66,10 +90,29 @@ class Booter():
         # instatiate run variables
         self.model = {}
         self.children = {}
+        self.watchdog = None
         # set the base directory as the current working directory
         self.brand_base_dir = os.getcwd()
         # connect to Redis
-        self.r = redis.Redis(self.host, self.port, socket_connect_timeout=1)
+        self.r = connect(self.host, self.port, socket)
+        self.socket = get_socket_path(self.r)
+        # separate connection pool for blocking reads
+        self.r_read = connect(self.host, self.port, self.socket, role='read')
+        # start the warm pool
+        self.warm_pool = None
+        if warm_pool:
+            preload = warm_pool_preload.split(',') if warm_pool_preload else []
+            self.warm_pool = WarmPool(warm_pool, preload=preload)
+            self.warm_pool.fill()
+            self.logger.info(f'Started warm pool with {warm_pool} workers')
+        # estimate the offset of this machine's clock from the supervisor's
+        self.clock_sync = None
+        if time_sync_interval:
+            self.clock_sync = ClockSync(self.r, self.machine,
+                                        interval=time_sync_interval,
+                                        logger=self.logger,
+                                        r_read=self.r_read)
+            self.clock_sync.start()
         # register signal handler
         signal.signal(signal.SIGINT, self.terminate)
 
@@ -173,30 +216,84 @@ class Booter():
 
         self.logger.info(f'Loaded graph with nodes: {node_names}')
 
+    def count_python_nodes(self) -> int:
+        """
+        Count the Python nodes assigned to this machine, so enough warm
+        workers are ready for the next start of the graph
+
+        Returns
+        -------
+        int
+            Number of Python nodes
+        """
+        return sum(1 for cfg in self.model.get('nodes', {}).values()
+                   if cfg.get('machine') == self.machine
+                   and is_python_node(cfg.get('binary', '')))
+
+    def launch_node(self, node, cfg):
+        """
+        Launch a node, in a warm worker if possible
+
+        Parameters
+        ----------
+        node : str
+            Nickname of the node
+        cfg : dict
+            The node's configuration in the supergraph
+
+        Returns
+        -------
+        p : subprocess.Popen
+            The node's process
+        """
+        host, port = self.model['redis_host'], self.model['redis_port']
+        node_args = ['-n', cfg['nickname'], '-i', host, '-p', str(port)]
+        if self.socket:
+            node_args += ['-s', self.socket]
+        priority = cfg.get('run_priority')
+        affinity = cfg.get('cpu_affinity')
+        # hand Python nodes to a warm worker if one is available
+        if self.warm_pool and not cfg.get('synthetic') and is_python_node(
+                cfg['binary']):
+            t_start = time.monotonic()
+            p = self.warm_pool.launch(cfg['binary'], node_args,
+                                      cpu_affinity=affinity,
+                                      run_priority=priority)
+            if p is not None:
+                self.logger.info(
+                    f"Handed '{node}' to warm worker (pid: {p.pid}) "
+                    f'in {time.monotonic() - t_start:.6f} s')
+                return p
+        if cfg.get('synthetic'):
+            # source replaced by the supervisor's benchmarkGraph command
+            args = [sys.executable, '-m', 'brand.synthetic'] + node_args
+        else:
+            args = [cfg['binary']] + node_args
+        if priority:  # if priority is not None or empty
+            chrt_args = ['chrt', '-f', str(int(priority))]
+            args = chrt_args + args
+        if affinity:  # if affinity is not None or empty
+            taskset_args = ['taskset', '-c', str(affinity)]
+            args = taskset_args + args
+        return subprocess.Popen(args)
+
     def start_graph(self):
         """
         Start the nodes in the graph that are assigned to this machine
         """
-        host, port = self.model['redis_host'], self.model['redis_port']
+        local_nodes = {}
         for node, cfg in self.model['nodes'].items():
             if 'machine' in cfg and cfg['machine'] == self.machine:
-                node_stream_name = cfg["nickname"]
-                args = [
-                    cfg['binary'], '-n', node_stream_name, '-i', host, '-p',
-                    str(port)
-                ]
-                if 'run_priority' in cfg:  # if priority is specified
-                    priority = cfg['run_priority']
-                    if priority:  # if priority is not None or empty
-                        chrt_args = ['chrt', '-f', str(int(priority))]
-                        args = chrt_args + args
-                if 'cpu_affinity' in cfg:  # if affinity is specified
-                    affinity = cfg['cpu_affinity']
-                    if affinity:  # if affinity is not None or empty
-                        taskset_args = ['taskset', '-c', str(affinity)]
-                        args = taskset_args + args
-                p = subprocess.Popen(args)
-                self.children[node] = p
+                self.children[node] = self.launch_node(node, cfg)
+                local_nodes[node] = cfg
+
+        if 'watchdog' in self.model and local_nodes:
+            self.watchdog = Watchdog(self.r, self.children, local_nodes,
+                                     self.launch_node,
+                                     graph_cfg=self.model['watchdog'],
+                                     source=self.machine,
+                                     logger=self.logger)
+            self.watchdog.start()
 
         self.r.xadd("booter_status", {"machine": self.machine, "status": f"{self.model['graph_name']} graph started successfully"})
 
@@ -205,6 +302,11 @@ class Booter():
         Stop the nodes on this machine that correspond to the running graph
         """
         self.kill_nodes()
+        # replace the workers that were used, ready for the next start. This
+        # waits until the nodes are stopped so the workers' imports do not
+        # compete with them for CPU time.
+        if self.warm_pool:
+            self.warm_pool.fill(self.count_python_nodes())
         if 'graph_name' in self.model:
             graph = self.model['graph_name']
         else:
@@ -215,44 +317,15 @@ class Booter():
         '''
         Kills child processes
         '''
-        for node, proc in self.children.items():
-            try:
-                # check if process exists
-                os.kill(proc.pid, 0)
-            except OSError:
-                self.logger.warning(f"'{node}' (pid: {proc.pid})"
-                                    " isn't running and may have crashed")
-                self.children[node] = None
-            else:
-                # process is running
-                # send SIGINT
-                proc.send_signal(signal.SIGINT)
-                try:
-                    # check if it terminated
-                    proc.communicate(timeout=15)
-                except subprocess.TimeoutExpired:
-                    self.logger.warning(f"Could not stop '{node}' "
-                                        f"(pid: {proc.pid}) using SIGINT")
-                    # if not, send SIGKILL
-                    proc.kill()
-                    try:
-                        # check if it terminated
-                        proc.communicate(timeout=15)
-                    except subprocess.TimeoutExpired:
-                        pass  # delay error message until after the loop
-                    else:
-                        self.logger.info(f"Killed '{node}' "
-                                         f"(pid: {proc.pid}) using SIGKILL")
-                        self.children[node] = None
-                else:
-                    self.logger.info(f"Stopped '{node}' "
-                                     f"(pid: {proc.pid}) using SIGINT")
-                    self.children[node] = None
-        # remove killed processes from self.children
-        self.children = {
-            n: p
-            for n, p in self.children.items() if p is not None
-        }
+        # stop the watchdog first, so it does not restart the nodes
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+        self.children, exit_times = stop_processes(self.children,
+                                                   self.logger)
+        if exit_times:
+            self.logger.info('Stopped all nodes in '
+                             f'{max(exit_times.values()):.3f} s')
         # raise an error if nodes are still running
         if self.children:
             running_nodes = [
@@ -312,51 +385,89 @@ class Booter():
         self.r.xadd("booter_status", {"machine": self.machine, "status": "Listening for commands"})
         while True:
             try:
-                streams = self.r.xread({'booter': entry_id},
-                                       block=5000,
-                                       count=1)
-                if streams:
-                    _, stream_data = streams[0]
-                    entry_id, entry_data = stream_data[0]
-                    command = entry_data[b'command'].decode()
-                    self.logger.info(f'Received {command} command')
-                    self.parse_command(entry_data)
-
+                streams = self.r_read.xread({'booter': entry_id},
+                                            block=5000)
             except redis.exceptions.ConnectionError as exc:
                 self.logger.error('Could not connect to Redis: ' + repr(exc))
                 sys.exit(0)
+            for _, stream_data in streams:
+                for entry_id, entry_data in stream_data:
+                    self.run_command(entry_id, entry_data)
 
-            except (GraphError, NodeError, CommandError) as exc:
-                # if a node has an error, stop the graph and kill all nodes
-                self.r.xadd("booter_status",
-                    {'machine': self.machine,
-                    'status': exc.__class__.__name__,
-                    'message': str(exc),
-                    'traceback': 'Booter ' + self.machine + ' ' + traceback.format_exc()})
-                self.r.xadd("booter_status",
-                    {'machine': self.machine, 'status': 'Listening for commands'})
-                if exc is NodeError:
-                    self.logger.error(f"Error with the {exc.node} node in the {exc.graph} graph")
-                elif exc is GraphError:
-                    self.logger.error(f"Error with the {exc.graph} graph")
-                elif exc is CommandError:
-                    self.logger.error(f"Error with the {exc.command} command")
-                self.logger.error(str(exc))
-
-            except Exception as exc:
-                self.r.xadd('booter_status',
-                    {'machine': self.machine,
-                    'status': 'Unhandled exception',
-                    'message': str(exc),
-                    'traceback': 'Booter ' + self.machine + ' ' + traceback.format_exc()})
-                self.logger.exception(f'Could not execute command. {repr(exc)}')
-                self.r.xadd("booter_status", {"machine": self.machine, "status": "Listening for commands"})
+    def run_command(self, command_id, entry):
+        """
+        Run a command from the booter stream, acknowledging its receipt and
+        completion on the booter_status stream. The acknowledgements include
+        the command's ID, so the supervisor can tell which machines ran it.
+
+        Parameters
+        ----------
+        command_id : bytes
+            ID of the entry in the 'booter' stream
+        entry : dict
+            An entry from the 'booter' stream containing a 'command' key
+        """
+        command = entry[b'command'].decode()
+        ack = {
+            'machine': self.machine,
+            'command': command,
+            'command_id': command_id
+        }
+        try:
+            t_start = time.monotonic()
+            self.logger.info(f'Received {command} command')
+            self.r.xadd("booter_status", {
+                **ack, 'status': 'Command received',
+                'ack': 'received'
+            })
+            self.parse_command(entry)
+            self.r.xadd("booter_status", {
+                **ack, 'status': 'Command done',
+                'ack': 'done',
+                'elapsed_s': round(time.monotonic() - t_start, 4)
+            })
+
+        except redis.exceptions.ConnectionError as exc:
+            self.logger.error('Could not connect to Redis: ' + repr(exc))
+            sys.exit(0)
+
+        except (GraphError, NodeError, CommandError) as exc:
+            # if a node has an error, stop the graph and kill all nodes
+            self.r.xadd("booter_status",
+                {'machine': self.machine,
+                'status': exc.__class__.__name__,
+                'message': str(exc),
+                'traceback': 'Booter ' + self.machine + ' ' + traceback.format_exc(),
+                'command_id': command_id})
+            self.r.xadd("booter_status",
+                {'machine': self.machine, 'status': 'Listening for commands'})
+            if exc is NodeError:
+                self.logger.error(f"Error with the {exc.node} node in the {exc.graph} graph")
+            elif exc is GraphError:
+                self.logger.error(f"Error with the {exc.graph} graph")
+            elif exc is CommandError:
+                self.logger.error(f"Error with the {exc.command} command")
+            self.logger.error(str(exc))
+
+        except Exception as exc:
+            self.r.xadd('booter_status',
+                {'machine': self.machine,
+                'status': 'Unhandled exception',
+                'message': str(exc),
+                'traceback': 'Booter ' + self.machine + ' ' + traceback.format_exc(),
+                'command_id': command_id})
+            self.logger.exception(f'Could not execute command. {repr(exc)}')
+            self.r.xadd("booter_status", {"machine": self.machine, "status": "Listening for commands"})
 
     def terminate(self, *args, **kwargs):
         """
         End this booter process when SIGINT is received
         """
         self.logger.info('SIGINT received, Exiting')
+        if self.warm_pool:
+            self.warm_pool.close()
+        if self.clock_sync is not None:
+            self.clock_sync.stop()
         try:
             self.r.xadd("booter_status", {"machine": self.machine, "status": "SIGINT received, Exiting"})
         except Exception as exc:
@@ -393,10 +504,36 @@ class Booter():
                         default=DEFAULT_REDIS_PORT,
                         help="port of the redis server"
                         f" (default: {DEFAULT_REDIS_PORT})")
+        ap.add_argument("-s",
+                        "--socket",
+                        required=False,
+                        type=str,
+                        help="unix socket of the redis server (default: the"
+                        " server's socket if it runs on this machine)")
         ap.add_argument("-l",
                         "--log-level",
                         default=logging.INFO,
                         type=lambda x: getattr(logging, x),
                         help="Configure the logging level")
+        ap.add_argument("-w",
+                        "--warm-pool",
+                        required=False,
+                        type=int,
+                        default=0,
+                        help="number of pre-started Python workers used to"
+                        " launch Python nodes (default: 0, disabled)")
+        ap.add_argument("--warm-pool-preload",
+                        required=False,
+                        type=str,
+                        help="comma-separated modules imported by the warm"
+                        " workers in addition to numpy, redis, and brand")
+        ap.add_argument("-t",
+                        "--time-sync-interval",
+                        required=False,
+                        type=float,
+                        default=DEFAULT_SYNC_INTERVAL,
+                        help="seconds between time sync pings to the"
+                        " supervisor (default: "
+                        f"{DEFAULT_SYNC_INTERVAL}, 0 disables time sync)")
         args = ap.parse_args()
         return args
\ No newline at end of file
@@ -0,0 +1,375 @@
+"""
+Rolling checkpoints of session data. A background thread periodically
+drains the entries added to each stream since the last checkpoint into
+append-only segment files, so a crash does not lose the whole session and,
+optionally, drained entries can be trimmed from Redis to bound its memory.
+
+Each segment is an uncompressed .npz file with a columnar layout:
+    id_ms, id_seq : uint64 arrays with the entry IDs
+    fields : bytes array with the field names
+    data_<i> : uint8 array with the concatenated values of field i
+    offsets_<i> : uint64 array of length n_entries + 1 with the start of
+        each value in data_<i>. Entries without the field have an empty
+        value.
+    has_<i> : bool array that is True for the entries that have field i,
+        so empty values can be told apart from missing fields
+
+Segments of a stream are stored in <directory>/<stream>/seg_<n>.npz, and the
+last checkpointed ID of each stream is kept in <directory>/checkpoint.json.
+A checkpoint starts a new segment every SEGMENT_ENTRIES entries or
+SEGMENT_BYTES bytes of values, so memory use stays bounded when a stream
+received a lot of data since the last checkpoint.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# streams used to control the graph, which are never checkpointed
+CONTROL_STREAMS = {
+    b'supergraph_stream', b'graph_status', b'supervisor_ipstream',
+    b'supervisor_status', b'booter', b'booter_status', b'node_health',
+    b'time_sync_ping', b'time_sync_pong'
+}
+CONTROL_SUFFIXES = (b'_state', b'_parameters')
+
+STATE_FILE = 'checkpoint.json'
+# maximum number of entries and bytes of values in each segment
+SEGMENT_ENTRIES = 100000
+SEGMENT_BYTES = 64 << 20
+
+
+def is_control_stream(stream) -> bool:
+    """
+    Check whether a stream is used to control the graph
+
+    Parameters
+    ----------
+    stream : bytes
+        Name of the stream
+
+    Returns
+    -------
+    bool
+        True if the stream should not be checkpointed
+    """
+    return stream in CONTROL_STREAMS or stream.endswith(CONTROL_SUFFIXES)
+
+
+def _next_id(entry_id) -> str:
+    ms, seq = entry_id.split(b'-')
+    return f'{int(ms)}-{int(seq) + 1}'
+
+
+def write_segment(path, entries):
+    """
+    Write stream entries to a segment file
+
+    Parameters
+    ----------
+    path : str
+        Path of the segment file
+    entries : list
+        Entries as returned by XRANGE
+    """
+    ids = np.array([entry_id.split(b'-') for entry_id, _ in entries],
+                   dtype=np.uint64).reshape(-1, 2)
+    fields = []
+    for _, entry in entries:
+        for field in entry:
+            if field not in fields:
+                fields.append(field)
+
+    arrays = {
+        'id_ms': ids[:, 0],
+        'id_seq': ids[:, 1],
+        'fields': np.array(fields, dtype=bytes)
+    }
+    for i, field in enumerate(fields):
+        arrays[f'has_{i}'] = np.array([field in entry for _, entry in entries],
+                                      dtype=bool)
+        values = [entry.get(field, b'') for _, entry in entries]
+        offsets = np.zeros(len(values) + 1, dtype=np.uint64)
+        np.cumsum([len(v) for v in values], out=offsets[1:])
+        arrays[f'data_{i}'] = np.frombuffer(b''.join(values), dtype=np.uint8)
+        arrays[f'offsets_{i}'] = offsets
+
+    # write to a temporary file so partial segments are never read
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_segment(path) -> list:
+    """
+    Read the entries stored in a segment file
+
+    Parameters
+    ----------
+    path : str
+        Path of the segment file
+
+    Returns
+    -------
+    list
+        Entries in the same format as XRANGE: a list of (id, dict) tuples
+        with bytes IDs, field names, and values
+    """
+    with np.load(path) as segment:
+        ids = [
+            f'{ms}-{seq}'.encode()
+            for ms, seq in zip(segment['id_ms'], segment['id_seq'])
+        ]
+        entries = [(entry_id, {}) for entry_id in ids]
+        for i, field in enumerate(segment['fields']):
+            data = segment[f'data_{i}'].tobytes()
+            offsets = segment[f'offsets_{i}']
+            # segments written without has_<i> do not store empty values
+            has = (segment[f'has_{i}'] if f'has_{i}' in segment.files else
+                   offsets[1:] > offsets[:-1])
+            for j, (_, entry) in enumerate(entries):
+                if has[j]:
+                    entry[bytes(field)] = data[int(offsets[j]):
+                                               int(offsets[j + 1])]
+    return entries
+
+
+class Checkpointer():
+    """
+    Background thread that checkpoints all data streams to segment files
+
+    Attributes
+    ----------
+    directory : str
+        Directory where segments are written
+    last_ids : dict
+        Stream names mapped to the ID of their last checkpointed entry
+    n_segments : dict
+        Stream names mapped to the number of segments written
+    """
+
+    def __init__(self,
+                 r,
+                 directory,
+                 interval=10,
+                 trim=False,
+                 count=10000,
+                 exclude=None,
+                 trim_streams=None,
+                 segment_entries=SEGMENT_ENTRIES,
+                 segment_bytes=SEGMENT_BYTES):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        directory : str
+            Directory where segments are written. Checkpointing resumes from
+            the state file in this directory, if there is one.
+        interval : float, optional
+            Time between checkpoints in seconds, by default 10
+        trim : bool, optional
+            If True, remove checkpointed entries from Redis with XTRIM MINID
+            (requires Redis 6.2). By default False.
+        count : int, optional
+            Maximum number of entries read with each XRANGE call, by default
+            10000
+        exclude : list, optional
+            Other streams that should not be checkpointed
+        trim_streams : list, optional
+            Streams whose checkpointed entries are removed from Redis even
+            if `trim` is False, e.g. streams with the persist_then_trim
+            retention policy
+        segment_entries : int, optional
+            Maximum number of entries in each segment, by default
+            SEGMENT_ENTRIES
+        segment_bytes : int, optional
+            Maximum number of bytes of values in each segment, by default
+            SEGMENT_BYTES
+        """
+        self.r = r
+        self.directory = directory
+        self.interval = interval
+        self.trim = trim
+        self.count = count
+        self.segment_entries = segment_entries
+        self.segment_bytes = segment_bytes
+        self.exclude = {
+            s.encode() if isinstance(s, str) else s
+            for s in (exclude or [])
+        }
+        self.trim_streams = {
+            s.encode() if isinstance(s, str) else s
+            for s in (trim_streams or [])
+        }
+
+        self.last_ids = {}
+        self.n_segments = {}
+        state_path = os.path.join(directory, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            self.last_ids = {
+                s.encode(): i.encode()
+                for s, i in state['last_ids'].items()
+            }
+            self.n_segments = {
+                s.encode(): n
+                for s, n in state['n_segments'].items()
+            }
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_streams(self) -> list:
+        """
+        Get the streams to checkpoint
+
+        Returns
+        -------
+        list
+            Names of all streams in the database, except control streams and
+            excluded streams
+        """
+        return sorted(
+            s for s in self.r.scan_iter(_type='stream')
+            if not is_control_stream(s) and s not in self.exclude)
+
+    def checkpoint_stream(self, stream) -> int:
+        """
+        Write the entries added to a stream since the last checkpoint to new
+        segments of at most `segment_entries` entries or `segment_bytes`
+        bytes
+
+        Parameters
+        ----------
+        stream : bytes
+            Name of the stream
+
+        Returns
+        -------
+        int
+            Number of entries written
+        """
+        last_id = self.last_ids.get(stream)
+        start = b'(' + last_id if last_id else b'-'
+        stream_dir = os.path.join(self.directory, stream.decode())
+        n_entries = 0
+        entries = []
+        n_bytes = 0
+        while True:
+            count = min(self.count, self.segment_entries - len(entries))
+            batch = self.r.xrange(stream, start, '+', count=count)
+            entries += batch
+            n_bytes += sum(
+                len(value) for _, entry in batch for value in entry.values())
+            done = len(batch) < count
+            if entries and (done or len(entries) >= self.segment_entries
+                            or n_bytes >= self.segment_bytes):
+                os.makedirs(stream_dir, exist_ok=True)
+                n = self.n_segments.get(stream, 0)
+                write_segment(os.path.join(stream_dir, f'seg_{n:06d}.npz'),
+                              entries)
+                self.n_segments[stream] = n + 1
+                self.last_ids[stream] = entries[-1][0]
+                n_entries += len(entries)
+                entries = []
+                n_bytes = 0
+            if done:
+                return n_entries
+            start = b'(' + batch[-1][0]
+
+    def checkpoint(self) -> int:
+        """
+        Checkpoint all streams, then trim the checkpointed entries if
+        enabled
+
+        Returns
+        -------
+        int
+            Number of entries written
+        """
+        n_entries = 0
+        written = []
+        for stream in self.get_streams():
+            n = self.checkpoint_stream(stream)
+            if n:
+                written.append(stream)
+                n_entries += n
+        if not written:
+            return 0
+
+        # save the state before trimming, so trimmed data is always on disk
+        state = {
+            'last_ids': {
+                s.decode(): i.decode()
+                for s, i in self.last_ids.items()
+            },
+            'n_segments': {s.decode(): n
+                           for s, n in self.n_segments.items()}
+        }
+        state_path = os.path.join(self.directory, STATE_FILE)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(state_path + '.tmp', state_path)
+
+        trimmed = [
+            s for s in written if self.trim or s in self.trim_streams
+        ]
+        if trimmed:
+            p = self.r.pipeline(transaction=False)
+            for stream in trimmed:
+                p.execute_command('XTRIM', stream, 'MINID',
+                                  _next_id(self.last_ids[stream]))
+            p.execute()
+        return n_entries
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._checkpoint_and_log()
+        # final checkpoint when stopped
+        self._checkpoint_and_log()
+
+    def _checkpoint_and_log(self):
+        t_start = time.monotonic()
+        try:
+            n_entries = self.checkpoint()
+        except Exception as exc:
+            logger.exception(f'Checkpoint failed: {repr(exc)}')
+            self.r.xadd('supervisor_status', {
+                'status': 'Checkpoint failed',
+                'message': repr(exc)
+            })
+            return
+        if n_entries:
+            logger.debug(f'Checkpointed {n_entries} entries in '
+                         f'{time.monotonic() - t_start:.3f} s')
+
+    def start(self):
+        """
+        Start checkpointing in a background thread
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='checkpointer',
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f'Checkpointing streams to {self.directory} every '
+                    f'{self.interval} s')
+
+    def stop(self):
+        """
+        Stop the background thread after a final checkpoint
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,188 @@
+"""
+Redis connections for all BRAND components. Clients are made with
+`connect`, which:
+    - connects through the server's unix socket when one is given or when
+      the server at host:port is on this machine and listens on a unix
+      socket (found with CONFIG GET unixsocket), and otherwise uses TCP
+    - uses the same socket, timeout, and retry settings everywhere
+    - shares one connection pool per server, role, and process, so clients
+      made in different places reuse connections
+    - keeps separate pools for the 'write' role (commands that return
+      immediately, e.g. XADD and XRANGE) and the 'read' role (blocking
+      reads, e.g. XREAD with BLOCK), so a blocking read never holds the
+      connection a status XADD needs
+
+Replies are parsed by hiredis when it is installed, which redis-py does
+automatically.
+"""
+import logging
+import os
+import threading
+
+import redis
+from redis.utils import HIREDIS_AVAILABLE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REDIS_HOST = '127.0.0.1'
+DEFAULT_REDIS_PORT = 6379
+ROLES = ('write', 'read')
+# keyword arguments of redis.ConnectionPool for both roles. Unix socket
+# connections do not take the connect timeout and keepalive settings.
+TCP_SETTINGS = {
+    'socket_connect_timeout': 1,
+    'socket_keepalive': True,
+    'retry_on_timeout': True
+}
+UNIX_SETTINGS = {'retry_on_timeout': True}
+
+_pools = {}
+_sockets = {}
+_lock = threading.Lock()
+
+
+def find_unix_socket(host, port):
+    """
+    Find the unix socket of a Redis server, if the server runs on this
+    machine. The server is asked for its unixsocket setting over TCP, and
+    the socket is only used if it exists here and leads to the same server.
+
+    Parameters
+    ----------
+    host : str
+        IP address or hostname of the server
+    port : int
+        Port of the server
+
+    Returns
+    -------
+    str or None
+        Path of the unix socket, or None if it is not available
+    """
+    key = (host, int(port))
+    with _lock:
+        if key in _sockets:
+            return _sockets[key]
+    path = None
+    tcp = redis.Redis(host, int(port), socket_connect_timeout=1)
+    try:
+        candidate = tcp.config_get('unixsocket').get('unixsocket')
+        if candidate and os.path.exists(candidate):
+            unix = redis.Redis(unix_socket_path=candidate)
+            try:
+                run_id = tcp.info('server')['run_id']
+                if unix.info('server')['run_id'] == run_id:
+                    path = candidate
+            finally:
+                unix.connection_pool.disconnect()
+    except (redis.exceptions.RedisError, OSError) as exc:
+        # e.g. the server is not running yet or CONFIG is disabled. The
+        # result is not cached, so the next call tries again.
+        logger.debug(f'Could not find a unix socket for {host}:{port}: '
+                     f'{repr(exc)}')
+        return None
+    finally:
+        tcp.connection_pool.disconnect()
+    with _lock:
+        _sockets[key] = path
+    return path
+
+
+def get_pool(host=DEFAULT_REDIS_HOST,
+             port=DEFAULT_REDIS_PORT,
+             socket_path=None,
+             role='write') -> redis.ConnectionPool:
+    """
+    Get the shared connection pool for a server and role, creating it if
+    needed
+
+    Parameters
+    ----------
+    host : str, optional
+        IP address or hostname of the server, by default DEFAULT_REDIS_HOST
+    port : int, optional
+        Port of the server, by default DEFAULT_REDIS_PORT
+    socket_path : str, optional
+        Unix socket of the server. If None, the socket is found with
+        `find_unix_socket`.
+    role : {'write', 'read'}, optional
+        'read' for blocking reads, 'write' for everything else
+
+    Returns
+    -------
+    redis.ConnectionPool
+        Connection pool
+    """
+    if role not in ROLES:
+        raise ValueError(f"role must be one of {ROLES}, got '{role}'")
+    if not socket_path:
+        socket_path = find_unix_socket(host, port)
+    if socket_path:
+        key = ('unix', socket_path, role)
+    else:
+        key = ('tcp', host, int(port), role)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if socket_path:
+                pool = redis.ConnectionPool(
+                    connection_class=redis.UnixDomainSocketConnection,
+                    path=socket_path,
+                    **UNIX_SETTINGS)
+            else:
+                pool = redis.ConnectionPool(host=host,
+                                            port=int(port),
+                                            **TCP_SETTINGS)
+            _pools[key] = pool
+            logger.debug(f'Created {role} pool for {key[1:-1]} (hiredis: '
+                         f'{HIREDIS_AVAILABLE})')
+    return pool
+
+
+def connect(host=DEFAULT_REDIS_HOST,
+            port=DEFAULT_REDIS_PORT,
+            socket_path=None,
+            role='write') -> redis.Redis:
+    """
+    Make a Redis client that uses the shared connection pool for a server
+    and role
+
+    Parameters
+    ----------
+    host : str, optional
+        IP address or hostname of the server, by default DEFAULT_REDIS_HOST
+    port : int, optional
+        Port of the server, by default DEFAULT_REDIS_PORT
+    socket_path : str, optional
+        Unix socket of the server. If None, the unix socket is used anyway
+        if the server is on this machine (see `find_unix_socket`).
+    role : {'write', 'read'}, optional
+        'read' for blocking reads, 'write' (the default) for everything else
+
+    Returns
+    -------
+    redis.Redis
+        Redis client
+    """
+    return redis.Redis(
+        connection_pool=get_pool(host, port, socket_path, role))
+
+
+def get_socket_path(r):
+    """
+    Get the unix socket used by a client
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis client
+
+    Returns
+    -------
+    str or None
+        Path of the unix socket, or None if the client uses TCP
+    """
+    kwargs = r.connection_pool.connection_kwargs
+    if r.connection_pool.connection_class is redis.UnixDomainSocketConnection:
+        return kwargs.get('path')
+    return None
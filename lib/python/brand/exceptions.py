@@ -44,4 +44,7 @@ class CommandError(Exception):
         self.details = details
 
 class RedisError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ShmError(Exception):
+    pass
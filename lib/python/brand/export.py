@@ -0,0 +1,276 @@
+"""
+In-process export of session data to HDF5. Each stream is read in chunks
+with XRANGE, decoded in vectorized batches using the graph's stream
+schemas, and appended to chunked, compressed datasets. Independent streams
+are read and decoded in parallel on a thread pool, but writes to the file,
+including compression, are serialized (h5py runs one HDF5 call at a time),
+so exports of large streams are bound by the compression speed.
+
+Layout of the output file:
+    /<stream>/id : (n_entries, 2) uint64 dataset with the [ms, seq] parts
+        of each entry ID
+    /<stream>/<field> : one dataset per field. Fields listed in the
+        stream schema's 'fields' have shape (n_entries, samp_per_stream,
+        chan_per_stream) and the field's data type. For streams with a
+        sample_type and no 'fields', the other fields whose values match
+        the stream's layout are decoded the same way. The sync and time
+        keys, and all other fields, are stored as ragged arrays, following
+        the NWB convention: a uint8 dataset with the concatenated values,
+        and a <field>_index uint64 dataset with the end offset of each
+        value.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .checkpoint import is_control_stream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_WORKERS = 4
+# target size of the HDF5 chunks of each dataset
+CHUNK_BYTES = 1 << 20
+
+
+class StreamExport():
+    """
+    Exports the streams of a database to an HDF5 file in the background
+
+    Attributes
+    ----------
+    path : str
+        Path of the output file
+    streams : list
+        Names of the exported streams (bytes)
+    n_total : dict
+        Number of entries to export for each stream
+    n_done : dict
+        Number of entries exported so far for each stream
+    """
+
+    def __init__(self,
+                 r,
+                 path,
+                 streams=None,
+                 schemas=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 n_workers=DEFAULT_WORKERS,
+                 compression='gzip',
+                 sync_key=b'sync',
+                 time_key=b'ts'):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        path : str
+            Path of the output file
+        streams : list, optional
+            Streams to export. By default, all streams except control
+            streams (see `brand.checkpoint.is_control_stream`).
+        schemas : dict, optional
+            Stream names (str) mapped to StreamSchema instances, e.g. from
+            `get_stream_schemas`. Used to decode fields into typed arrays.
+        chunk_size : int, optional
+            Number of entries read with each XRANGE call and written with
+            each dataset update, by default 10000. HDF5 chunks are sized
+            separately, to about CHUNK_BYTES.
+        n_workers : int, optional
+            Number of streams exported in parallel, by default 4
+        compression : str, optional
+            HDF5 compression filter for the datasets, by default 'gzip'
+        sync_key : bytes, optional
+            Field containing the sync labels, never decoded, by default
+            b'sync'
+        time_key : bytes, optional
+            Field containing the entry's time, never decoded, by default
+            b'ts'
+        """
+        self.r = r
+        self.path = path
+        if streams is None:
+            streams = [
+                s for s in r.scan_iter(_type='stream')
+                if not is_control_stream(s)
+            ]
+        self.streams = sorted(
+            s.encode() if isinstance(s, str) else s for s in streams)
+        self.schemas = schemas or {}
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        self.compression = compression
+        self.untyped_fields = {sync_key, time_key}
+
+        self.n_total = {}
+        self.n_done = {}
+        self._executor = None
+        self._futures = []
+        self._file = None
+        # serializes dataset writes from different threads
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start exporting in the background
+        """
+        import h5py  # optional dependency, only needed for exports
+
+        # export the entries that are in the database now
+        end_ids = {}
+        for stream in self.streams:
+            last = self.r.xrevrange(stream, count=1)
+            if last:
+                end_ids[stream] = last[0][0]
+                self.n_total[stream] = self.r.xlen(stream)
+                self.n_done[stream] = 0
+
+        self._file = h5py.File(self.path, 'w')
+        self._executor = ThreadPoolExecutor(max_workers=self.n_workers,
+                                            thread_name_prefix='export')
+        self._futures = [
+            self._executor.submit(self._export_stream, stream, end_id)
+            for stream, end_id in end_ids.items()
+        ]
+        logger.info(f'Exporting {len(self._futures)} streams to {self.path}')
+
+    def _export_stream(self, stream, end_id):
+        name = stream.decode()
+        schema = self.schemas.get(name)
+        with self._lock:
+            group = self._file.create_group(name)
+            id_dset = group.create_dataset('id', (0, 2),
+                                           maxshape=(None, 2),
+                                           dtype=np.uint64,
+                                           chunks=_chunk_shape((2, ), 8),
+                                           compression=self.compression)
+        datasets = {}
+        # whether each field is decoded with the schema, decided on the
+        # first batch
+        typed = {}
+        # bytes written to each ragged field
+        n_bytes = {}
+        start = '-'
+        while True:
+            entries = self.r.xrange(stream, start, end_id,
+                                    count=self.chunk_size)
+            if not entries:
+                break
+            n = len(entries)
+            ids = np.array([entry_id.split(b'-') for entry_id, _ in entries],
+                           dtype=np.uint64)
+
+            # decode each field of the batch at once. Fields are taken from
+            # the first entry, since entries of a stream share their fields.
+            columns = {}
+            for field in entries[0][1]:
+                values = [entry.get(field, b'') for _, entry in entries]
+                if field not in typed:
+                    typed[field] = self._is_typed(schema, field, values)
+                if typed[field]:
+                    dtype, shape = schema.layout(field)
+                    data = np.frombuffer(b''.join(values), dtype=dtype)
+                    if data.size != n * shape[0] * shape[1]:
+                        raise ValueError(
+                            f'Entries of the {field} field of the {name} '
+                            'stream do not match its schema')
+                    columns[field] = data.reshape((n, ) + shape)
+                else:
+                    # ragged array: concatenated values and their end offsets
+                    ends = np.cumsum([len(v) for v in values], dtype=np.uint64)
+                    columns[field] = np.frombuffer(b''.join(values),
+                                                   dtype=np.uint8)
+                    columns[field + b'_index'] = ends + n_bytes.get(field, 0)
+                    n_bytes[field] = n_bytes.get(field, 0) + int(ends[-1])
+
+            with self._lock:
+                for field, column in columns.items():
+                    if field not in datasets:
+                        shape = column.shape[1:]
+                        datasets[field] = group.create_dataset(
+                            field.decode(), (0, ) + shape,
+                            maxshape=(None, ) + shape,
+                            dtype=column.dtype,
+                            chunks=_chunk_shape(shape,
+                                                column.dtype.itemsize),
+                            compression=self.compression)
+                    _append(datasets[field], column)
+                _append(id_dset, ids)
+
+            self.n_done[stream] += n
+            if n < self.chunk_size:
+                break
+            start = b'(' + entries[-1][0]
+
+    def _is_typed(self, schema, field, values) -> bool:
+        """
+        Check whether a field is decoded with the stream's schema
+        """
+        if schema is None or field in self.untyped_fields:
+            return False
+        if field in schema.fields:
+            return True
+        if schema.dtype is None or schema.fields:
+            return False
+        # a data field of a stream with only a default layout
+        dtype, shape = schema.layout(field)
+        n_bytes = dtype.itemsize * shape[0] * shape[1]
+        return all(len(v) == n_bytes for v in values)
+
+    def done(self) -> bool:
+        """
+        Check whether the export has finished
+
+        Returns
+        -------
+        bool
+            True if all streams have been exported, or if the export failed
+        """
+        return all(f.done() for f in self._futures)
+
+    def progress(self) -> float:
+        """
+        Get the fraction of entries exported so far
+
+        Returns
+        -------
+        float
+            Number of exported entries divided by the total, between 0 and 1
+        """
+        n_total = sum(self.n_total.values())
+        return sum(self.n_done.values()) / n_total if n_total else 1.0
+
+    def finish(self):
+        """
+        Wait for the export to finish and close the file
+
+        Raises
+        ------
+        Exception
+            The first error raised while exporting a stream
+        """
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown()
+            self._file.close()
+        logger.info(f'Exported {sum(self.n_done.values())} entries to '
+                    f'{self.path}')
+
+
+def _chunk_shape(shape, itemsize) -> tuple:
+    """
+    Get the chunk shape of a dataset of entries with the given shape, with
+    about CHUNK_BYTES per chunk
+    """
+    row_bytes = max(int(np.prod(shape)) * itemsize, 1)
+    return (max(CHUNK_BYTES // row_bytes, 1), ) + tuple(shape)
+
+
+def _append(dset, data):
+    n = dset.shape[0]
+    dset.resize(n + len(data), axis=0)
+    dset[n:] = data
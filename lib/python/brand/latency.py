@@ -0,0 +1,586 @@
+"""
+Offline latency analysis for a BRAND session. Streams are joined on the
+sync labels described in doc/DataSyncGuidelines.md to rebuild per-edge and
+end-to-end latency distributions across the graph.
+
+Usage:
+    python -m brand.latency --rdb <path to RDB file>
+    python -m brand.latency -i <host> -p <port>
+"""
+import argparse
+import ast
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import coloredlogs
+import numpy as np
+import redis
+
+from .connection import connect
+from .exceptions import RedisError
+from .perf import Histogram
+from .timesync import get_stream_offsets
+from .timing import to_supervisor_time
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level='INFO', logger=logger)
+
+DEFAULT_CHUNK_SIZE = 10000
+PERCENTILES = (50, 99, 99.9)
+
+
+def start_redis_from_rdb(rdb_path, socket_path, timeout=30):
+    """
+    Start a redis-server that loads an RDB file and listens only on a unix
+    socket
+
+    Parameters
+    ----------
+    rdb_path : str
+        Path to the RDB file
+    socket_path : str
+        Path of the unix socket to create
+    timeout : float, optional
+        Seconds to wait for the RDB to load, by default 30
+
+    Returns
+    -------
+    proc : subprocess.Popen
+        The redis-server process
+    r : redis.Redis
+        Connection to the server
+    """
+    rdb_path = os.path.abspath(rdb_path)
+    if not os.path.exists(rdb_path):
+        raise FileNotFoundError(f'Could not find the RDB file at {rdb_path}')
+    proc = subprocess.Popen([
+        'redis-server', '--port', '0', '--unixsocket', socket_path,
+        '--dir', os.path.dirname(rdb_path), '--dbfilename',
+        os.path.basename(rdb_path), '--save', '', '--appendonly', 'no'
+    ],
+                            stdout=subprocess.DEVNULL)
+    r = redis.Redis(unix_socket_path=socket_path)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RedisError('redis-server exited while loading '
+                             f'{rdb_path} (code {proc.returncode})')
+        try:
+            if r.ping():
+                return proc, r
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.BusyLoadingError):
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise RedisError(f'Timed out loading {rdb_path}')
+
+
+def parse_sync(value) -> dict:
+    """
+    Parse the sync dictionary of a stream entry
+
+    Parameters
+    ----------
+    value : bytes
+        JSON-encoded sync dictionary. Python dict literals (single quotes)
+        are also accepted.
+
+    Returns
+    -------
+    dict
+        Sync labels
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value.decode())
+
+
+def parse_time(value) -> int:
+    """
+    Parse the monotonic time key of a stream entry
+
+    Parameters
+    ----------
+    value : bytes
+        Time in nanoseconds as a uint64 encoded to bytes, or as text
+
+    Returns
+    -------
+    int
+        Time in nanoseconds
+    """
+    if len(value) == 8:
+        return int(np.frombuffer(value, dtype=np.uint64)[0])
+    return int(value)
+
+
+class StreamLabels():
+    """
+    Sync labels and times of all entries in a stream, decoded once and
+    stored in memory-mapped files so that later joins use bounded memory
+
+    Attributes
+    ----------
+    name : bytes
+        Name of the stream
+    labels : list
+        Names of the sync labels in the stream
+    n_entries : int
+        Number of entries with a complete set of labels and a time
+    n_invalid : int
+        Number of entries skipped because a label or the time was missing
+    n_unsorted : dict
+        Number of times each label decreased between consecutive entries
+    n_duplicates : dict
+        Number of entries that repeat the previous entry's label value
+    """
+
+    def __init__(self, name, labels, directory):
+        self.name = name
+        self.labels = sorted(labels)
+        self.n_entries = 0
+        self.n_invalid = 0
+        self.n_unsorted = {label: 0 for label in self.labels}
+        self.n_duplicates = {label: 0 for label in self.labels}
+        self._last = {label: None for label in self.labels}
+
+        base = os.path.join(directory, name.hex())
+        self._paths = {label: f'{base}.{i}.bin'
+                       for i, label in enumerate(self.labels)}
+        self._paths[None] = f'{base}.time.bin'
+        self._files = {k: open(p, 'wb') for k, p in self._paths.items()}
+
+    def append(self, label_values, times):
+        """
+        Append decoded labels and times from a chunk of entries
+
+        Parameters
+        ----------
+        label_values : dict
+            Label names mapped to int64 arrays of label values
+        times : numpy.ndarray
+            int64 array of times in nanoseconds
+        """
+        for label in self.labels:
+            values = label_values[label]
+            if self._last[label] is not None:
+                values_ext = np.concatenate(([self._last[label]], values))
+            else:
+                values_ext = values
+            steps = np.diff(values_ext)
+            self.n_unsorted[label] += int(np.count_nonzero(steps < 0))
+            self.n_duplicates[label] += int(np.count_nonzero(steps == 0))
+            if len(values):
+                self._last[label] = values[-1]
+            values.tofile(self._files[label])
+        times.tofile(self._files[None])
+        self.n_entries += len(times)
+
+    def close(self):
+        """
+        Finish writing and open the label and time files as memory maps
+        """
+        for f in self._files.values():
+            f.close()
+        self.values = {
+            label: self._open(self._paths[label])
+            for label in self.labels
+        }
+        self.times = self._open(self._paths[None])
+
+    def _open(self, path):
+        if self.n_entries == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.memmap(path, dtype=np.int64, mode='r')
+
+
+def extract_stream(r, stream, directory, sync_key=b'sync', time_key=b'ts',
+                   chunk_size=DEFAULT_CHUNK_SIZE, clock_estimate=None,
+                   start_id='-'):
+    """
+    Read a stream in chunks with XRANGE and store its sync labels and times
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+    stream : bytes
+        Name of the stream
+    directory : str
+        Directory in which to store the decoded labels and times
+    sync_key : bytes, optional
+        Field containing the sync dictionary, by default b'sync'
+    time_key : bytes, optional
+        Field containing the monotonic time in nanoseconds, by default b'ts'
+    chunk_size : int, optional
+        Number of entries per XRANGE, by default DEFAULT_CHUNK_SIZE
+    clock_estimate : dict, optional
+        Clock estimate of the machine that wrote the stream (see
+        brand.timesync), used to map its times onto the supervisor's clock
+    start_id : str, optional
+        ID of the first entry to read, by default '-' (the whole stream)
+
+    Returns
+    -------
+    StreamLabels or None
+        Decoded labels and times, or None if the stream's first entry from
+        `start_id` does not have sync labels and a time
+    """
+    first = r.xrange(stream, start_id, '+', count=1)
+    if (not first or sync_key not in first[0][1]
+            or time_key not in first[0][1]):
+        return None
+    labels = list(parse_sync(first[0][1][sync_key]))
+    if not labels:
+        return None
+
+    out = StreamLabels(stream, labels, directory)
+    start = start_id
+    while True:
+        entries = r.xrange(stream, start, '+', count=chunk_size)
+        if not entries:
+            break
+        start = b'(' + entries[-1][0]
+
+        label_values = {label: [] for label in out.labels}
+        times = []
+        for _, data in entries:
+            try:
+                sync = parse_sync(data[sync_key])
+                values = [int(sync[label]) for label in out.labels]
+                t = parse_time(data[time_key])
+            except (KeyError, ValueError, SyntaxError, TypeError):
+                out.n_invalid += 1
+                continue
+            for label, value in zip(out.labels, values):
+                label_values[label].append(value)
+            times.append(t)
+
+        out.append(
+            {
+                label: np.array(values, dtype=np.int64)
+                for label, values in label_values.items()
+            },
+            to_supervisor_time(np.array(times, dtype=np.int64),
+                               clock_estimate))
+        if len(entries) < chunk_size:
+            break
+
+    out.close()
+    return out
+
+
+def join_latency(upstream, downstream, label, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Join two streams on a sync label and compute the latency of each match.
+    Both streams are processed in chunks, using binary search to find the
+    downstream entries for each chunk of upstream entries.
+
+    Parameters
+    ----------
+    upstream : StreamLabels
+        Stream that introduced the label
+    downstream : StreamLabels
+        Stream derived from the upstream stream
+    label : str
+        Sync label to join on
+    chunk_size : int, optional
+        Number of upstream entries per chunk, by default DEFAULT_CHUNK_SIZE
+
+    Returns
+    -------
+    dict
+        Latency histogram and counts of matched, dropped, and negative
+        latency entries
+    """
+    hist = Histogram()
+    n_matched = 0
+    n_dropped = 0
+    n_negative = 0
+
+    x_values = upstream.values[label]
+    y_values = downstream.values[label]
+    n_x = len(x_values)
+    # upstream labels after the last downstream label were not dropped, the
+    # session just ended before they could be processed
+    y_last = y_values[-1] if len(y_values) else None
+
+    for i_x in range(0, n_x, chunk_size):
+        xv = np.asarray(x_values[i_x:i_x + chunk_size])
+        xt = np.asarray(upstream.times[i_x:i_x + chunk_size])
+        if y_last is None:
+            break
+        i_lo = np.searchsorted(y_values, xv[0], side='left')
+        i_hi = np.searchsorted(y_values, xv[-1], side='right')
+        yv = np.asarray(y_values[i_lo:i_hi])
+        yt = np.asarray(downstream.times[i_lo:i_hi])
+
+        idx = np.searchsorted(yv, xv)
+        idx_clip = np.minimum(idx, max(len(yv) - 1, 0))
+        matched = (idx < len(yv)) & (yv[idx_clip] == xv) if len(yv) else (
+            np.zeros(len(xv), dtype=bool))
+
+        latency = yt[idx_clip[matched]] - xt[matched]
+        n_negative += int(np.count_nonzero(latency < 0))
+        hist.record_many(latency[latency >= 0])
+        n_matched += int(np.count_nonzero(matched))
+        n_dropped += int(np.count_nonzero(~matched & (xv <= y_last)))
+
+    return {
+        'hist': hist,
+        'matched': n_matched,
+        'dropped': n_dropped,
+        'negative': n_negative,
+    }
+
+
+def first_time_difference(upstream, downstream, label, n=1000):
+    """
+    Get the median time difference between two streams for their first
+    common label values. Used to order streams that have the same labels.
+    """
+    xv = np.asarray(upstream.values[label][:n])
+    yv = np.asarray(downstream.values[label][:n])
+    _, i_x, i_y = np.intersect1d(xv, yv, return_indices=True)
+    if len(i_x) == 0:
+        return 0
+    return float(
+        np.median(
+            np.asarray(downstream.times[:n])[i_y] -
+            np.asarray(upstream.times[:n])[i_x]))
+
+
+def build_graph(streams) -> list:
+    """
+    Infer the edges between streams from their sync labels. A stream is
+    downstream of another if its labels include all of the other's labels.
+
+    Parameters
+    ----------
+    streams : dict
+        Stream names mapped to StreamLabels
+
+    Returns
+    -------
+    list
+        (upstream, downstream) stream name pairs for all pairs of streams
+        connected through the graph
+    """
+    pairs = []
+    names = list(streams)
+    for a in names:
+        for b in names:
+            if a == b:
+                continue
+            la, lb = set(streams[a].labels), set(streams[b].labels)
+            if la < lb:
+                pairs.append((a, b))
+            elif la == lb and a < b:
+                # same labels, so order the streams by time
+                label = streams[a].labels[0]
+                if first_time_difference(streams[a], streams[b], label) >= 0:
+                    pairs.append((a, b))
+                else:
+                    pairs.append((b, a))
+    return pairs
+
+
+def analyze(r, sync_key=b'sync', time_key=b'ts', streams=None,
+            chunk_size=DEFAULT_CHUNK_SIZE, align_clocks=True,
+            start_id='-') -> dict:
+    """
+    Compute per-edge and end-to-end latency statistics for a session
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+    sync_key : bytes, optional
+        Field containing the sync dictionary, by default b'sync'
+    time_key : bytes, optional
+        Field containing the monotonic time in nanoseconds, by default b'ts'
+    streams : list, optional
+        Streams to analyze, by default all streams with sync labels
+    chunk_size : int, optional
+        Number of entries to process at once, by default DEFAULT_CHUNK_SIZE
+    align_clocks : bool, optional
+        Map the times of streams written on booters' machines onto the
+        supervisor's clock with the estimates in the time_sync stream (see
+        brand.timesync), by default True
+    start_id : str, optional
+        Only analyze entries from this ID onwards, e.g. from
+        brand.process.redis_time_id at the start of a test, by default '-'
+        (all entries)
+
+    Returns
+    -------
+    dict
+        Report with 'streams', 'edges', and 'end_to_end' sections
+    """
+    if streams is None:
+        streams = sorted(r.scan_iter(_type='STREAM'))
+    streams = [s.encode() if isinstance(s, str) else s for s in streams]
+    stream_offsets = get_stream_offsets(r) if align_clocks else {}
+
+    with tempfile.TemporaryDirectory(prefix='brand_latency_') as tmp:
+        decoded = {}
+        for stream in streams:
+            t0 = time.monotonic()
+            labels = extract_stream(r, stream, tmp, sync_key, time_key,
+                                    chunk_size, stream_offsets.get(stream),
+                                    start_id)
+            if labels is None:
+                continue
+            decoded[stream] = labels
+            logger.info(f'Read {labels.n_entries} entries from '
+                        f'{stream.decode()} in {time.monotonic() - t0:.1f} s')
+
+        report = {'streams': {}, 'edges': [], 'end_to_end': []}
+        for name, labels in decoded.items():
+            report['streams'][name.decode()] = {
+                'labels': labels.labels,
+                'entries': labels.n_entries,
+                'invalid': labels.n_invalid,
+                'duplicated': labels.n_duplicates,
+                'unsorted': labels.n_unsorted,
+            }
+            if name in stream_offsets:
+                report['streams'][name.decode()]['clock_offset_ns'] = (
+                    stream_offsets[name]['offset_ns'])
+            if any(labels.n_unsorted.values()):
+                logger.warning(f'Labels in {name.decode()} are not sorted, '
+                               'so its latencies are unreliable')
+
+        pairs = build_graph(decoded)
+        pair_set = set(pairs)
+        ups = {b: {a for a, b2 in pairs if b2 == b} for b in decoded}
+        downs = {a: {b for a2, b in pairs if a2 == a} for a in decoded}
+        for a, b in pairs:
+            direct = not any((a, c) in pair_set and (c, b) in pair_set
+                             for c in decoded if c not in (a, b))
+            source = not ups[a]
+            sink = not downs[b]
+            if not (direct or (source and sink)):
+                continue
+            # join on the upstream stream's labels, which the downstream
+            # stream carries forward
+            label = decoded[a].labels[0]
+            result = join_latency(decoded[a], decoded[b], label, chunk_size)
+            hist = result.pop('hist')
+            result.update({
+                'upstream': a.decode(),
+                'downstream': b.decode(),
+                'label': label,
+                'max_ns': hist.max,
+                'duplicated': decoded[b].n_duplicates[label],
+            })
+            for q in PERCENTILES:
+                result[f'p{q}_ns'] = hist.percentile(q)
+            if direct:
+                report['edges'].append(result)
+            if source and sink:
+                report['end_to_end'].append(result)
+
+    return report
+
+
+def format_report(report) -> str:
+    """
+    Format a latency report as a text table
+
+    Parameters
+    ----------
+    report : dict
+        Output of `analyze`
+
+    Returns
+    -------
+    str
+        Formatted report
+    """
+    columns = ['matched', 'dropped', 'duplicated', 'negative'] + [
+        f'p{q}_ns' for q in PERCENTILES
+    ] + ['max_ns']
+    lines = []
+    for section in ['edges', 'end_to_end']:
+        lines.append(f'{section}:')
+        header = f'  {"upstream -> downstream":40s}' + ''.join(
+            f'{c:>14s}' for c in columns)
+        lines.append(header)
+        for row in report[section]:
+            name = f'{row["upstream"]} -> {row["downstream"]}'
+            lines.append(f'  {name:40s}' +
+                         ''.join(f'{row[c]:>14d}' for c in columns))
+    return '\n'.join(lines)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Compute per-edge and '
+                                 'end-to-end latencies from sync labels')
+    ap.add_argument('--rdb', type=str, help='RDB file to analyze')
+    ap.add_argument('-i', '--host', type=str, default='127.0.0.1',
+                    help='ip address of the redis server')
+    ap.add_argument('-p', '--port', type=int, default=6379,
+                    help='port of the redis server')
+    ap.add_argument('-s', '--socket', type=str,
+                    help='unix socket of the redis server')
+    ap.add_argument('--sync-key', type=str, default='sync',
+                    help='field containing the sync labels')
+    ap.add_argument('--time-key', type=str, default='ts',
+                    help='field containing the monotonic time in ns')
+    ap.add_argument('--streams', type=str, nargs='+',
+                    help='streams to analyze (default: all)')
+    ap.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                    help='number of entries to process at once')
+    ap.add_argument('--start-id', type=str, default='-',
+                    help='only analyze entries from this stream ID onwards')
+    ap.add_argument('--no-align-clocks', action='store_true',
+                    help='do not map the times of streams written on other '
+                    'machines onto the supervisor clock')
+    ap.add_argument('-o', '--output', type=str,
+                    help='write the report to this JSON file')
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    proc = None
+    tmp = tempfile.TemporaryDirectory(prefix='brand_latency_redis_')
+    try:
+        if args.rdb:
+            proc, r = start_redis_from_rdb(
+                args.rdb, os.path.join(tmp.name, 'redis.sock'))
+        elif args.socket:
+            r = connect(socket_path=args.socket)
+        else:
+            r = connect(args.host, args.port)
+
+        report = analyze(r,
+                         sync_key=args.sync_key.encode(),
+                         time_key=args.time_key.encode(),
+                         streams=args.streams,
+                         chunk_size=args.chunk_size,
+                         align_clocks=not args.no_align_clocks,
+                         start_id=args.start_id)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        tmp.cleanup()
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f'Report saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,18 @@
 
 import sys
 import argparse
-from redis import Redis
 import logging
 import signal
 import json
 import time
 
+from .connection import connect, get_socket_path
+from .exceptions import ShmError
+from .perf import PerfMonitor
+from .schema import get_stream_schemas
+from .shm import SEQ_FIELD, ShmRing
+from .timing import PeriodicTimer
+
 class BRANDNode():
     def __init__(self):
 
@@ -35,9 +41,22 @@ class BRANDNode():
         # connect to Redis
         self.r = self.connectToRedis(redis_host, redis_port, redis_socket)
 
+        # timer used by run_periodic
+        self.timer = None
+
         # initialize parameters
         self.parameters = {}
+        self.parameter_count = 0
+        self.stream_schemas = {}
+        self.shm_rings = {}
+        # last sequence number read from each stream's ring
+        self.shm_seqs = {}
         self.supergraph_id = '0-0'
+        # version of the latest parameter patch applied. Patches newer than
+        # the supergraph are applied by updateParameters.
+        self.parameters_version = 0
+        self.parameters_stream = self.NAME + '_parameters'
+        self.parameters_id = '0-0'
         self.initializeParameters()
 
         # set up logging
@@ -50,6 +69,23 @@ class BRANDNode():
         logging.basicConfig(format=f'[{self.NAME}] %(levelname)s: %(message)s',
                             level=numeric_level)
 
+        # apply parameter patches published after the supergraph, once
+        # logging is set up, since applying them logs
+        self.updateParameters()
+        if self.parameters['log'] != loglevel:
+            numeric_level = getattr(logging, self.parameters['log'].upper(),
+                                    None)
+            if not isinstance(numeric_level, int):
+                raise ValueError('Invalid log level: %s' %
+                                 self.parameters['log'])
+            logging.getLogger().setLevel(numeric_level)
+
+        # set up performance instrumentation
+        self.perf = None
+        if self.parameters.get('perf_interval'):
+            self.perf = PerfMonitor(self.r, self.NAME,
+                                    self.parameters['perf_interval'])
+
         signal.signal(signal.SIGINT, self.terminate)
 
         # # initialize output stream entry data
@@ -83,18 +119,16 @@ class BRANDNode():
         #len_args = len(vars(args))
         #print("Redis arguments passed:{}".format(len_args))
 
-        try:
-            if redis_socket:
-                r = Redis(unix_socket_path=redis_socket)
-                print(f"[{self.NAME}] Redis connection established on socket:"
-                      f" {redis_socket}")
-            else:
-                r = Redis(redis_host, redis_port, retry_on_timeout=True)
-                print(f"[{self.NAME}] Redis connection established on host:"
-                      f" {redis_host}, port: {redis_port}")
-        except ConnectionError as e:
-            print(f"[{self.NAME}] Error with Redis connection, check again: {e}")
-            sys.exit(1)
+        # uses the server's unix socket if it is on this machine, even
+        # without redis_socket
+        r = connect(redis_host, redis_port, redis_socket)
+        socket_path = get_socket_path(r)
+        if socket_path:
+            print(f"[{self.NAME}] Redis connection established on socket:"
+                  f" {socket_path}")
+        else:
+            print(f"[{self.NAME}] Redis connection established on host:"
+                  f" {redis_host}, port: {redis_port}")
 
         initial_data = {
             'code':0,
@@ -138,9 +172,13 @@ class BRANDNode():
 
             model_data = json.loads(entry[1][b'data'].decode())
 
-            for node in model_data['nodes']:
-                if model_data['nodes'][node]['nickname'] == self.NAME:
-                    new_params[i] = model_data['nodes'][node]['parameters']
+            # nodes are keyed by nickname in the supergraph
+            if self.NAME in model_data['nodes']:
+                new_params[i] = model_data['nodes'][self.NAME]['parameters']
+            self.parameters_version = model_data.get('parameters_version', 0)
+
+        # stream layouts only change with a new supergraph, so build them once
+        self.stream_schemas = get_stream_schemas(model_data)
 
         return new_params
 
@@ -170,9 +208,119 @@ class BRANDNode():
 
     def run(self):
 
+        # tell the supervisor that this node is ready for data
+        self.r.xadd(self.NAME + '_state', {'code': 0, 'status': 'ready'})
+
+        period = self.get_run_period()
         while True:
+            if period:
+                # returns if run_period is cleared or invalid
+                self.run_periodic(period)
+                period = None
+            self.run_work()
+            if self.updateParameters():
+                period = self.get_run_period()
+
+    def run_work(self):
+        """
+        Call work(), recording its duration and publishing performance
+        summaries if the 'perf_interval' parameter is set
+        """
+        if self.perf is None:
             self.work()
-            self.updateParameters()
+            return
+
+        start = time.monotonic_ns()
+        self.work()
+        end = time.monotonic_ns()
+        self.perf.record_work(end - start)
+        extra = self.timer.stats() if self.timer is not None else None
+        if self.perf.publish_if_due(end, extra) and self.timer is not None:
+            self.timer.reset_stats()
+
+    def record_latency(self, input_ns, output_ns=None):
+        """
+        Record the latency between a consumed input entry and the output
+        computed from it. Does nothing unless 'perf_interval' is set.
+
+        Parameters
+        ----------
+        input_ns : int
+            Monotonic time (in nanoseconds) stored in the input entry
+        output_ns : int, optional
+            Monotonic time (in nanoseconds) stored in the output entry, by
+            default the current time
+        """
+        if self.perf is not None:
+            self.perf.record_latency(input_ns, output_ns)
+
+    def count_entries(self, n_entries=1):
+        """
+        Count processed entries for the entries/sec statistic. Does nothing
+        unless 'perf_interval' is set.
+
+        Parameters
+        ----------
+        n_entries : int, optional
+            Number of entries, by default 1
+        """
+        if self.perf is not None:
+            self.perf.count(n_entries)
+
+    def get_run_period(self):
+        """
+        Get the period at which work() should run from the 'run_period'
+        parameter
+
+        Returns
+        -------
+        float or None
+            Period in seconds, or None if work() should run continuously
+            because 'run_period' is not set, 0, or invalid
+        """
+        value = self.parameters.get('run_period')
+        if not value:
+            return None
+        try:
+            period = float(value)
+        except (TypeError, ValueError):
+            period = float('nan')
+        if not period > 0 or period == float('inf'):
+            logging.warning(f'Invalid run_period {value!r}, running work() '
+                            'continuously')
+            return None
+        return period
+
+    def run_periodic(self, period=None):
+        """
+        Run work() at the period (in seconds) given by the 'run_period'
+        parameter. Each iteration sleeps until an absolute deadline on
+        CLOCK_MONOTONIC, and overruns and jitter are recorded in self.timer.
+        Changes to 'run_period' take effect on the next iteration. Returns
+        if 'run_period' is changed to 0, None, or an invalid value.
+
+        Parameters
+        ----------
+        period : float, optional
+            Period in seconds, by default from `get_run_period`
+        """
+        if period is None:
+            period = self.get_run_period()
+            if period is None:
+                return
+        self.timer = PeriodicTimer(int(period * 1e9))
+        while True:
+            self.timer.wait()
+            self.run_work()
+            if self.updateParameters():
+                new_period = self.get_run_period()
+                if new_period is None:
+                    logging.info('run_period cleared, running work() '
+                                 'continuously')
+                    return
+                if new_period != period:
+                    period = new_period
+                    self.timer.period_ns = int(period * 1e9)
 
     def work(self):
         """
@@ -198,6 +346,150 @@ class BRANDNode():
     #     self.r.xadd(self.output_stream, self.output_entry)
 
 
+    def decode_entry(self, stream, entry):
+        """
+        Decode the fields of a stream entry according to the stream's
+        definition in the supergraph. For streams with the 'shm' transport,
+        the payload is copied from the stream's shared-memory ring.
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+        entry : dict
+            Entry data, as returned by Redis
+
+        Returns
+        -------
+        dict
+            Entry data with each typed field decoded to a read-only
+            numpy.ndarray view
+        """
+        schema = self.stream_schemas[stream]
+        if schema.transport == 'shm':
+            entry = dict(entry)
+            seq = entry.pop(SEQ_FIELD.encode())
+            entry[schema.shm_field] = self.read_shm(stream, seq)
+        return schema.decode_entry(entry)
+
+    def encode_entry(self, stream, entry):
+        """
+        Encode the fields of a stream entry according to the stream's
+        definition in the supergraph. For streams with the 'shm' transport,
+        the payload is written to the stream's shared-memory ring and the
+        entry only carries its sequence number.
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+        entry : dict
+            Entry data, with arrays for each typed field
+
+        Returns
+        -------
+        dict
+            Entry data that can be passed to XADD
+        """
+        schema = self.stream_schemas[stream]
+        out = schema.encode_entry(entry)
+        if schema.transport == 'shm':
+            field = schema.shm_field
+            payload = out.pop(field if field in out else field.decode())
+            ring = self.get_shm_ring(stream, create=True)
+            out[SEQ_FIELD] = ring.write(payload)
+        return out
+
+    def xadd(self, stream, entry):
+        """
+        Add an entry to a stream, trimming the stream according to its
+        retention policy in the supergraph (see StreamSchema.trim_args)
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+        entry : dict
+            Entry data that can be passed to XADD, e.g. from `encode_entry`
+
+        Returns
+        -------
+        bytes
+            ID of the new entry
+        """
+        schema = self.stream_schemas.get(stream)
+        trim_args = schema.trim_args() if schema is not None else []
+        if not trim_args:
+            return self.r.xadd(stream, entry)
+        pieces = [item for pair in entry.items() for item in pair]
+        return self.r.execute_command('XADD', stream, *trim_args, '*',
+                                      *pieces)
+
+    def read_shm(self, stream, seq):
+        """
+        Copy a payload from the shared-memory ring of a stream. If the
+        producer was restarted, its sequence numbers start over in a new
+        ring, so the ring is reopened when the sequence number goes
+        backwards or a read fails after the ring was replaced.
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+        seq : int or bytes
+            Sequence number from the entry's shm_seq field
+
+        Returns
+        -------
+        bytes
+            Payload
+        """
+        seq = int(seq)
+        last_seq = self.shm_seqs.get(stream)
+        ring = self.get_shm_ring(
+            stream, check_replaced=last_seq is not None and seq <= last_seq)
+        try:
+            data = ring.read(seq)
+        except ShmError:
+            if not ring.is_replaced():
+                raise
+            data = self.get_shm_ring(stream, check_replaced=True).read(seq)
+        self.shm_seqs[stream] = seq
+        return data
+
+    def get_shm_ring(self, stream, create=False, check_replaced=False):
+        """
+        Get the shared-memory ring of a stream, opening it on first use
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+        create : bool, optional
+            Create the ring if this node has not opened it yet. Only the
+            node that produces the stream should create its ring.
+        check_replaced : bool, optional
+            Reopen the ring if the producer replaced it with a new one since
+            it was opened (see ShmRing.is_replaced)
+
+        Returns
+        -------
+        ShmRing
+            The stream's ring
+        """
+        ring = self.shm_rings.get(stream)
+        if ring is not None and check_replaced and ring.is_replaced():
+            logging.info(f'Reopening the shared-memory ring of {stream}')
+            ring.close()
+            del self.shm_rings[stream]
+        if stream not in self.shm_rings:
+            schema = self.stream_schemas[stream]
+            self.shm_rings[stream] = ShmRing(stream,
+                                             n_slots=schema.shm_slots,
+                                             slot_bytes=schema.shm_slot_bytes,
+                                             create=create)
+        return self.shm_rings[stream]
+
     def updateParameters(self):
         """
         This function reads from the nickname_parameters stream, 
@@ -207,11 +499,42 @@ class BRANDNode():
         it assumes that the new value is meaningful (since it should have been checked
         by the supervisor node) and then updates the parameters = {} value
         If this function updates the parameters{} dictionary, then it increments parameter_count
+
+        Returns
+        -------
+        updated : bool
+            True if new parameters were applied
         """
-        pass
+        replies = self.r.xread({self.parameters_stream: self.parameters_id})
+        if not replies:
+            return False
+
+        entries = replies[0][1]
+        self.parameters_id = entries[-1][0]
+
+        # apply all new patches to a copy, then swap it in at once. Patches
+        # that are already in the supergraph we read are skipped.
+        new_parameters = dict(self.parameters)
+        updated = False
+        for _, entry in entries:
+            version = int(entry.get(b'version', 0))
+            if version and version <= self.parameters_version:
+                continue
+            new_parameters.update(json.loads(entry[b'data']))
+            self.parameters_version = max(self.parameters_version, version)
+            updated = True
+        if not updated:
+            return False
+        self.parameters = new_parameters
+        self.parameter_count += 1
+
+        logging.info(f'Parameters updated (count: {self.parameter_count})')
+        return True
 
     def terminate(self, sig, frame):
         logging.info('SIGINT received, Exiting')
+        if self.timer is not None:
+            logging.info(f'Loop timing: {self.timer.stats()}')
         self.r.close()
         #self.sock.close()
         sys.exit(0)
@@ -0,0 +1,281 @@
+"""
+Performance instrumentation for BRAND nodes. Durations are accumulated in
+log-spaced histograms, and compact summaries are published to a
+<nickname>_perf stream at a fixed interval. The same histogram layout is
+used by the C helpers in brand.c.
+"""
+import time
+
+import numpy as np
+
+# each power of two is split into this many linearly spaced bins
+BINS_PER_OCTAVE = 8
+# histograms cover durations up to 2**40 ns (about 18 minutes)
+N_BINS = 40 * BINS_PER_OCTAVE
+
+_msb = np.arange(N_BINS) // BINS_PER_OCTAVE
+_frac = np.arange(N_BINS) % BINS_PER_OCTAVE
+# upper edge of each bin, in nanoseconds
+BIN_EDGES = (BINS_PER_OCTAVE + _frac + 1) * 2.0**_msb / BINS_PER_OCTAVE
+
+
+def bin_index(value) -> int:
+    """
+    Get the histogram bin for a duration
+
+    Parameters
+    ----------
+    value : int
+        Duration in nanoseconds
+
+    Returns
+    -------
+    int
+        Index of the histogram bin
+    """
+    value = int(value)
+    if value < 1:
+        return 0
+    msb = value.bit_length() - 1
+    if msb >= 3:
+        frac = (value >> (msb - 3)) & 7
+    else:
+        frac = (value << (3 - msb)) & 7
+    return min(msb * BINS_PER_OCTAVE + frac, N_BINS - 1)
+
+
+def bin_indices(values) -> np.ndarray:
+    """
+    Get the histogram bins for an array of durations. Equivalent to calling
+    `bin_index` on each value.
+
+    Parameters
+    ----------
+    values : array_like
+        Durations in nanoseconds
+
+    Returns
+    -------
+    numpy.ndarray
+        Index of the histogram bin for each value
+    """
+    values = np.maximum(np.asarray(values, dtype=np.float64), 1)
+    mantissa, exponent = np.frexp(values)
+    frac = np.floor(mantissa * 2 * BINS_PER_OCTAVE - BINS_PER_OCTAVE)
+    bins = (exponent - 1) * BINS_PER_OCTAVE + frac.astype(np.int64)
+    return np.minimum(bins, N_BINS - 1)
+
+
+class Histogram():
+    """
+    Log-spaced histogram of durations in nanoseconds
+
+    Attributes
+    ----------
+    counts : numpy.ndarray
+        Number of values recorded in each bin
+    count : int
+        Total number of values recorded
+    max : int
+        Largest value recorded
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(N_BINS, dtype=np.uint64)
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all recorded values
+        """
+        self.counts[:] = 0
+        self.count = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        Record a duration
+
+        Parameters
+        ----------
+        value : int
+            Duration in nanoseconds
+        """
+        self.counts[bin_index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values):
+        """
+        Record an array of durations
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Durations in nanoseconds
+        """
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(bin_indices(values),
+                                   minlength=N_BINS).astype(np.uint64)
+        self.count += len(values)
+        self.max = max(self.max, int(np.max(values)))
+
+    def percentile(self, q) -> int:
+        """
+        Estimate a percentile of the recorded values
+
+        Parameters
+        ----------
+        q : float
+            Percentile to compute, between 0 and 100
+
+        Returns
+        -------
+        int
+            Upper edge of the bin containing the percentile (in nanoseconds),
+            or 0 if no values were recorded
+        """
+        if self.count == 0:
+            return 0
+        rank = np.ceil(q / 100 * self.count)
+        i_bin = np.searchsorted(np.cumsum(self.counts), max(rank, 1))
+        return int(min(BIN_EDGES[i_bin], self.max))
+
+
+class PerfMonitor():
+    """
+    Records work() durations, input-to-output latencies, and entry counts
+    for a node, and publishes summaries to the <nickname>_perf stream
+
+    Attributes
+    ----------
+    work : Histogram
+        Durations of work() calls
+    latency : Histogram
+        Latencies between consumed input entries and the resulting outputs
+    n_entries : int
+        Number of entries processed since the last summary
+    """
+
+    def __init__(self, r, nickname, interval=1.0):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        nickname : str
+            Nickname of the node
+        interval : float, optional
+            Time between summaries in seconds, by default 1.0
+        """
+        self.r = r
+        self.stream = nickname + '_perf'
+        self.interval_ns = int(interval * 1e9)
+
+        self.work = Histogram()
+        self.latency = Histogram()
+        self.n_entries = 0
+        self.last_publish_ns = time.monotonic_ns()
+
+    def record_work(self, duration_ns):
+        """
+        Record the duration of a work() call
+
+        Parameters
+        ----------
+        duration_ns : int
+            Duration in nanoseconds
+        """
+        self.work.record(duration_ns)
+
+    def record_latency(self, input_ns, output_ns=None):
+        """
+        Record the latency between an input entry and the output computed
+        from it
+
+        Parameters
+        ----------
+        input_ns : int
+            Monotonic time (in nanoseconds) stored in the consumed input
+            entry
+        output_ns : int, optional
+            Monotonic time (in nanoseconds) of the output, by default the
+            current time
+        """
+        if output_ns is None:
+            output_ns = time.monotonic_ns()
+        self.latency.record(output_ns - input_ns)
+
+    def count(self, n_entries=1):
+        """
+        Count processed entries
+
+        Parameters
+        ----------
+        n_entries : int, optional
+            Number of entries, by default 1
+        """
+        self.n_entries += n_entries
+
+    def summary(self, elapsed_ns) -> dict:
+        """
+        Summarize the values recorded since the last summary
+
+        Parameters
+        ----------
+        elapsed_ns : int
+            Time covered by the summary, in nanoseconds
+
+        Returns
+        -------
+        dict
+            Summary statistics, in nanoseconds and entries per second
+        """
+        return {
+            'interval_ns': elapsed_ns,
+            'iterations': self.work.count,
+            'work_p50_ns': self.work.percentile(50),
+            'work_p99_ns': self.work.percentile(99),
+            'work_max_ns': self.work.max,
+            'latency_count': self.latency.count,
+            'latency_p50_ns': self.latency.percentile(50),
+            'latency_p99_ns': self.latency.percentile(99),
+            'latency_max_ns': self.latency.max,
+            'entries_per_sec': self.n_entries * 1e9 / max(elapsed_ns, 1),
+        }
+
+    def publish_if_due(self, now_ns=None, extra=None) -> bool:
+        """
+        Publish a summary to the <nickname>_perf stream if the interval has
+        elapsed, then reset the statistics
+
+        Parameters
+        ----------
+        now_ns : int, optional
+            Current monotonic time in nanoseconds
+        extra : dict, optional
+            Additional fields to include in the summary
+
+        Returns
+        -------
+        bool
+            True if a summary was published
+        """
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        elapsed_ns = now_ns - self.last_publish_ns
+        if elapsed_ns < self.interval_ns:
+            return False
+
+        summary = self.summary(elapsed_ns)
+        if extra:
+            summary.update(extra)
+        self.r.xadd(self.stream, summary)
+
+        self.work.reset()
+        self.latency.reset()
+        self.n_entries = 0
+        self.last_publish_ns = now_ns
+        return True
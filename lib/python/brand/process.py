@@ -0,0 +1,312 @@
+"""
+Helpers shared by Supervisor and Booter for starting, monitoring, and
+stopping node processes
+"""
+import logging
+import os
+import signal
+import time
+
+from .exceptions import NodeError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STARTUP_TIMEOUT = 10  # seconds
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def get_launch_waves(nodes) -> list:
+    """
+    Group nodes into waves that should be launched in order. Consumers are
+    launched before the producers of their input streams, so no node misses
+    the first samples of its inputs. Streams are read from the optional
+    'redis_inputs' and 'redis_outputs' keys of each node. Nodes in a
+    dependency cycle, or without declared streams, go in the first wave.
+
+    Parameters
+    ----------
+    nodes : dict
+        Node nicknames mapped to their configuration in the supergraph
+
+    Returns
+    -------
+    waves : list of list
+        Node nicknames in each wave, in launch order
+    """
+    producers = {}
+    for nickname, cfg in nodes.items():
+        for stream in _as_list(cfg.get('redis_outputs')):
+            producers.setdefault(stream, set()).add(nickname)
+
+    # downstream nodes of each node
+    consumers = {nickname: set() for nickname in nodes}
+    for nickname, cfg in nodes.items():
+        for stream in _as_list(cfg.get('redis_inputs')):
+            for producer in producers.get(stream, ()):
+                if producer != nickname:
+                    consumers[producer].add(nickname)
+
+    # a node's wave is the length of the longest path to a sink
+    wave = {}
+
+    def get_wave(nickname, path):
+        if nickname in wave:
+            return wave[nickname]
+        if nickname in path:  # cycle
+            return 0
+        path.add(nickname)
+        level = max((get_wave(c, path) + 1 for c in consumers[nickname]),
+                    default=0)
+        path.discard(nickname)
+        wave[nickname] = level
+        return level
+
+    for nickname in nodes:
+        get_wave(nickname, set())
+
+    n_waves = max(wave.values(), default=-1) + 1
+    return [[n for n in nodes if wave[n] == i] for i in range(n_waves)]
+
+
+def parse_node_state(entry) -> str:
+    """
+    Get the state reported in a <nickname>_state entry. C nodes write a
+    'state' field (see emit_status in brand.c), and Python nodes write a
+    'status' field.
+
+    Parameters
+    ----------
+    entry : dict
+        Entry data from a <nickname>_state stream
+
+    Returns
+    -------
+    str
+        Lower-case state, e.g. 'ready' or 'fatal error: <message>'
+    """
+    value = entry.get(b'state', entry.get(b'status', b''))
+    return value.decode('utf-8').strip('"').lower()
+
+
+def reports_ready(binary) -> bool:
+    """
+    Guess whether a node reports 'ready' on its <nickname>_state stream.
+    Python nodes built on BRANDNode do so in BRANDNode.run. C nodes, and
+    executables that cannot be read on this machine, are assumed not to.
+
+    Parameters
+    ----------
+    binary : str
+        Path to the node executable
+
+    Returns
+    -------
+    bool
+        True if the executable is a Python script that uses BRANDNode
+    """
+    try:
+        with open(binary, 'rb') as f:
+            head = f.read(1 << 16)
+    except OSError:
+        return False
+    return (head.startswith(b'#!') and b'python' in head.split(b'\n', 1)[0]
+            and b'BRANDNode' in head)
+
+
+def redis_time_id(r) -> str:
+    """
+    Get a stream ID for the current time on the Redis server. Reading from
+    this ID returns only entries added after this call.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+
+    Returns
+    -------
+    str
+        Stream ID
+    """
+    sec, usec = r.time()
+    return f'{sec * 1000 + usec // 1000}-0'
+
+
+def wait_for_nodes_ready(r, nicknames, start_id, timeout, graph=''):
+    """
+    Wait until all nodes report that they are ready on their <nickname>_state
+    streams, using a single multi-stream XREAD per iteration
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+    nicknames : list
+        Nicknames of the nodes to wait for
+    start_id : str
+        Only consider state entries after this ID (e.g. from `redis_time_id`
+        before the nodes were launched)
+    timeout : float
+        Maximum time to wait, in seconds
+    graph : str, optional
+        Name of the graph, used in error messages
+
+    Returns
+    -------
+    ready : dict
+        Nicknames of the nodes that became ready, mapped to the time (from
+        time.monotonic) at which their ready state was received
+
+    Raises
+    ------
+    NodeError
+        If a node reports a fatal error
+    """
+    deadline = time.monotonic() + timeout
+    last_ids = {f'{nickname}_state': start_id for nickname in nicknames}
+    ready = {}
+    while last_ids:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        replies = r.xread(last_ids, block=remaining_ms)
+        now = time.monotonic()
+        for stream, entries in replies:
+            stream = stream.decode('utf-8')
+            nickname = stream[:-len('_state')]
+            last_ids[stream] = entries[-1][0]
+            for _, entry in entries:
+                state = parse_node_state(entry)
+                if state.startswith('fatal error'):
+                    raise NodeError(
+                        f'{nickname} reported an error during startup: '
+                        f'{state}', graph, nickname)
+                if state == 'ready':
+                    ready[nickname] = now
+                    del last_ids[stream]
+                    break
+    return ready
+
+
+def get_cpu_time(pid) -> float:
+    """
+    Get the CPU time used by a process, from /proc/<pid>/stat
+
+    Parameters
+    ----------
+    pid : int
+        Process ID
+
+    Returns
+    -------
+    float
+        User plus system CPU time of all of the process's threads, in
+        seconds, or None if the process does not exist
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            stat = f.read()
+    except FileNotFoundError:
+        return None
+    # the command name can contain spaces, so split after it
+    fields = stat[stat.rindex(')') + 2:].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / os.sysconf('SC_CLK_TCK')
+
+
+def _wait_for_exit(procs, deadline, t_start, exit_times, poll_interval):
+    """
+    Poll processes until they all exit or the deadline passes. Returns the
+    processes that are still running.
+    """
+    running = dict(procs)
+    while running:
+        for node, proc in list(running.items()):
+            if proc.poll() is not None:
+                exit_times[node] = time.monotonic() - t_start
+                del running[node]
+        if not running:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(poll_interval, remaining))
+    return running
+
+
+def stop_processes(children,
+                   logger=logger,
+                   timeout=15,
+                   kill_timeout=15,
+                   poll_interval=0.01):
+    """
+    Stop node processes concurrently. SIGINT is sent to all processes at
+    once, and they are waited on together with a shared deadline. Processes
+    that are still running after `timeout` are sent SIGKILL as a group.
+
+    Parameters
+    ----------
+    children : dict
+        Node nicknames mapped to their subprocess.Popen objects
+    logger : logging.Logger, optional
+        Logger used to report the outcome for each node
+    timeout : float, optional
+        Time to wait after SIGINT, in seconds, by default 15
+    kill_timeout : float, optional
+        Time to wait after SIGKILL, in seconds, by default 15
+    poll_interval : float, optional
+        Time between checks for exited processes, in seconds
+
+    Returns
+    -------
+    running : dict
+        Nodes that could not be stopped, mapped to their Popen objects
+    exit_times : dict
+        Nodes that were stopped, mapped to the time (in seconds) between
+        sending SIGINT and detecting their exit
+    """
+    exit_times = {}
+    signaled = {}
+    t_start = time.monotonic()
+    for node, proc in children.items():
+        if proc.poll() is not None:
+            logger.warning(f"'{node}' (pid: {proc.pid})"
+                           " isn't running and may have crashed")
+            continue
+        try:
+            proc.send_signal(signal.SIGINT)
+        except ProcessLookupError:
+            pass  # exited after poll(), reaped below
+        signaled[node] = proc
+
+    running = _wait_for_exit(signaled, t_start + timeout, t_start,
+                             exit_times, poll_interval)
+    for node in signaled:
+        if node in exit_times:
+            logger.info(f"Stopped '{node}' (pid: {signaled[node].pid}) "
+                        f"using SIGINT in {exit_times[node]:.3f} s")
+
+    if running:
+        for node, proc in running.items():
+            logger.warning(f"Could not stop '{node}' (pid: {proc.pid}) "
+                           "using SIGINT")
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        killed = running
+        running = _wait_for_exit(killed, time.monotonic() + kill_timeout,
+                                 t_start, exit_times, poll_interval)
+        for node, proc in killed.items():
+            if node not in running:
+                logger.info(f"Killed '{node}' (pid: {proc.pid}) using "
+                            f"SIGKILL after {exit_times[node]:.3f} s")
+
+    return running, exit_times
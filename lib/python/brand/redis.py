@@ -1,6 +1,26 @@
 import numpy as np
 
 
+def parse_stream_id(entry_id) -> tuple:
+    """
+    Parse a stream entry ID so that IDs can be compared
+
+    Parameters
+    ----------
+    entry_id : str or bytes
+        Entry ID, e.g. '1650000000000-0'
+
+    Returns
+    -------
+    tuple
+        (milliseconds, sequence number)
+    """
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
 def xread_count(r, stream, count, startid=0, block=None) -> list:
     """
     Block and read multiple entries from a single stream
@@ -22,6 +42,10 @@ def xread_count(r, stream, count, startid=0, block=None) -> list:
     -------
     out : list
         List of entries for each stream
+
+    See Also
+    --------
+    StreamReader : persistent reader that decodes into a ring buffer
     """
     entry_id = startid
     n_samples = count
@@ -41,6 +65,38 @@ def xread_count(r, stream, count, startid=0, block=None) -> list:
     return out
 
 
+def xdel_after(r, stream, start_id, count=1000) -> int:
+    """
+    Delete the entries of a stream from an ID onwards, e.g. to discard data
+    written during a test
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+    stream : bytes
+        Name of the stream
+    start_id : str or bytes
+        ID of the first entry to delete
+    count : int, optional
+        Number of entries deleted per XDEL, by default 1000
+
+    Returns
+    -------
+    int
+        Number of deleted entries
+    """
+    n_deleted = 0
+    while True:
+        entries = r.xrange(stream, start_id, '+', count=count)
+        if not entries:
+            break
+        n_deleted += r.xdel(stream, *[entry_id for entry_id, _ in entries])
+        if len(entries) < count:
+            break
+    return n_deleted
+
+
 def xread_sync(self,
                streams,
                sync_field,
@@ -66,6 +122,10 @@ def xread_sync(self,
     -------
     out : list
         List of entries for each stream
+
+    See Also
+    --------
+    SyncReader : batched reader that avoids one round-trip per sample
     """
     # Data type of the sync field
     dtype = np.dtype(sync_dtype)
@@ -119,3 +179,329 @@ def xread_sync(self,
             out[i_s][1][i_c] = (entry_ids[i_s], entry_data[i_s])
 
     return out  # Return the synchronized output
+
+
+class SyncReader():
+    """
+    Read and sync entries from multiple streams in batches. This is a
+    batched alternative to `xread_sync`: each call to `read` issues a single
+    XREAD for all streams, decodes the sync field of the whole batch at once,
+    and aligns the streams with a merge-join on the sync values. Entries that
+    could still be matched by future data are buffered for the next call.
+
+    Attributes
+    ----------
+    stream_names : list
+        Names of the streams being synchronized
+    entry_ids : list
+        Last ID read from each stream
+    n_dropped : list
+        Number of unmatched entries dropped from each stream's buffer
+        because it exceeded `max_buffer`
+    """
+
+    def __init__(self,
+                 r,
+                 streams,
+                 sync_field,
+                 sync_dtype='uint32',
+                 count=1000,
+                 block=None,
+                 max_buffer=None):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        streams : dict
+            dict of stream names to stream IDs, where IDs indicate the last ID
+            already seen.
+        sync_field : bytes
+            Field in each stream containing a value that should match in the
+            synchronized data. Values must increase monotonically within each
+            stream.
+        sync_dtype : str, optional
+            Data type of the sync field, by default 'uint32'
+        count : int, optional
+            Maximum number of entries to read from each stream per XREAD, by
+            default 1000
+        block : int, optional
+            Number of milliseconds to wait in each XREAD call, by default None
+        max_buffer : int, optional
+            Maximum number of unmatched entries buffered for each stream.
+            If a stream stalls, the oldest unmatched entries of the other
+            streams are dropped beyond this length. By default 10 * count.
+        """
+        self.r = r
+        self.sync_field = sync_field
+        self.dtype = np.dtype(sync_dtype)
+        self.count = count
+        self.block = block
+        self.max_buffer = 10 * count if max_buffer is None else max_buffer
+
+        self.stream_names = list(streams)
+        self.entry_ids = [streams[name] for name in self.stream_names]
+        self.n_streams = len(self.stream_names)
+        # map the stream names returned by Redis to their index
+        self._index = {
+            name.encode() if isinstance(name, str) else name: i
+            for i, name in enumerate(self.stream_names)
+        }
+
+        # entries that have been read but not yet matched
+        self._entries = [[] for _ in range(self.n_streams)]
+        self._sync = [np.empty(0, dtype=self.dtype)] * self.n_streams
+        self.n_dropped = [0] * self.n_streams
+
+    def _fetch(self):
+        """
+        Read a batch of new entries from all streams with a single XREAD
+
+        Returns
+        -------
+        bool
+            True if any new entries were received
+        """
+        replies = self.r.xread(dict(zip(self.stream_names, self.entry_ids)),
+                               count=self.count,
+                               block=self.block)
+        itemsize = self.dtype.itemsize
+        for name, entries in replies:
+            # names are str if the client uses decode_responses=True
+            i_s = self._index[name.encode() if isinstance(name, str) else name]
+            self.entry_ids[i_s] = entries[-1][0]
+            sync_bytes = b''.join(
+                [data[self.sync_field][:itemsize] for _, data in entries])
+            self._entries[i_s] += entries
+            self._sync[i_s] = np.concatenate(
+                (self._sync[i_s], np.frombuffer(sync_bytes, dtype=self.dtype)))
+        return len(replies) > 0
+
+    def _match(self) -> list:
+        """
+        Merge-join the buffered entries on their sync values and drop
+        entries that can no longer be matched
+
+        Returns
+        -------
+        out : list
+            List of matched entries for each stream
+        """
+        out = [[name, []] for name in self.stream_names]
+        if not all(len(sync) for sync in self._sync):
+            self._limit()
+            return out
+
+        common = self._sync[0]
+        for sync in self._sync[1:]:
+            common = np.intersect1d(common, sync)
+
+        cut = [0] * self.n_streams
+        if len(common):
+            for i_s in range(self.n_streams):
+                idx = np.searchsorted(self._sync[i_s], common)
+                entries = self._entries[i_s]
+                out[i_s][1] = [entries[i] for i in idx]
+                cut[i_s] = np.searchsorted(self._sync[i_s],
+                                           common[-1],
+                                           side='right')
+
+        # values below the first remaining value of any stream can no longer
+        # be matched, since sync values increase monotonically
+        remaining = [
+            sync[c] for sync, c in zip(self._sync, cut) if c < len(sync)
+        ]
+        floor = max(remaining) if remaining else None
+        for i_s in range(self.n_streams):
+            if floor is not None:
+                cut[i_s] = max(
+                    cut[i_s],
+                    np.searchsorted(self._sync[i_s], floor, side='left'))
+            self._entries[i_s] = self._entries[i_s][cut[i_s]:]
+            self._sync[i_s] = self._sync[i_s][cut[i_s]:]
+        self._limit()
+
+        return out
+
+    def _limit(self):
+        """
+        Drop the oldest unmatched entries of streams whose buffer is longer
+        than `max_buffer`, e.g. while another stream is stalled
+        """
+        for i_s in range(self.n_streams):
+            excess = len(self._entries[i_s]) - self.max_buffer
+            if excess > 0:
+                self._entries[i_s] = self._entries[i_s][excess:]
+                self._sync[i_s] = self._sync[i_s][excess:]
+                self.n_dropped[i_s] += excess
+
+    def read(self) -> list:
+        """
+        Read new entries from all streams and return the ones whose sync
+        values match across all streams. Reads are repeated until at least
+        one match is found or XREAD returns no new entries.
+
+        Returns
+        -------
+        out : list
+            List of synchronized entries for each stream, in the same format
+            as `xread_sync`
+        """
+        while True:
+            received = self._fetch()
+            out = self._match()
+            if out[0][1] or not received:
+                return out
+
+
+class StreamReader():
+    """
+    Persistent reader for a single stream that decodes a binary field of
+    each entry into a preallocated NumPy ring buffer. The buffer is stored
+    twice back-to-back so that the most recent samples are always available
+    as a contiguous view, without copying.
+
+    Attributes
+    ----------
+    last_id : bytes or str
+        Last ID read from the stream
+    n_total : int
+        Total number of samples written to the buffer since initialization
+    n_new : int
+        Number of samples written by the most recent call to `read`
+    """
+
+    def __init__(self,
+                 r,
+                 stream,
+                 field,
+                 dtype,
+                 n_channels,
+                 capacity,
+                 startid=0,
+                 count=1000,
+                 block=None):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        stream : bytes
+            Name of the stream
+        field : bytes
+            Field in each entry containing the binary payload. The payload
+            must hold one or more samples of `n_channels` values each, stored
+            sample by sample.
+        dtype : str or numpy.dtype
+            Data type of the payload
+        n_channels : int
+            Number of channels in each sample
+        capacity : int
+            Number of samples held in the ring buffer
+        startid : int, optional
+            The starting ID to be used for XREAD. This ID indicates the last
+            ID already seen.
+        count : int, optional
+            Maximum number of entries to request per XREAD, by default 1000
+        block : int, optional
+            Number of milliseconds to wait in each XREAD call, by default None
+        """
+        self.r = r
+        self.stream = stream
+        self.field = field
+        self.dtype = np.dtype(dtype)
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.count = count
+        self.block = block
+
+        self.last_id = startid
+        self.n_total = 0
+        self.n_new = 0
+
+        self._buffer = np.zeros((2 * capacity, n_channels), dtype=self.dtype)
+        self._write_index = 0
+
+    def _write(self, data):
+        """
+        Copy samples into the ring buffer
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            Samples to write, with shape (n_samples, n_channels)
+        """
+        n_samples = data.shape[0]
+        cap = self.capacity
+        if n_samples > cap:
+            # only the most recent samples fit in the buffer
+            self._write_index = (self._write_index + n_samples - cap) % cap
+            data = data[-cap:]
+        i_w = self._write_index
+        n_first = min(data.shape[0], cap - i_w)
+        n_rest = data.shape[0] - n_first
+        self._buffer[i_w:i_w + n_first] = data[:n_first]
+        self._buffer[cap + i_w:cap + i_w + n_first] = data[:n_first]
+        if n_rest:
+            self._buffer[:n_rest] = data[n_first:]
+            self._buffer[cap:cap + n_rest] = data[n_first:]
+        self._write_index = (i_w + data.shape[0]) % cap
+        self.n_total += n_samples
+
+    def read(self, n_samples=None) -> int:
+        """
+        Read new entries from the stream into the ring buffer
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            Keep reading until at least this many new samples have arrived.
+            By default, return after a single XREAD. If `block` is None,
+            each XREAD then blocks until new entries arrive, so the loop
+            does not spin while waiting.
+
+        Returns
+        -------
+        n_new : int
+            Number of new samples written to the buffer
+        """
+        self.n_new = 0
+        block = self.block
+        if n_samples is not None and block is None:
+            block = 0  # wait indefinitely
+        while True:
+            replies = self.r.xread({self.stream: self.last_id},
+                                   count=self.count,
+                                   block=block)
+            if replies:
+                entries = replies[0][1]
+                self.last_id = entries[-1][0]
+                payload = b''.join([data[self.field] for _, data in entries])
+                data = np.frombuffer(payload, dtype=self.dtype).reshape(
+                    -1, self.n_channels)
+                self._write(data)
+                self.n_new += data.shape[0]
+            if n_samples is None or self.n_new >= n_samples:
+                return self.n_new
+
+    def latest(self, n_samples=None) -> np.ndarray:
+        """
+        Get a view of the most recent samples in the buffer. The view is
+        only valid until the next call to `read`.
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            Number of samples to return, by default the samples written by
+            the most recent call to `read`
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n_samples, n_channels), oldest sample first
+        """
+        if n_samples is None:
+            n_samples = self.n_new
+        n_samples = min(n_samples, self.capacity, self.n_total)
+        end = self._write_index + self.capacity
+        return self._buffer[end - n_samples:end]
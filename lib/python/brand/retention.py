@@ -0,0 +1,187 @@
+"""
+Central enforcement of stream retention policies. Nodes trim their output
+streams on XADD (see BRANDNode.xadd and xadd_with_retention in brand.c),
+but nodes that do not use these helpers, and streams with both a maxlen and
+a window, are trimmed here by a background thread in the supervisor.
+Streams with persist_then_trim are trimmed by the Checkpointer instead,
+after their entries are written to disk.
+
+A stream whose trim fails is reported once on supervisor_status and then
+skipped for a backoff time that doubles after each failure, up to
+MAX_BACKOFF. Its recovery is also reported.
+"""
+import logging
+import threading
+import time
+
+import redis
+
+from .schema import window_min_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_INTERVAL = 1  # seconds
+# maximum seconds between retries of a stream whose trim fails
+MAX_BACKOFF = 60
+# first Redis version with XTRIM MINID, used by window retention policies
+MINID_VERSION = (6, 2)
+
+
+def get_redis_version(r) -> tuple:
+    """
+    Get the version of a Redis server
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+
+    Returns
+    -------
+    tuple
+        Version numbers, e.g. (6, 2, 6)
+    """
+    version = r.info('server')['redis_version']
+    return tuple(int(part) for part in str(version).split('.'))
+
+
+class StreamTrimmer():
+    """
+    Background thread that trims streams according to their retention
+    policies
+
+    Attributes
+    ----------
+    schemas : dict
+        Stream names mapped to StreamSchema instances with a maxlen or
+        window
+    """
+
+    def __init__(self, r, schemas, interval=DEFAULT_RETENTION_INTERVAL):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        schemas : dict
+            Stream names mapped to StreamSchema instances, e.g. from
+            `get_stream_schemas`. Streams without a maxlen or window are
+            ignored.
+        interval : float, optional
+            Time between trims in seconds, by default 1
+        """
+        self.r = r
+        self.schemas = {
+            name: schema
+            for name, schema in schemas.items() if schema.is_bounded()
+        }
+        self.interval = interval
+        # streams whose trim failed, mapped to (number of consecutive
+        # failures, time.monotonic() of the next attempt)
+        self.failures = {}
+        self._failed = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def trim(self) -> int:
+        """
+        Trim all streams once, except streams that are backing off after
+        a failed trim. Trimming is approximate (~), so Redis only removes
+        whole macro nodes and streams may keep a few more entries than
+        their policy allows.
+
+        Returns
+        -------
+        int
+            Number of entries removed
+        """
+        now = time.monotonic()
+        names = [
+            name for name in self.schemas
+            if self.failures.get(name, (0, now))[1] <= now
+        ]
+        if not names:
+            return 0
+        sec, usec = self.r.time()
+        now_ms = sec * 1000 + usec // 1000
+        p = self.r.pipeline(transaction=False)
+        commands = []
+        for name in names:
+            schema = self.schemas[name]
+            if schema.maxlen is not None:
+                p.execute_command('XTRIM', name, 'MAXLEN', '~', schema.maxlen)
+                commands.append(name)
+            if schema.window is not None:
+                p.execute_command('XTRIM', name, 'MINID', '~',
+                                  window_min_id(now_ms, schema.window))
+                commands.append(name)
+        n_removed = 0
+        errors = {}
+        for name, result in zip(commands,
+                                p.execute(raise_on_error=False)):
+            if isinstance(result, Exception):
+                errors[name] = result
+            else:
+                n_removed += result
+        for name in names:
+            if name in errors:
+                self._stream_failed(name, errors[name])
+            elif self.failures.pop(name, None) is not None:
+                self._report(f'Trimming {name} recovered')
+        return n_removed
+
+    def _stream_failed(self, name, exc):
+        n_failures = self.failures.get(name, (0, 0))[0] + 1
+        backoff = min(self.interval * 2**n_failures, MAX_BACKOFF)
+        self.failures[name] = (n_failures, time.monotonic() + backoff)
+        if n_failures == 1:
+            logger.error(f'Trimming {name} failed, retrying with backoff: '
+                         f'{repr(exc)}')
+            self._report(f'Trimming {name} failed', repr(exc))
+
+    def _report(self, status, message=''):
+        # reporting must not stop the thread, e.g. if Redis is unreachable
+        try:
+            self.r.xadd('supervisor_status', {
+                'status': status,
+                'message': message
+            })
+        except redis.exceptions.RedisError as exc:
+            logger.warning(f"Could not report '{status}': {repr(exc)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                n_removed = self.trim()
+            except Exception as exc:
+                # only report the first of a run of failures
+                if not self._failed:
+                    logger.exception(f'Trimming streams failed: {repr(exc)}')
+                    self._report('Trimming streams failed', repr(exc))
+                self._failed = True
+                continue
+            self._failed = False
+            if n_removed:
+                logger.debug(f'Trimmed {n_removed} entries')
+
+    def start(self):
+        """
+        Start trimming in a background thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='trimmer',
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f'Trimming {len(self.schemas)} streams every '
+                    f'{self.interval} s')
+
+    def stop(self):
+        """
+        Stop the background thread
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
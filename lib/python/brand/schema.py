@@ -0,0 +1,359 @@
+"""
+Stream schemas describe the binary layout of the fields in each Redis
+stream of a graph, so that nodes can decode and encode entries without
+hand-written struct packing
+"""
+import time
+
+import numpy as np
+
+# aliases for C type names and legacy sample_type values used in graph files
+SAMPLE_TYPE_ALIASES = {
+    'char': 'int8',
+    'short': 'int16',
+    'int': 'int32',
+    'Int': 'int32',
+    'uInt': 'uint32',
+    'uInt32': 'uint32',
+    'float': 'float32',
+    'double': 'float64',
+}
+
+
+def get_dtype(sample_type) -> np.dtype:
+    """
+    Get the NumPy data type for a sample_type value from a graph
+
+    Parameters
+    ----------
+    sample_type : str
+        Name of the data type. Can be any NumPy dtype name (e.g. 'float32',
+        'uint64') or one of the C type names in SAMPLE_TYPE_ALIASES.
+
+    Returns
+    -------
+    numpy.dtype
+        Data type of the samples
+    """
+    return np.dtype(SAMPLE_TYPE_ALIASES.get(sample_type, sample_type))
+
+
+class StreamSchema():
+    """
+    Binary layout of the fields in a stream
+
+    Attributes
+    ----------
+    name : str
+        Name of the stream
+    transport : str
+        'redis' or 'shm'
+    shm_field : bytes
+        Field sent through the shared-memory ring, if transport is 'shm'
+    dtype : numpy.dtype
+        Default data type for the stream's fields, or None if the stream does
+        not define a sample_type
+    shape : tuple
+        Default (samp_per_stream, chan_per_stream) shape of each field
+    fields : dict
+        Data type and shape of fields that override the stream's defaults.
+        Keys are field names (bytes) and values are (dtype, shape) tuples.
+    maxlen : int
+        Approximate maximum number of entries kept in Redis, or None
+    window : float
+        Maximum age in seconds of the entries kept in Redis, or None
+    persist_then_trim : bool
+        If True, entries are removed from Redis once they are checkpointed
+    """
+
+    def __init__(self,
+                 name,
+                 sample_type=None,
+                 chan_per_stream=1,
+                 samp_per_stream=1,
+                 fields=None,
+                 transport='redis',
+                 shm_slots=1024,
+                 shm_field=None,
+                 retention=None,
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the stream
+        sample_type : str, optional
+            Default data type of the stream's fields
+        chan_per_stream : int, optional
+            Number of channels in each sample, by default 1
+        samp_per_stream : int, optional
+            Number of samples in each entry, by default 1
+        fields : dict, optional
+            Per-field definitions with their own 'sample_type',
+            'chan_per_stream', and 'samp_per_stream' keys. Missing keys are
+            taken from the stream's defaults.
+        transport : str, optional
+            'redis' (default) to send all fields through Redis, or 'shm' to
+            send the `shm_field` payload through a shared-memory ring
+        shm_slots : int, optional
+            Number of slots in the shared-memory ring, by default 1024
+        shm_field : str, optional
+            Field sent through the shared-memory ring. Required if the
+            stream has more than one field.
+        retention : dict, optional
+            How long entries are kept in Redis, with 'maxlen' (approximate
+            maximum number of entries), 'window' (maximum age in seconds),
+            and 'persist_then_trim' (remove entries once checkpointed) keys.
+            By default, entries are kept until the database is flushed.
+        **kwargs
+            Other keys in the stream definition, kept in `self.options`
+        """
+        self.name = name
+        self.dtype = get_dtype(sample_type) if sample_type else None
+        self.shape = (int(samp_per_stream), int(chan_per_stream))
+        self.options = kwargs
+
+        self.fields = {}
+        for field, cfg in (fields or {}).items():
+            field = field.encode() if isinstance(field, str) else field
+            cfg = cfg or {}
+            dtype = get_dtype(cfg['sample_type']) if cfg.get(
+                'sample_type') else self.dtype
+            if dtype is None:
+                raise ValueError(f'No sample_type defined for the {field} '
+                                 f'field of the {name} stream')
+            shape = (int(cfg.get('samp_per_stream', self.shape[0])),
+                     int(cfg.get('chan_per_stream', self.shape[1])))
+            self.fields[field] = (dtype, shape)
+
+        if transport not in ('redis', 'shm'):
+            raise ValueError(f'Invalid transport for the {name} stream: '
+                             f'{transport}')
+        self.transport = transport
+        self.shm_slots = int(shm_slots)
+        self.shm_field = None
+        self.shm_slot_bytes = 0
+        if transport == 'shm':
+            if shm_field is None and len(self.fields) == 1:
+                shm_field = list(self.fields)[0]
+            if shm_field is None:
+                raise ValueError(f'shm_field is required for the {name} '
+                                 'stream')
+            self.shm_field = (shm_field.encode()
+                              if isinstance(shm_field, str) else shm_field)
+            dtype, shape = self.layout(self.shm_field)
+            self.shm_slot_bytes = dtype.itemsize * shape[0] * shape[1]
+
+        retention = dict(retention or {})
+        self.maxlen = retention.pop('maxlen', None)
+        self.window = retention.pop('window', None)
+        self.persist_then_trim = bool(retention.pop('persist_then_trim',
+                                                    False))
+        if retention:
+            raise ValueError(f'Unknown retention settings for the {name} '
+                             f'stream: {sorted(retention)}')
+        if self.maxlen is not None:
+            self.maxlen = int(self.maxlen)
+            if self.maxlen <= 0:
+                raise ValueError(f'maxlen must be positive for the {name} '
+                                 'stream')
+        if self.window is not None:
+            self.window = float(self.window)
+            if self.window <= 0:
+                raise ValueError(f'window must be positive for the {name} '
+                                 'stream')
+        if self.persist_then_trim and (self.maxlen or self.window):
+            raise ValueError(f'persist_then_trim cannot be combined with '
+                             f'maxlen or window for the {name} stream')
+
+    def is_bounded(self) -> bool:
+        """
+        Check whether entries of the stream are trimmed by length or age
+
+        Returns
+        -------
+        bool
+            True if the stream has a maxlen or a window
+        """
+        return self.maxlen is not None or self.window is not None
+
+    def trim_args(self, now_ms=None) -> list:
+        """
+        Get the trimming arguments to add to XADD commands for this stream.
+        XADD accepts a single trimming strategy, so streams with both a
+        maxlen and a window are only trimmed by length on XADD, and by age
+        by the supervisor.
+
+        Parameters
+        ----------
+        now_ms : int, optional
+            Current time in milliseconds since the epoch, used for the
+            window. By default, the local clock.
+
+        Returns
+        -------
+        list
+            ['MAXLEN', '~', maxlen], ['MINID', '~', min_id] (requires Redis
+            6.2), or an empty list
+        """
+        if self.maxlen is not None:
+            return ['MAXLEN', '~', self.maxlen]
+        if self.window is not None:
+            if now_ms is None:
+                now_ms = int(time.time() * 1000)
+            return ['MINID', '~', window_min_id(now_ms, self.window)]
+        return []
+
+    def layout(self, field) -> tuple:
+        """
+        Get the data type and shape of a field
+
+        Parameters
+        ----------
+        field : bytes
+            Name of the field
+
+        Returns
+        -------
+        dtype : numpy.dtype
+            Data type of the field
+        shape : tuple
+            (samp_per_stream, chan_per_stream) shape of the field
+
+        Raises
+        ------
+        KeyError
+            If the field is not in `fields` and the stream has no default
+            sample_type
+        """
+        if field in self.fields:
+            return self.fields[field]
+        if self.dtype is None:
+            raise KeyError(f'No data type defined for the {field} field of '
+                           f'the {self.name} stream')
+        return self.dtype, self.shape
+
+    def decode(self, field, value) -> np.ndarray:
+        """
+        Decode a field of a stream entry without copying
+
+        Parameters
+        ----------
+        field : bytes
+            Name of the field
+        value : bytes
+            Value of the field, as returned by Redis
+
+        Returns
+        -------
+        numpy.ndarray
+            Read-only view of the data. If the number of values matches the
+            schema, the array has shape (samp_per_stream, chan_per_stream),
+            otherwise it is one-dimensional.
+        """
+        dtype, shape = self.layout(field)
+        data = np.frombuffer(value, dtype=dtype)
+        if shape != (1, 1) and data.size == shape[0] * shape[1]:
+            data = data.reshape(shape)
+        return data
+
+    def encode(self, field, value) -> bytes:
+        """
+        Encode data for a field of a stream entry
+
+        Parameters
+        ----------
+        field : bytes
+            Name of the field
+        value : array_like
+            Data to encode. It is cast to the field's data type if needed.
+
+        Returns
+        -------
+        bytes
+            Encoded data
+        """
+        dtype, _ = self.layout(field)
+        return np.asarray(value, dtype=dtype).tobytes()
+
+    def decode_entry(self, entry) -> dict:
+        """
+        Decode all fields of a stream entry that are defined in `fields`.
+        Other fields are returned unchanged.
+
+        Parameters
+        ----------
+        entry : dict
+            Entry data, as returned by Redis
+
+        Returns
+        -------
+        dict
+            Entry data with decoded fields
+        """
+        return {
+            field: self.decode(field, value) if field in self.fields else value
+            for field, value in entry.items()
+        }
+
+    def encode_entry(self, entry) -> dict:
+        """
+        Encode all fields of a stream entry that are defined in `fields`.
+        Other fields are returned unchanged.
+
+        Parameters
+        ----------
+        entry : dict
+            Entry data, with field names as str or bytes
+
+        Returns
+        -------
+        dict
+            Entry data that can be passed to XADD
+        """
+        out = {}
+        for field, value in entry.items():
+            key = field.encode() if isinstance(field, str) else field
+            out[field] = self.encode(key, value) if key in self.fields else value
+        return out
+
+
+def window_min_id(now_ms, window) -> str:
+    """
+    Get the oldest stream ID kept by a time-window retention policy
+
+    Parameters
+    ----------
+    now_ms : int
+        Current time in milliseconds since the epoch
+    window : float
+        Maximum age of the entries, in seconds
+
+    Returns
+    -------
+    str
+        Stream ID for XTRIM or XADD MINID
+    """
+    return f'{max(int(now_ms - window * 1000), 0)}-0'
+
+
+def get_stream_schemas(graph) -> dict:
+    """
+    Build the schemas for all streams defined in a graph
+
+    Parameters
+    ----------
+    graph : dict
+        Graph or supergraph. Stream definitions are read from its 'streams'
+        key, or from the 'RedisStreams' key of older graph files.
+
+    Returns
+    -------
+    dict
+        Stream names mapped to StreamSchema instances
+    """
+    streams = graph.get('streams', graph.get('RedisStreams')) or {}
+    return {
+        name: StreamSchema(name, **(cfg or {}))
+        for name, cfg in streams.items()
+    }
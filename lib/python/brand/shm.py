@@ -0,0 +1,239 @@
+"""
+Shared-memory ring buffers for high-bandwidth streams. The producer writes
+each payload into a slot of a ring in /dev/shm and adds only the slot's
+sequence number to the Redis stream, along with the usual sync and time
+keys. The layout matches the shm_ring helpers in brand.c.
+
+Layout of /dev/shm/brand_<stream>:
+    header (64 bytes):
+        0   magic (8 bytes, b'BRANDSHM')
+        8   version (uint64)
+        16  n_slots (uint64)
+        24  slot_bytes (uint64): maximum payload size of each slot
+        32  write_seq (uint64): sequence number of the next write
+    slots (SLOT_HEADER_BYTES + slot_bytes, rounded up to 64 bytes each):
+        0   state (uint64): 2 * seq + 1 while writing seq, 2 * seq + 2 once
+            written
+        8   n_bytes (uint64): size of the payload
+        16  payload
+
+Sequence number seq is stored in slot seq % n_slots. Readers check the
+slot's state before and after copying the payload, so a slot that was
+overwritten by the producer is detected instead of returning torn data.
+"""
+import mmap
+import os
+
+import numpy as np
+
+from .exceptions import ShmError
+
+SHM_DIR = '/dev/shm'
+MAGIC = b'BRANDSHM'
+VERSION = 1
+HEADER_BYTES = 64
+SLOT_HEADER_BYTES = 16
+ALIGNMENT = 64
+SEQ_FIELD = 'shm_seq'
+
+
+def ring_path(stream) -> str:
+    """
+    Get the path of the shared-memory file for a stream
+
+    Parameters
+    ----------
+    stream : str or bytes
+        Name of the stream
+
+    Returns
+    -------
+    str
+        Path of the file in /dev/shm
+    """
+    if isinstance(stream, bytes):
+        stream = stream.decode()
+    return os.path.join(SHM_DIR, f'brand_{stream}')
+
+
+class ShmRing():
+    """
+    Lock-free single-producer ring buffer in shared memory
+
+    Attributes
+    ----------
+    path : str
+        Path of the shared-memory file
+    n_slots : int
+        Number of slots in the ring
+    slot_bytes : int
+        Maximum payload size of each slot
+    inode : int
+        Inode of the shared-memory file when it was opened
+    """
+
+    def __init__(self, stream, n_slots=None, slot_bytes=None, create=False):
+        """
+        Parameters
+        ----------
+        stream : str or bytes
+            Name of the stream that carries the ring's sequence numbers
+        n_slots : int, optional
+            Number of slots. Required when creating the ring.
+        slot_bytes : int, optional
+            Maximum payload size of each slot. Required when creating the
+            ring.
+        create : bool, optional
+            If True, replace any existing ring for this stream with a new
+            one (producer). Otherwise, open an existing ring (consumer).
+        """
+        self.path = ring_path(stream)
+        if create:
+            if not n_slots or not slot_bytes:
+                raise ValueError('n_slots and slot_bytes are required to '
+                                 'create a shared-memory ring')
+            self.n_slots = int(n_slots)
+            self.slot_bytes = int(slot_bytes)
+            self.stride = _slot_stride(self.slot_bytes)
+            size = HEADER_BYTES + self.n_slots * self.stride
+            # unlink first so consumers of a previous ring keep their mapping
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+            try:
+                os.ftruncate(fd, size)
+                self._mm = mmap.mmap(fd, size)
+                self.inode = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            self._mm[8:HEADER_BYTES] = bytes(HEADER_BYTES - 8)
+            header = np.ndarray((7, ), dtype=np.uint64, buffer=self._mm,
+                                offset=8)
+            header[0] = VERSION
+            header[1] = self.n_slots
+            header[2] = self.slot_bytes
+            self._mm[:8] = MAGIC
+        else:
+            fd = os.open(self.path, os.O_RDWR)
+            try:
+                self._mm = mmap.mmap(fd, 0)
+                self.inode = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            if self._mm[:8] != MAGIC:
+                raise ShmError(f'{self.path} is not a BRAND ring')
+            header = np.ndarray((7, ), dtype=np.uint64, buffer=self._mm,
+                                offset=8)
+            if int(header[0]) != VERSION:
+                raise ShmError(f'{self.path} has version {header[0]}, '
+                               f'expected {VERSION}')
+            self.n_slots = int(header[1])
+            self.slot_bytes = int(header[2])
+            self.stride = _slot_stride(self.slot_bytes)
+
+        self._header = header
+        # state and n_bytes of each slot
+        self._slots = np.ndarray((self.n_slots, 2),
+                                 dtype=np.uint64,
+                                 buffer=self._mm,
+                                 offset=HEADER_BYTES,
+                                 strides=(self.stride, 8))
+        self._write_seq = int(header[3])
+
+    def _payload(self, slot, n_bytes) -> np.ndarray:
+        offset = HEADER_BYTES + slot * self.stride + SLOT_HEADER_BYTES
+        return np.ndarray((n_bytes, ), dtype=np.uint8, buffer=self._mm,
+                          offset=offset)
+
+    def write(self, data) -> int:
+        """
+        Write a payload to the next slot
+
+        Parameters
+        ----------
+        data : bytes or numpy.ndarray
+            Payload to write
+
+        Returns
+        -------
+        seq : int
+            Sequence number of the payload
+        """
+        payload = np.frombuffer(data, dtype=np.uint8) if isinstance(
+            data, (bytes, bytearray, memoryview)) else np.ascontiguousarray(
+                data).view(np.uint8).ravel()
+        n_bytes = payload.size
+        if n_bytes > self.slot_bytes:
+            raise ShmError(f'Payload of {n_bytes} bytes does not fit in '
+                           f'{self.slot_bytes}-byte slots')
+        seq = self._write_seq
+        slot = seq % self.n_slots
+        self._slots[slot, 0] = 2 * seq + 1
+        self._payload(slot, n_bytes)[:] = payload
+        self._slots[slot, 1] = n_bytes
+        self._slots[slot, 0] = 2 * seq + 2
+        self._write_seq = seq + 1
+        self._header[3] = self._write_seq
+        return seq
+
+    def read(self, seq) -> bytes:
+        """
+        Copy the payload with a given sequence number
+
+        Parameters
+        ----------
+        seq : int
+            Sequence number of the payload
+
+        Returns
+        -------
+        bytes
+            Payload
+        """
+        seq = int(seq)
+        slot = seq % self.n_slots
+        state = int(self._slots[slot, 0])
+        if state != 2 * seq + 2:
+            raise ShmError(f'Slot for sequence {seq} in {self.path} is '
+                           'not available (overwritten or not written)')
+        data = self._payload(slot, int(self._slots[slot, 1])).tobytes()
+        if int(self._slots[slot, 0]) != state:
+            raise ShmError(f'Slot for sequence {seq} in {self.path} was '
+                           'overwritten while reading')
+        return data
+
+    def is_replaced(self) -> bool:
+        """
+        Check whether the producer replaced this ring with a new one, e.g.
+        after it was restarted
+
+        Returns
+        -------
+        bool
+            True if the ring's path now leads to a different file
+        """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        """
+        Unmap the ring
+        """
+        self._header = None
+        self._slots = None
+        self._mm.close()
+
+    def unlink(self):
+        """
+        Remove the shared-memory file. Processes that already mapped the
+        ring can keep using it.
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _slot_stride(slot_bytes) -> int:
+    size = SLOT_HEADER_BYTES + slot_bytes
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
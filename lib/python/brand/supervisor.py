@@ -1,27 +1,95 @@
 import argparse
+import asyncio
+import copy
+import functools
 import json
 import logging
 import os
+import queue
 import re
 import sh
 from sh import git
 import signal
 import subprocess
 import sys
+import threading
 import time
 import traceback
+from concurrent.futures import Executor, Future
 from datetime import datetime
 
 import coloredlogs
 import redis
 import yaml
-from redis import Redis
 
+from .checkpoint import Checkpointer
+from .connection import connect, get_socket_path
 from .exceptions import (GraphError, NodeError, BooterError, DerivativeError, CommandError, RedisError)
+from .export import StreamExport
+from .latency import analyze as analyze_latency
+from .process import (DEFAULT_STARTUP_TIMEOUT, _as_list, get_cpu_time,
+                      get_launch_waves, redis_time_id, reports_ready,
+                      stop_processes,
+                      wait_for_nodes_ready)
+from .redis import parse_stream_id, xdel_after
+from .retention import (DEFAULT_RETENTION_INTERVAL, MINID_VERSION,
+                        StreamTrimmer, get_redis_version)
+from .schema import get_stream_schemas
+from .timesync import TimeSyncResponder
+from .watchdog import Watchdog, get_node_settings
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level='DEBUG', logger=logger)
 DEFAULT_DATA_DIR = os.path.abspath(os.path.join(os.getcwd(), '..', 'Data'))
+# seconds between progress reports of background saves and exports
+PROGRESS_INTERVAL = 1
+# seconds between INFO polls while waiting for an RDB save
+RDB_POLL_INTERVAL = 0.1
+# maximum seconds between a parameter update and the publication of a
+# supergraph that includes it
+DEFAULT_SUPERGRAPH_INTERVAL = 10
+# seconds to wait for booters to stop their nodes (each node gets up to 15 s
+# after SIGINT and 15 s after SIGKILL)
+BOOTER_STOP_TIMEOUT = 35
+# minimum seconds to wait for booters to start their nodes, even if the
+# graph's startup_timeout was used up by local nodes
+BOOTER_START_MIN_TIMEOUT = 5
+# commands that run as soon as they are received instead of being queued
+# behind long-running commands
+INLINE_COMMANDS = {'updateparameters', 'publishsupergraph', 'jobstatus'}
+# defaults for the benchmarkGraph command
+DEFAULT_BENCHMARK_RATE = 1000  # entries per second from each synthetic source
+DEFAULT_BENCHMARK_DURATION = 10  # seconds
+
+class DaemonExecutor(Executor):
+    '''
+    Executor that runs calls in order on a single daemon thread. Unlike
+    ThreadPoolExecutor, its thread is not joined when the interpreter
+    exits, so long jobs (e.g. make or saveNwb) do not delay the exit.
+    '''
+    def __init__(self, name):
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def _run(self):
+        while True:
+            future, fn, args, kwargs = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
 
 class Supervisor:
     def __init__(self):
@@ -30,6 +98,8 @@ class Supervisor:
 
         self.model = {}
         self.r = None
+        # separate connection pool for blocking reads (see brand.connection)
+        self.r_read = None
         self.parent = None
         self.children = {}
 
@@ -45,6 +115,32 @@ class Supervisor:
         self.redis_pid = None
 
         self.booter_status_id = '0-0'
+        # background RDB save in progress
+        self.rdb_save = None
+        # background checkpointer, while a graph with checkpoints is running
+        self.checkpointer = None
+        # background export in progress
+        self.export = None
+        # node health watchdog, while a graph with a watchdog is running
+        self.watchdog = None
+        # trims streams with a retention policy while a graph is running
+        self.trimmer = None
+        # answers the booters' time sync pings
+        self.time_sync = None
+        # guards rdb_save and export, which are checked from several threads
+        self.save_lock = threading.RLock()
+        # queued and running commands, keyed by supervisor_ipstream entry ID
+        self.jobs = {}
+        # guards jobs and children, which are used by both the command loop
+        # and the job thread. The model is guarded by supergraph_lock.
+        self.state_lock = threading.RLock()
+        self.booter_lock = threading.Lock()
+        # version of the latest parameter patch, and whether the published
+        # supergraph is missing patches
+        self.parameters_version = 0
+        self.supergraph_dirty = False
+        self.supergraph_published = time.monotonic()
+        self.supergraph_lock = threading.Lock()
 
         signal.signal(signal.SIGINT, self.terminate)
 
@@ -52,6 +148,8 @@ class Supervisor:
 
         self.start_redis_server()
         self.r.xadd("graph_status", {'status': self.state[5]})
+        self.time_sync = TimeSyncResponder(self.r, r_read=self.r_read)
+        self.time_sync.start()
 
         if self.graph_file is not None: self.load_graph(graph_dict)
 
@@ -186,7 +284,12 @@ class Supervisor:
                 raise RedisError("Launching redis-server failed for an unknown reason, check supervisor logs. Aborting.")
         except subprocess.TimeoutExpired:  # no error message received
             logger.info('redis-server is running')
-        self.r = Redis(self.host,self.port,socket_connect_timeout=1)
+        # prefers the unix socket, from --socket or the redis config
+        self.r = connect(self.host, self.port, self.unixsocket)
+        self.r_read = connect(self.host, self.port, get_socket_path(self.r),
+                              role='read')
+        if get_socket_path(self.r):
+            logger.info(f'Connected to redis on {get_socket_path(self.r)}')
 
         # Set rdb save directory
         if not os.path.exists(self.save_path_rdb):
@@ -235,6 +338,31 @@ class Supervisor:
         return save_path
 
 
+    def read_graph_file(self, file) -> dict:
+        '''
+        Read a graph YAML file
+
+        Parameters
+        ----------
+        file : str
+            Path to the graph YAML file
+
+        Returns
+        -------
+        graph_dict : dict
+            Graph dictionary, with the file's name as 'graph_name'
+        '''
+        try:
+            with open(file, 'r') as stream:
+                graph_dict = yaml.safe_load(stream)
+                graph_dict['graph_name'] = os.path.splitext(os.path.split(file)[-1])[0]
+                self.graph_file = file
+        except FileNotFoundError as exc:
+            raise GraphError(f"Could not find the graph at {file}", file) from exc
+        except yaml.YAMLError as exc:
+            raise GraphError("Error parsing graph YAML file", file) from exc
+        return graph_dict
+
     def load_graph(self,graph_dict,rdb_filename=None,publish_graph=True):
         ''' Running logic for the supervisor graph, establishes a redis connection on specified host & port  
         Args:
@@ -294,6 +422,10 @@ class Supervisor:
                 model["nodes"][n["nickname"]].update(n)
                 bin_f = self.search_node_bin_file(n["module"],n["name"])
                 model["nodes"][n["nickname"]]["binary"] = bin_f
+                # wait for BRANDNode-based nodes to report 'ready' unless
+                # the graph opts out, e.g. for nodes that override run()
+                model["nodes"][n["nickname"]].setdefault(
+                    "wait_ready", reports_ready(bin_f))
                 if ('machine' not in n or n["machine"] == self.machine):
                     if not os.path.exists(bin_f):
                         raise NodeError(
@@ -324,6 +456,70 @@ class Supervisor:
 
                 logger.info("%s is a valid node" % n["nickname"])
 
+            if "streams" in graph_dict:
+                model["streams"] = graph_dict["streams"]
+                try:
+                    get_stream_schemas(model)
+                except (TypeError, ValueError) as exc:
+                    raise GraphError(f"Invalid stream definition: {exc}",
+                                     self.graph_file) from exc
+
+            if "checkpoint" in graph_dict:
+                checkpoint = graph_dict["checkpoint"] or {}
+                if not isinstance(checkpoint, dict):
+                    raise GraphError("The checkpoint section must be a "
+                                     "dictionary", self.graph_file)
+                model["checkpoint"] = checkpoint
+
+            persisted = [
+                name for name, schema in get_stream_schemas(model).items()
+                if schema.persist_then_trim
+            ]
+            if persisted and "checkpoint" not in model:
+                raise GraphError(
+                    "Streams with the persist_then_trim retention policy "
+                    f"require a checkpoint section: {persisted}",
+                    self.graph_file)
+
+            # time windows are trimmed with XTRIM MINID
+            windowed = [
+                name for name, schema in get_stream_schemas(model).items()
+                if schema.window is not None
+            ]
+            if windowed:
+                version = get_redis_version(self.r)
+                if version < MINID_VERSION:
+                    raise GraphError(
+                        "The window retention policy requires Redis "
+                        f"{'.'.join(map(str, MINID_VERSION))} or newer, but "
+                        f"the server runs {'.'.join(map(str, version))}: "
+                        f"{windowed}", self.graph_file)
+
+            if "retention_interval" in graph_dict:
+                model["retention_interval"] = float(
+                    graph_dict["retention_interval"])
+
+            if "watchdog" in graph_dict:
+                watchdog = graph_dict["watchdog"] or {}
+                if not isinstance(watchdog, dict):
+                    raise GraphError("The watchdog section must be a "
+                                     "dictionary", self.graph_file)
+                for nickname, node_info in model["nodes"].items():
+                    try:
+                        get_node_settings(watchdog, node_info)
+                    except ValueError as exc:
+                        raise GraphError(
+                            f"Invalid watchdog settings for {nickname}: "
+                            f"{exc}", self.graph_file) from exc
+                model["watchdog"] = watchdog
+
+            if "supergraph_interval" in graph_dict:
+                model["supergraph_interval"] = float(
+                    graph_dict["supergraph_interval"])
+
+            if "startup_timeout" in graph_dict:
+                model["startup_timeout"] = float(graph_dict["startup_timeout"])
+
             if "derivatives" in graph_dict:
                 model["derivatives"] = {}
                 derivatives = graph_dict['derivatives']
@@ -375,132 +571,383 @@ class Supervisor:
                 self.graph_name,
                 name) from exc
 
-        # model is valid if we make it here
-        self.model = model
+        # model is valid if we make it here. Inline updateParameters
+        # commands may change the model while this job runs.
+        with self.supergraph_lock:
+            self.model = model
         if publish_graph:
             self.publish_graph()
 
     def publish_graph(self):
-        model_pub = json.dumps(self.model)
-        payload = {
-            "data": model_pub
-        }
-        self.r.xadd("supergraph_stream",payload)
+        with self.supergraph_lock:
+            # parameter patches up to this version are included in the model
+            self.model["parameters_version"] = self.parameters_version
+            model_pub = json.dumps(self.model)
+            payload = {
+                "data": model_pub
+            }
+            self.r.xadd("supergraph_stream",payload)
+            self.supergraph_dirty = False
+            self.supergraph_published = time.monotonic()
         logger.info("Supergraph Stream (Model) published successfully with payload")
         self.r.xadd("graph_status", {'status': self.state[4]}) # status 4 means graph is running and supergraph is published
 
+    def publish_graph_if_due(self, force=False):
+        '''
+        Publishes the supergraph if parameters were updated since it was last
+        published, and the supergraph interval has elapsed
+
+        Parameters
+        ----------
+        force : bool, optional
+            If True, publish pending parameter updates regardless of the
+            interval
+        '''
+        if not self.supergraph_dirty:
+            return
+        interval = self.model.get("supergraph_interval",
+                                  DEFAULT_SUPERGRAPH_INTERVAL)
+        if force or time.monotonic() - self.supergraph_published >= interval:
+            self.publish_graph()
+            with self.state_lock:
+                running = bool(self.children)
+            if running:
+                # status 3 means graph is running
+                self.r.xadd("graph_status", {'status': self.state[3]})
+
 
     def start_graph(self):
         ''' Start the graph '''
-        self.r.xadd('booter', {
-            'command': 'startGraph',
-            'graph': json.dumps(self.model)
-        })
+        # nodes report their state after this ID
+        start_id = redis_time_id(self.r)
+        t_start = time.monotonic()
+        booter_cmd = self.send_booter_command('startGraph',
+                                              graph=json.dumps(self.model))
         current_state = self.r.xrevrange("graph_status", count=1)
         current_graph_status = self.get_graph_status(current_state)
         logger.info("Current status of the graph is: %s" % current_graph_status)
         logger.info("Validation of the graph is successful")
-        host = self.model["redis_host"]
-        port = self.model["redis_port"]
-        for node, node_info in self.model["nodes"].items():
-            node_stream_name = node_info["nickname"]
+        self.parent = os.getpid()
+        logger.info("Parent Running on: %d" % os.getppid())
+
+        # launch local nodes wave by wave, consumers before producers, and
+        # wait for each wave to be ready before launching the next one
+        timeout = self.model.get("startup_timeout", DEFAULT_STARTUP_TIMEOUT)
+        deadline = t_start + timeout
+        local_nodes = {
+            node: node_info
+            for node, node_info in self.model["nodes"].items()
             if ('machine' not in node_info
-                    or node_info["machine"] == self.machine):
-
-                binary = node_info["binary"]
+                or node_info["machine"] == self.machine)
+        }
+        # only wait for nodes that opted in to report 'ready'
+        waited = {
+            node
+            for node, node_info in self.model["nodes"].items()
+            if node_info.get("wait_ready", False)
+        }
+        launch_times = {}
+        ready = {}
+        for wave in get_launch_waves(local_nodes):
+            for node in wave:
+                launch_times[node] = time.monotonic()
+                with self.state_lock:
+                    self.children[node] = self.launch_node(
+                        node, local_nodes[node])
+                if node not in waited:
+                    ready[node] = launch_times[node]
+            wave = [node for node in wave if node in waited]
+            remaining = deadline - time.monotonic()
+            if wave and remaining > 0:
+                ready.update(
+                    wait_for_nodes_ready(self.r_read, wave, start_id, remaining,
+                                         self.graph_name))
+
+        # wait for the booters to start their nodes
+        self.wait_for_booters(*booter_cmd,
+                              timeout=max(deadline - time.monotonic(),
+                                          BOOTER_START_MIN_TIMEOUT))
+
+        # wait for the remaining nodes, including those started by booters
+        pending = [n for n in waited if n not in ready]
+        remaining = deadline - time.monotonic()
+        if pending and remaining > 0:
+            ready.update(
+                wait_for_nodes_ready(self.r_read, pending, start_id, remaining,
+                                     self.graph_name))
+
+        startup_times = {
+            node: round(t - launch_times.get(node, t_start), 4)
+            for node, t in ready.items()
+        }
+        for node, startup_time in startup_times.items():
+            logger.info(f"{node} ready after {startup_time:.3f} s")
+        not_ready = [n for n in waited if n not in ready]
+        if not_ready:
+            logger.warning(f"Nodes not ready after {timeout} s: {not_ready}")
+        self.r.xadd("supervisor_status", {
+            "status": "Graph started",
+            "startup_times": json.dumps(startup_times),
+            "not_ready": json.dumps(not_ready)
+        })
 
-                # validate binary version
-                try:
-                    # read Git hash for the node
-                    with open(os.path.join(os.path.split(binary)[0], 'git_hash.o'), 'r') as f:
-                        hash = f.read().splitlines()[0]
-                except FileNotFoundError: # git hash file not found
-                    hash = ''
-                if hash != self.model["nodes"][node_info["nickname"]]["git_hash"]:
-                    logging.warning(f'Git hash for {node_info["nickname"]} '
-                                    'node nickname does not match supergraph')
-
-                logger.info("Binary for %s is %s" % (node,binary))
-                logger.info("Node Stream Name: %s" % node_stream_name)
-                args = [binary, '-n', node_stream_name]
-                args += ['-i', host, '-p', str(port)]
-                if self.unixsocket:
-                    args += ['-s', self.unixsocket]
-                if 'run_priority' in node_info:  # if priority is specified
-                    priority = node_info['run_priority']
-                    if priority:  # if priority is not None or empty
-                        chrt_args = ['chrt', '-f', str(int(priority))]
-                        args = chrt_args + args
-                if 'cpu_affinity' in node_info:  # if affinity is specified
-                    affinity = node_info['cpu_affinity']
-                    if affinity:  # if affinity is not None or empty
-                        taskset_args = ['taskset', '-c', str(affinity)]
-                        args = taskset_args + args
-                proc = subprocess.Popen(args)
-                proc.name = node
-                logger.info("Child process created with pid: %s" % proc.pid)
-                logger.info("Parent process is running and waiting for commands from redis")
-                self.parent = os.getpid()
-                logger.info("Parent Running on: %d" % os.getppid())
-                self.children[node] = proc
+        schemas = get_stream_schemas(self.model)
+        if "checkpoint" in self.model:
+            checkpoint_dir = os.path.join(
+                self.save_path, 'checkpoints',
+                os.path.splitext(self.rdb_filename)[0])
+            persisted = [
+                name for name, schema in schemas.items()
+                if schema.persist_then_trim
+            ]
+            self.checkpointer = Checkpointer(self.r, checkpoint_dir,
+                                             trim_streams=persisted,
+                                             **self.model["checkpoint"])
+            self.checkpointer.start()
+
+        if any(schema.is_bounded() for schema in schemas.values()):
+            self.trimmer = StreamTrimmer(
+                self.r, schemas,
+                interval=self.model.get("retention_interval",
+                                        DEFAULT_RETENTION_INTERVAL))
+            self.trimmer.start()
+
+        if "watchdog" in self.model:
+            self.watchdog = Watchdog(self.r, self.children, local_nodes,
+                                     self.launch_node,
+                                     graph_cfg=self.model["watchdog"],
+                                     source=self.machine or 'supervisor',
+                                     logger=self.logger)
+            self.watchdog.start()
 
         self.checkBooter()
 
         # status 3 means graph is running and publishing data
         self.r.xadd("graph_status", {'status': self.state[3]})
 
+    def get_booter_machines(self) -> set:
+        '''
+        Get the machines whose booters run nodes of the current graph
+
+        Returns
+        -------
+        set
+            Names of the machines
+        '''
+        return {
+            node_info['machine']
+            for node_info in self.model.get("nodes", {}).values()
+            if node_info.get('machine') not in (None, self.machine)
+        }
+
+    def send_booter_command(self, command, **fields) -> tuple:
+        '''
+        Send a command to the booters
+
+        Parameters
+        ----------
+        command : str
+            Name of the command
+        **fields
+            Other fields of the command entry
+
+        Returns
+        -------
+        command : str
+            Name of the command
+        command_id : bytes
+            ID of the command's entry in the booter stream, which booters
+            include in their acknowledgements
+        status_id : bytes
+            ID of the last booter_status entry before the command was sent
+        t_sent : float
+            Time (from time.monotonic) at which the command was sent
+        '''
+        last_status = self.r.xrevrange('booter_status', count=1)
+        status_id = last_status[0][0] if last_status else b'0-0'
+        t_sent = time.monotonic()
+        command_id = self.r.xadd('booter', {'command': command, **fields})
+        return command, command_id, status_id, t_sent
+
+    def wait_for_booters(self, command, command_id, status_id, t_sent,
+                         timeout) -> dict:
+        '''
+        Wait until the booters of all machines in the graph have run a
+        command, and publish the time each one took to supervisor_status
+
+        Parameters
+        ----------
+        command, command_id, status_id, t_sent
+            Output of `send_booter_command`
+        timeout : float
+            Maximum time to wait for all booters, in seconds. Statuses that
+            are already in booter_status are read even if the timeout is 0.
+
+        Returns
+        -------
+        acks : dict
+            Machines that ran the command, mapped to the time from sending
+            the command to seeing the booter's acknowledgements of its
+            receipt ('received_s') and completion ('done_s'), and the time
+            the booter measured for running it ('elapsed_s')
+
+        Raises
+        ------
+        BooterError
+            If a booter reports an error
+        '''
+        pending = self.get_booter_machines()
+        acks = {machine: {} for machine in pending}
+        failed = []
+        deadline = time.monotonic() + timeout
+        first_read = True
+        while pending:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms > 0:
+                replies = self.r_read.xread({'booter_status': status_id},
+                                            block=remaining_ms)
+            elif first_read:
+                # the acks may have arrived already
+                replies = self.r.xread({'booter_status': status_id})
+            else:
+                break
+            first_read = False
+            now = time.monotonic()
+            for _, entries in replies:
+                status_id = entries[-1][0]
+                for _, entry in entries:
+                    if entry.get(b'command_id') != command_id:
+                        continue
+                    machine = entry[b'machine'].decode('utf-8')
+                    if machine not in acks:
+                        continue
+                    ack = entry.get(b'ack')
+                    if ack == b'received':
+                        acks[machine]['received_s'] = round(now - t_sent, 4)
+                    elif ack == b'done':
+                        acks[machine]['done_s'] = round(now - t_sent, 4)
+                        acks[machine]['elapsed_s'] = float(
+                            entry[b'elapsed_s'])
+                        pending.discard(machine)
+                    else:  # error
+                        failed.append(machine)
+                        pending.discard(machine)
+                # raises a BooterError for errors not already reported
+                self.process_booter_status(entries)
+
+        for machine in sorted(acks):
+            if machine in pending or machine in failed:
+                continue
+            logger.info(f"{machine} ran {command} in "
+                        f"{acks[machine]['done_s']:.3f} s")
+        if pending:
+            logger.warning(f"No response to {command} from these booters "
+                           f"after {timeout:.1f} s: {sorted(pending)}")
+        if acks:
+            self.r.xadd("supervisor_status", {
+                "status": "Booter acknowledgements",
+                "command": command,
+                "command_id": command_id,
+                "acks": json.dumps(acks),
+                "missing": json.dumps(sorted(pending)),
+                "failed": json.dumps(failed)
+            })
+        return acks
+
+    def launch_node(self, node, node_info):
+        '''
+        Launch a node as a child process
+
+        Parameters
+        ----------
+        node : str
+            Nickname of the node
+        node_info : dict
+            The node's configuration in the supergraph
+
+        Returns
+        -------
+        proc : subprocess.Popen
+            The node's process
+        '''
+        host = self.model["redis_host"]
+        port = self.model["redis_port"]
+        node_stream_name = node_info["nickname"]
+        binary = node_info["binary"]
+
+        # validate binary version
+        try:
+            # read Git hash for the node
+            with open(os.path.join(os.path.split(binary)[0], 'git_hash.o'), 'r') as f:
+                hash = f.read().splitlines()[0]
+        except FileNotFoundError: # git hash file not found
+            hash = ''
+        if hash != self.model["nodes"][node_info["nickname"]]["git_hash"]:
+            logging.warning(f'Git hash for {node_info["nickname"]} '
+                            'node nickname does not match supergraph')
+
+        logger.info("Binary for %s is %s" % (node,binary))
+        logger.info("Node Stream Name: %s" % node_stream_name)
+        if node_info.get("synthetic"):
+            # source replaced by the benchmarkGraph command
+            args = [sys.executable, '-m', 'brand.synthetic']
+        else:
+            args = [binary]
+        args += ['-n', node_stream_name, '-i', host, '-p', str(port)]
+        socket_path = get_socket_path(self.r)
+        if socket_path:
+            args += ['-s', socket_path]
+        if 'run_priority' in node_info:  # if priority is specified
+            priority = node_info['run_priority']
+            if priority:  # if priority is not None or empty
+                chrt_args = ['chrt', '-f', str(int(priority))]
+                args = chrt_args + args
+        if 'cpu_affinity' in node_info:  # if affinity is specified
+            affinity = node_info['cpu_affinity']
+            if affinity:  # if affinity is not None or empty
+                taskset_args = ['taskset', '-c', str(affinity)]
+                args = taskset_args + args
+        proc = subprocess.Popen(args)
+        proc.name = node
+        logger.info("Child process created with pid: %s" % proc.pid)
+        return proc
+
 
     def stop_graph(self):
         '''
         Stops the graph
         '''
-        self.r.xadd('booter', {'command': 'stopGraph'})
+        self.publish_graph_if_due(force=True)
+        booter_cmd = self.send_booter_command('stopGraph')
         # Kill child processes (nodes)
         self.r.xadd("graph_status", {'status': self.state[5]})
         self.kill_nodes()
+        self.wait_for_booters(*booter_cmd, timeout=BOOTER_STOP_TIMEOUT)
+        if self.trimmer is not None:
+            self.trimmer.stop()
+            self.trimmer = None
+        # final checkpoint of the data written before the nodes stopped
+        if self.checkpointer is not None:
+            self.checkpointer.stop()
+            self.checkpointer = None
 
     def kill_nodes(self):
         '''
         Kills child processes
         '''
-        for node, proc in self.children.items():
-            try:
-                # check if process exists
-                os.kill(proc.pid, 0)
-            except OSError:
-                self.logger.warning(f"'{node}' (pid: {proc.pid})"
-                                    " isn't running and may have crashed")
-                self.children[node] = None
-            else:
-                # process is running
-                # send SIGINT
-                proc.send_signal(signal.SIGINT)
-                try:
-                    # check if it terminated
-                    proc.communicate(timeout=15)
-                except subprocess.TimeoutExpired:
-                    self.logger.warning(f"Could not stop '{node}' "
-                                        f"(pid: {proc.pid}) using SIGINT")
-                    # if not, send SIGKILL
-                    proc.kill()
-                    try:
-                        # check if it terminated
-                        proc.communicate(timeout=15)
-                    except subprocess.TimeoutExpired:
-                        pass  # delay error message until after the loop
-                    else:
-                        self.logger.info(f"Killed '{node}' "
-                                         f"(pid: {proc.pid}) using SIGKILL")
-                        self.children[node] = None
-                else:
-                    self.logger.info(f"Stopped '{node}' "
-                                     f"(pid: {proc.pid}) using SIGINT")
-                    self.children[node] = None
-        # remove killed processes from self.children
-        self.children = {
-            n: p
-            for n, p in self.children.items() if p is not None
-        }
+        # stop the watchdog first, so it does not restart the nodes
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+        with self.state_lock:
+            children = dict(self.children)
+        # nodes are stopped without the lock, which can take several seconds
+        children, exit_times = stop_processes(children, self.logger)
+        with self.state_lock:
+            self.children = children
+        if exit_times:
+            self.logger.info('Stopped all nodes in '
+                             f'{max(exit_times.values()):.3f} s')
         # raise an error if nodes are still running
         if self.children:
             running_nodes = [
@@ -552,35 +999,130 @@ class Supervisor:
                 self.graph_file)
 
         # if we make it out of the above loop without error, then the parameter update is valid, so overwrite the existing model
-        for nickname in new_params:
-            nn_dec = nickname.decode("utf-8")
-            nickname_params = json.loads(new_params[nickname].decode())
-            for param, value in nickname_params.items():
-                self.model["nodes"][nn_dec]["parameters"][param] = value
-
-        # write the new supergraph
-        model_pub = json.dumps(self.model)
-        payload = {
-            "data": model_pub
-        }
-        self.r.xadd("supergraph_stream", payload)
-        logger.info("Supergraph updated successfully")
-        self.r.xadd("graph_status", {'status': self.state[4]}) # status 4 means graph is published
-        self.r.xadd("graph_status", {'status': self.state[3]}) # status 3 means graph is running
+        with self.supergraph_lock:
+            for nickname in new_params:
+                nn_dec = nickname.decode("utf-8")
+                nickname_params = json.loads(new_params[nickname].decode())
+                for param, value in nickname_params.items():
+                    self.model["nodes"][nn_dec]["parameters"][param] = value
+
+            # publish only the changes, as a versioned patch for each node.
+            # The full supergraph is republished by publish_graph_if_due.
+            self.parameters_version += 1
+            p = self.r.pipeline()
+            for nickname in new_params:
+                p.xadd(f"{nickname.decode('utf-8')}_parameters",
+                       {"data": new_params[nickname],
+                        "version": self.parameters_version})
+            p.execute()
+            self.supergraph_dirty = True
+        logger.info(f"Parameters updated (version {self.parameters_version})")
+        self.publish_graph_if_due()
+
+    def save_rdb(self, wait=False):
+        '''
+        Saves an RDB file of the current database with BGSAVE, so Redis
+        keeps serving nodes while the file is written
 
-    def save_rdb(self):
+        Parameters
+        ----------
+        wait : bool, optional
+            If True, block until the save has completed. Otherwise, progress
+            is checked by `check_rdb_save` in the command loop.
         '''
-        Saves an RDB file of the current database
+        # the RDB file must contain the latest parameters
+        self.publish_graph_if_due(force=True)
+        with self.save_lock:
+            if self.rdb_save is None:
+                try:
+                    self.r.bgsave()
+                except redis.exceptions.ResponseError as exc:
+                    raise CommandError(f"Could not start BGSAVE: {exc}",
+                                       'supervisor', 'saveRdb') from exc
+                self.rdb_save = {
+                    'filename': self.rdb_filename,
+                    'start': time.monotonic(),
+                    'last_report': time.monotonic()
+                }
+                logger.info(f"Saving RDB data to file: {self.rdb_filename}")
+                self.r.xadd("supervisor_status", {
+                    "status": "RDB save started",
+                    "rdb_filename": self.rdb_filename
+                })
+            if wait:
+                self.wait_for_rdb_save()
+
+    def check_rdb_save(self) -> bool:
         '''
-        # Save rdb file
-        self.r.save()
-        logger.info(f"RDB data saved to file: {self.rdb_filename}")
+        Checks the progress of a background RDB save using INFO persistence,
+        publishing progress and completion to supervisor_status
+
+        Returns
+        -------
+        bool
+            True if a background save is still in progress
+        '''
+        # the RDB file must contain the latest parameters
+        self.publish_graph_if_due(force=True)
+        with self.save_lock:
+            if self.rdb_save is None:
+                return False
+            info = self.r.info('persistence')
+            now = time.monotonic()
+            elapsed = now - self.rdb_save['start']
+            if info.get('rdb_bgsave_in_progress', 0):
+                if now - self.rdb_save['last_report'] >= PROGRESS_INTERVAL:
+                    progress = {
+                        "status": "RDB save in progress",
+                        "rdb_filename": self.rdb_save['filename'],
+                        "elapsed_s": round(elapsed, 3),
+                        "fork_usec": info.get('latest_fork_usec', 0)
+                    }
+                    # available in Redis 7
+                    for key in ('current_fork_perc',
+                                'current_save_keys_processed',
+                                'current_save_keys_total'):
+                        if key in info:
+                            progress[key] = info[key]
+                    self.r.xadd("supervisor_status", progress)
+                    self.rdb_save['last_report'] = now
+                return True
+
+            filename = self.rdb_save['filename']
+            self.rdb_save = None
+            status = info.get('rdb_last_bgsave_status', 'ok')
+            if status != 'ok':
+                self.r.xadd("supervisor_status", {
+                    "status": "RDB save failed",
+                    "rdb_filename": filename
+                })
+                raise CommandError(f"BGSAVE of {filename} failed",
+                                   'supervisor', 'saveRdb',
+                                   f'rdb_last_bgsave_status: {status}')
+            logger.info(f"RDB data saved to file: {filename} "
+                        f"({elapsed:.2f} s)")
+            self.r.xadd("supervisor_status", {
+                "status": "RDB save completed",
+                "rdb_filename": filename,
+                "elapsed_s": round(elapsed, 3),
+                "fork_usec": info.get('latest_fork_usec', 0)
+            })
+            return False
+
+    def wait_for_rdb_save(self):
+        '''
+        Blocks until the current background RDB save, if any, has completed
+        '''
+        while self.check_rdb_save():
+            time.sleep(RDB_POLL_INTERVAL)
 
     def save_nwb(self):
         '''
         Saves an NWB file from the most recent supergraph
         '''
         self.check_graph_not_running(cmd='saveNwb')
+        # exportNWB needs the RDB file
+        self.wait_for_rdb_save()
 
         # Make path for saving NWB file
         save_path_nwb = os.path.join(self.save_path, 'NWB')
@@ -608,10 +1150,100 @@ class Supervisor:
         elif p_nwb.returncode < 0:
             logger.info(f"exportNWB was halted during execution with return code {p_nwb.returncode}, {signal.Signals(-p_nwb.returncode).name}")
 
+    def export_data(self, path=None, streams=None):
+        '''
+        Exports the streams in the database to an HDF5 file in the
+        background. Progress is checked by `check_export` in the command
+        loop.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the output file. By default, the RDB file name with an
+            .h5 extension in the HDF5 folder of the save path.
+        streams : list, optional
+            Streams to export. By default, all streams except control
+            streams.
+        '''
+        if self.export is not None:
+            raise CommandError(f"An export to {self.export.path} is already "
+                               "in progress", 'supervisor', 'exportData')
+        if path is None:
+            save_path_h5 = os.path.join(self.save_path, 'HDF5')
+            os.makedirs(save_path_h5, exist_ok=True)
+            path = os.path.join(save_path_h5,
+                                os.path.splitext(self.rdb_filename)[0] + '.h5')
+        export = StreamExport(self.r, path, streams=streams,
+                              schemas=get_stream_schemas(self.model))
+        try:
+            export.start()
+        except ImportError as exc:
+            raise CommandError("exportData requires h5py", 'supervisor',
+                               'exportData', repr(exc)) from exc
+        self.export = export
+        self.export_report = time.monotonic()
+        self.r.xadd("supervisor_status", {
+            "status": "Export started",
+            "path": path,
+            "streams": len(export.n_total)
+        })
+
+    def check_export(self) -> bool:
+        '''
+        Checks the progress of a background export, publishing progress and
+        completion to supervisor_status
+
+        Returns
+        -------
+        bool
+            True if an export is still in progress
+        '''
+        with self.save_lock:
+            if self.export is None:
+                return False
+            if not self.export.done():
+                now = time.monotonic()
+                if now - self.export_report >= PROGRESS_INTERVAL:
+                    self.r.xadd("supervisor_status", {
+                        "status": "Export in progress",
+                        "path": self.export.path,
+                        "progress": round(self.export.progress(), 4)
+                    })
+                    self.export_report = now
+                return True
+
+            export = self.export
+            self.export = None
+            try:
+                export.finish()
+            except Exception as exc:
+                self.r.xadd("supervisor_status", {
+                    "status": "Export failed",
+                    "path": export.path
+                })
+                raise CommandError(f"Export to {export.path} failed",
+                                   'supervisor', 'exportData',
+                                   traceback.format_exc()) from exc
+            self.r.xadd("supervisor_status", {
+                "status": "Export completed",
+                "path": export.path,
+                "entries": sum(export.n_done.values())
+            })
+            return False
+
     def flush_db(self):
         '''
         Flushes the RDB
         '''
+        if self.check_rdb_save():
+            raise CommandError("Cannot flush the database while the RDB file "
+                               f"{self.rdb_save['filename']} is being saved",
+                               'supervisor', 'flushDb')
+        if self.check_export():
+            raise CommandError("Cannot flush the database while it is being "
+                               f"exported to {self.export.path}",
+                               'supervisor', 'flushDb')
+
         # Flush database
         self.r.flushdb()
 
@@ -633,8 +1265,7 @@ class Supervisor:
         # Make path for saving NWB file
         save_path_nwb = os.path.join(self.save_path, 'NWB')
         # Save rdb file
-        self.r.save()
-        logger.info(f"RDB data saved to file: {self.rdb_filename}")
+        self.save_rdb(wait=True)
 
         # Generate NWB dataset
         p_nwb = subprocess.Popen(['python',
@@ -645,16 +1276,148 @@ class Supervisor:
                             save_path_nwb])
         p_nwb.wait()
 
-        # Flush database
-        self.r.flushdb()
+        # Flush database, unless a background export still needs it
+        self.flush_db()
 
-        # Set new rdb filename (to avoid overwriting what we just saved)
-        self.rdb_filename = 'idle_' + datetime.now().strftime(r'%y%m%dT%H%M') + '.rdb'
-        self.r.config_set('dbfilename', self.rdb_filename)
-        logger.info(f"New RDB file name set to {self.rdb_filename}")
+    def benchmark_graph(self, sources, rate=DEFAULT_BENCHMARK_RATE,
+                        duration=DEFAULT_BENCHMARK_DURATION) -> dict:
+        '''
+        Run the loaded graph under synthetic load and write a report next
+        to the RDB file. The source nodes are replaced with
+        brand.synthetic nodes that write random samples to the sources'
+        redis_outputs at a fixed rate. After `duration` seconds, the graph
+        is stopped and the report lists the CPU time of each local node
+        (from /proc), Redis operations per second and memory use, and
+        end-to-end latencies computed from the sync labels (see
+        brand.latency). Only entries added during the benchmark are
+        analyzed, and they are then deleted from the graph's redis_outputs
+        streams, so the synthetic data is not saved by a later saveRdb.
+        Streams that are not declared in redis_outputs keep their entries.
 
-        # New RDB, so need to reset graph status
-        self.r.xadd("graph_status", {'status': self.state[5]})
+        Parameters
+        ----------
+        sources : list
+            Nicknames of the nodes to replace with synthetic sources
+        rate : float, optional
+            Entries per second written by each synthetic source
+        duration : float, optional
+            Seconds to run the graph for
+
+        Returns
+        -------
+        report : dict
+            Benchmark report
+        '''
+        if not self.model:
+            raise GraphError("No graph loaded to benchmark", self.graph_file)
+        if not sources:
+            raise GraphError("The benchmarkGraph command requires 'sources', "
+                             "a JSON list or comma-separated string of node "
+                             "nicknames", self.graph_file)
+        # edit a copy, so the loaded model is unchanged if a source is
+        # invalid
+        with self.supergraph_lock:
+            original_model = self.model
+            benchmark_model = copy.deepcopy(original_model)
+        for nickname in sources:
+            if nickname not in benchmark_model["nodes"]:
+                raise GraphError(f"{nickname} is not a node in the graph",
+                                 self.graph_file)
+            node_info = benchmark_model["nodes"][nickname]
+            outputs = _as_list(node_info.get("redis_outputs"))
+            if not outputs:
+                raise NodeError(f"{nickname} must declare redis_outputs to "
+                                "be replaced with a synthetic source",
+                                self.graph_name, nickname)
+            node_info["synthetic"] = True
+            node_info["parameters"] = {
+                "output_streams": outputs,
+                "rate": rate,
+                "log": node_info["parameters"].get("log", "INFO"),
+            }
+
+        def redis_stats():
+            stats = self.r.info('stats')
+            return time.monotonic(), stats['total_commands_processed']
+
+        with self.supergraph_lock:
+            self.model = benchmark_model
+        try:
+            self.publish_graph()
+            # entries from this ID onwards were written by the benchmark
+            start_id = redis_time_id(self.r)
+            try:
+                self.start_graph()
+                # nodes launched by booters run on other machines
+                remote_nodes = [node for node in self.model["nodes"]
+                                if node not in self.children]
+                pids = {node: proc.pid for node, proc in self.children.items()}
+                pids['redis-server'] = self.redis_pid
+                cpu_start = {node: get_cpu_time(pid) for node, pid in pids.items()}
+                t_start, commands_start = redis_stats()
+                memory = []
+                # sample memory use once per second
+                while time.monotonic() - t_start < duration:
+                    time.sleep(min(1, max(duration - (time.monotonic() - t_start), 0)))
+                    memory.append(self.r.info('memory')['used_memory'])
+                t_end, commands_end = redis_stats()
+                cpu_end = {node: get_cpu_time(pid) for node, pid in pids.items()}
+                exited = [node for node, proc in self.children.items()
+                          if proc.poll() is not None]
+            finally:
+                # also stops the nodes of a partially started graph
+                self.stop_graph()
+        finally:
+            # restore the real sources, even if the graph failed to start
+            with self.supergraph_lock:
+                self.model = original_model
+            self.publish_graph()
+
+        elapsed = t_end - t_start
+        cpu = {}
+        for node in pids:
+            if cpu_start[node] is not None and cpu_end[node] is not None:
+                cpu_s = cpu_end[node] - cpu_start[node]
+                cpu[node] = {'cpu_s': round(cpu_s, 3),
+                             'cpu_percent': round(100 * cpu_s / elapsed, 1)}
+        report = {
+            'graph_name': self.graph_name,
+            'sources': sources,
+            'rate': rate,
+            'duration_s': round(elapsed, 3),
+            'remote_nodes': remote_nodes,
+            'exited_nodes': exited,
+            'cpu': cpu,
+            'redis': {
+                'ops_per_s': round((commands_end - commands_start) / elapsed, 1),
+                'used_memory_max': max(memory, default=0),
+                'used_memory_end': memory[-1] if memory else 0,
+            },
+        }
+        try:
+            report['latency'] = analyze_latency(self.r, start_id=start_id)
+        except Exception as exc:
+            logger.exception('Could not compute latencies')
+            report['latency'] = {'error': repr(exc)}
+
+        # discard the benchmark's data
+        streams = {stream
+                   for node_info in self.model["nodes"].values()
+                   for stream in _as_list(node_info.get("redis_outputs"))}
+        n_deleted = sum(xdel_after(self.r, stream, start_id)
+                        for stream in sorted(streams))
+        logger.info(f'Deleted {n_deleted} benchmark entries from '
+                    f'{len(streams)} streams')
+
+        report_path = os.path.join(
+            self.save_path_rdb,
+            os.path.splitext(self.rdb_filename)[0] + '_benchmark.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f'Benchmark report written to {report_path}')
+        self.r.xadd("supervisor_status", {"status": "Benchmark completed",
+                                          "path": report_path})
+        return report
 
     def make(self):
         '''
@@ -663,7 +1426,7 @@ class Supervisor:
         self.check_graph_not_running(cmd='make')
 
         # Run make
-        self.r.xadd('booter', {'command': 'make'})
+        self.send_booter_command('make')
         p_make = subprocess.run(['make'],
                                 capture_output=True)
 
@@ -681,6 +1444,8 @@ class Supervisor:
 
     def terminate(self, sig, frame):
         logger.info('SIGINT received, Exiting')
+        if self.time_sync is not None:
+            self.time_sync.stop()
         try:
             self.r.xadd("supervisor_status", {"status": "SIGINT received, Exiting"})
         except Exception as exc:
@@ -709,16 +1474,7 @@ class Supervisor:
             if b'file' in data:
                 logger.info(f"{cmd} command received with file")
                 file = data[b'file'].decode("utf-8")
-                graph_dict = {}
-                try:
-                    with open(file, 'r') as stream:
-                        graph_dict = yaml.safe_load(stream)
-                        graph_dict['graph_name'] = os.path.splitext(os.path.split(file)[-1])[0]
-                        self.graph_file = file
-                except FileNotFoundError as exc:
-                    raise GraphError(f"Could not find the graph at {file}", file) from exc
-                except yaml.YAMLError as exc:
-                    raise GraphError("Error parsing graph YAML file", file) from exc
+                graph_dict = self.read_graph_file(file)
                 self.load_graph(graph_dict,rdb_filename=rdb_filename)
                 if cmd == "startgraph":
                     self.start_graph()
@@ -751,6 +1507,24 @@ class Supervisor:
         elif cmd == "savenwb":
             logger.info("Save NWB command received")
             self.save_nwb()
+        elif cmd == "exportdata":
+            logger.info("Export data command received")
+            path = data[b'path'].decode('utf-8') if b'path' in data else None
+            streams = json.loads(data[b'streams']) if b'streams' in data else None
+            self.export_data(path=path, streams=streams)
+        elif cmd == "benchmarkgraph":
+            logger.info("Benchmark graph command received")
+            if self.children:
+                raise GraphError("Graph already running, run stopGraph before benchmarking a graph", self.graph_file)
+            if b'file' in data:
+                self.load_graph(self.read_graph_file(data[b'file'].decode('utf-8')),
+                                publish_graph=False)
+            sources = data.get(b'sources', b'').decode('utf-8')
+            sources = (json.loads(sources) if sources.startswith('[')
+                       else [s for s in sources.split(',') if s])
+            rate = float(data.get(b'rate', DEFAULT_BENCHMARK_RATE))
+            duration = float(data.get(b'duration', DEFAULT_BENCHMARK_DURATION))
+            self.benchmark_graph(sources, rate, duration)
         elif cmd == "flushdb":
             logger.info("Flush DB command received")
             self.flush_db()
@@ -767,6 +1541,11 @@ class Supervisor:
             if not os.path.exists(self.save_path_rdb):
                 os.makedirs(self.save_path_rdb)
             self.r.config_set('dir', self.save_path_rdb)
+        elif cmd == "publishsupergraph":
+            logger.info("Publish supergraph command received")
+            self.publish_graph_if_due(force=True)
+        elif cmd == "jobstatus":
+            self.publish_jobs()
         elif cmd == "make":
             logger.info("Make command received")
             self.make()
@@ -779,136 +1558,269 @@ class Supervisor:
         Checks status of booter nodes
         '''
         statuses = self.r.xrange('booter_status', '('+self.booter_status_id, '+')
-        if len(statuses) > 0:
-            for entry in statuses:
-                status = entry[1][b'status'].decode('utf-8')
-                if status in ['NodeError', 'GraphError', 'CommandError']:
-                    # get messages starting from the error
-                    self.booter_status_id = entry[0].decode('utf-8')
-                    raise BooterError(
-                        f"{entry[1][b'machine'].decode('utf-8')} machine encountered an error: {entry[1][b'message'].decode('utf-8')}",
-                        entry[1][b'machine'].decode('utf-8'),
-                        self.graph_file,
-                        entry[1][b'traceback'].decode('utf-8'),
-                        status)
-
-            self.booter_status_id = statuses[-1][0].decode('utf-8')
+        self.process_booter_status(statuses)
 
+    def process_booter_status(self, statuses):
+        '''
+        Processes entries from the booter_status stream. Entries that were
+        already processed are skipped, so entries can come from both
+        checkBooter and the command loop's XREAD.
 
-    def main(self):
-        last_id = '$'
-        logger.info('Listening for commands')
-        self.r.xadd("supervisor_status", {"status": "Listening for commands"})
-        while(True):
-            try:
-                self.checkBooter()
-                cmd = self.r.xread({"supervisor_ipstream": last_id},
-                                    count=1,
-                                    block=5000)
-                if cmd:
-                    key,messages = cmd[0]
-                    last_id,data = messages[0]
-                    if b'commands' in data:
-                        self.parseCommands(data)
-                    else:
-                        self.r.xadd("supervisor_status", {"status": "Invalid supervisor_ipstream entry", "message": "No 'commands' key found in the supervisor_ipstream entry"})
-                        logger.error("'commands' key not in supervisor_ipstream entry")
-                        self.r.xadd("supervisor_status", {"status": "Listening for commands"})
+        Parameters
+        ----------
+        statuses : list
+            Entries from the booter_status stream
+        '''
+        with self.booter_lock:
+            last_id = parse_stream_id(self.booter_status_id)
+            statuses = [
+                entry for entry in statuses
+                if parse_stream_id(entry[0]) > last_id
+            ]
+            if len(statuses) > 0:
+                for entry in statuses:
+                    status = entry[1][b'status'].decode('utf-8')
+                    if status in ['NodeError', 'GraphError', 'CommandError']:
+                        # get messages starting from the error
+                        self.booter_status_id = entry[0].decode('utf-8')
+                        raise BooterError(
+                            f"{entry[1][b'machine'].decode('utf-8')} machine encountered an error: {entry[1][b'message'].decode('utf-8')}",
+                            entry[1][b'machine'].decode('utf-8'),
+                            self.graph_file,
+                            entry[1][b'traceback'].decode('utf-8'),
+                            status)
+
+                self.booter_status_id = statuses[-1][0].decode('utf-8')
+
+    def report_errors(self, func, *args) -> bool:
+        '''
+        Calls a function, reporting any error it raises to the graph_status
+        and supervisor_status streams
 
-            except redis.exceptions.ConnectionError as exc:
-                logger.error('Could not connect to Redis: ' + repr(exc))
-                sys.exit(0)
+        Parameters
+        ----------
+        func : callable
+            Function to call
+        *args
+            Arguments for the function
 
-            except GraphError as exc:
-                # if the graph has an error, it was never executed, so log it
+        Returns
+        -------
+        bool
+            True if the function returned without raising an error
+        '''
+        try:
+            func(*args)
+            return True
+
+        except redis.exceptions.ConnectionError as exc:
+            logger.error('Could not connect to Redis: ' + repr(exc))
+            raise
+
+        except GraphError as exc:
+            # if the graph has an error, it was never executed, so log it
+            self.r.xadd("graph_status",
+                {'status': self.state[2],
+                'message': str(exc),
+                'traceback': 'Supervisor ' + traceback.format_exc()})
+            if self.children:
+                status = self.r.xrevrange("graph_status", '+', '-', count=2)
                 self.r.xadd("graph_status",
-                    {'status': self.state[2],
+                    {'status': status[-1][1][b'status']})
+            else:
+                self.r.xadd("graph_status", {'status': self.state[5]})
+            graph = 'None' if exc.graph is None else exc.graph
+            logger.error(f"Graph operation failed for {graph} graph")
+            logger.error(str(exc))
+
+        except NodeError as exc:
+            # if a node has an error, stop the graph
+            self.r.xadd("graph_status",
+                {'status': self.state[2],
+                'message': str(exc),
+                'traceback': 'Supervisor ' + traceback.format_exc()})
+            self.r.xadd("supervisor_ipstream",
+                {'commands': 'stopGraph'})
+            logger.error(f"Error with the {exc.node} node in the {exc.graph} graph")
+            logger.error(str(exc))
+
+        except BooterError as exc:
+            # if a booter has a CommandError, report it
+            if exc.source_exc == 'CommandError':
+                self.r.xadd("supervisor_status",
+                    {'status': exc.source_exc,
                     'message': str(exc),
-                    'traceback': 'Supervisor ' + traceback.format_exc()})
-                if self.children:
-                    status = self.r.xrevrange("graph_status", '+', '-', count=2)
-                    self.r.xadd("graph_status",
-                        {'status': status[-1][1][b'status']})
-                else:
-                    self.r.xadd("graph_status", {'status': self.state[5]})
-                graph = 'None' if exc.graph is None else exc.graph
-                logger.error(f"Graph operation failed for {graph} graph")
-                logger.error(str(exc))
-
-            except NodeError as exc:
-                # if a node has an error, stop the graph
+                    'traceback': exc.booter_tb + '\nSupervisor ' + traceback.format_exc()})
+            # if a booter has a different error, stop the graph and kill all nodes
+            else:
                 self.r.xadd("graph_status",
                     {'status': self.state[2],
                     'message': str(exc),
-                    'traceback': 'Supervisor ' + traceback.format_exc()})
+                    'traceback': exc.booter_tb + '\nSupervisor ' + traceback.format_exc()})
                 self.r.xadd("supervisor_ipstream",
                     {'commands': 'stopGraph'})
-                logger.error(f"Error with the {exc.node} node in the {exc.graph} graph")
-                logger.error(str(exc))
-
-            except BooterError as exc:
-                # if a booter has a CommandError, report it
-                if exc.source_exc == 'CommandError':
-                    self.r.xadd("supervisor_status",
-                        {'status': exc.source_exc,
-                        'message': str(exc),
-                        'traceback': exc.booter_tb + '\nSupervisor ' + traceback.format_exc()})
-                # if a booter has a different error, stop the graph and kill all nodes
-                else:
-                    self.r.xadd("graph_status",
-                        {'status': self.state[2],
-                        'message': str(exc),
-                        'traceback': exc.booter_tb + '\nSupervisor ' + traceback.format_exc()})
-                    self.r.xadd("supervisor_ipstream",
-                        {'commands': 'stopGraph'})
-                logger.error(f"Error with the {exc.machine} machine")
-                logger.error(str(exc))
-
-            except DerivativeError as exc:
-                # if a derivative has an error, then note that in the RDB
-                derivative_tb = ''
-                if exc.process.stdout is None:
-                    derivative_tb += 'STDOUT: None\n'
-                else:
-                    derivative_tb += 'STDOUT: ' + exc.process.stdout.decode('utf-8') + '\n'
+            logger.error(f"Error with the {exc.machine} machine")
+            logger.error(str(exc))
+
+        except DerivativeError as exc:
+            # if a derivative has an error, then note that in the RDB
+            derivative_tb = ''
+            if exc.process.stdout is None:
+                derivative_tb += 'STDOUT: None\n'
+            else:
+                derivative_tb += 'STDOUT: ' + exc.process.stdout.decode('utf-8') + '\n'
 
-                if exc.process.stderr is None:
-                    derivative_tb += 'STDERR: None\n'
-                else:
-                    derivative_tb += 'STDERR: ' + exc.process.stderr.decode('utf-8') + '\n'
+            if exc.process.stderr is None:
+                derivative_tb += 'STDERR: None\n'
+            else:
+                derivative_tb += 'STDERR: ' + exc.process.stderr.decode('utf-8') + '\n'
 
+            self.r.xadd("graph_status",
+                {'status': self.state[2],
+                'message': str(exc),
+                'traceback': 'Supervisor ' + traceback.format_exc() + '\n' + derivative_tb})
+            # rewrite previous graph_status
+            if self.children:
+                status = self.r.xrevrange("graph_status", '+', '-', count=2)
                 self.r.xadd("graph_status",
-                    {'status': self.state[2],
-                    'message': str(exc),
-                    'traceback': 'Supervisor ' + traceback.format_exc() + '\n' + derivative_tb})
-                # rewrite previous graph_status
-                if self.children:
-                    status = self.r.xrevrange("graph_status", '+', '-', count=2)
-                    self.r.xadd("graph_status",
-                        {'status': status[-1][1][b'status']})
-                else:
-                    self.r.xadd("graph_status", {'status': self.state[5]})
+                    {'status': status[-1][1][b'status']})
+            else:
+                self.r.xadd("graph_status", {'status': self.state[5]})
 
-                logger.error(f"Error with the {exc.derivative} derivative")
-                logger.error(str(exc))
-                if exc.process.stderr is not None and len(exc.process.stderr) > 0:
-                    logger.debug(exc.process.stderr.decode('utf-8'))
+            logger.error(f"Error with the {exc.derivative} derivative")
+            logger.error(str(exc))
+            if exc.process.stderr is not None and len(exc.process.stderr) > 0:
+                logger.debug(exc.process.stderr.decode('utf-8'))
 
-            except CommandError as exc:
-                # if a command has an error, then note that in the RDB
-                self.r.xadd("supervisor_status",
-                    {"status": "Command error",
-                    "message": str(exc),
-                    "traceback": "Supervisor " + traceback.format_exc() + '\nDetails:\n' + exc.details})
+        except CommandError as exc:
+            # if a command has an error, then note that in the RDB
+            self.r.xadd("supervisor_status",
+                {"status": "Command error",
+                "message": str(exc),
+                "traceback": "Supervisor " + traceback.format_exc() + '\nDetails:\n' + exc.details})
 
-                logger.error(f"Could not execute {exc.command} command.")
-                logger.error(str(exc))
-                self.r.xadd("supervisor_status", {"status": "Listening for commands"})
+            logger.error(f"Could not execute {exc.command} command.")
+            logger.error(str(exc))
+            self.r.xadd("supervisor_status", {"status": "Listening for commands"})
 
-            except Exception as exc:
-                self.r.xadd("supervisor_status",
-                    {"status": "Unhandled exception",
-                    "message": str(exc),
-                    "traceback": "Supervisor " + traceback.format_exc()})
-                logger.exception(f'Could not execute command. {repr(exc)}')
-                self.r.xadd("supervisor_status", {"status": "Listening for commands"})
\ No newline at end of file
+        except Exception as exc:
+            self.r.xadd("supervisor_status",
+                {"status": "Unhandled exception",
+                "message": str(exc),
+                "traceback": "Supervisor " + traceback.format_exc()})
+            logger.exception(f'Could not execute command. {repr(exc)}')
+            self.r.xadd("supervisor_status", {"status": "Listening for commands"})
+        return False
+
+    def run_job(self, job_id, data):
+        '''
+        Runs a command from the job queue, publishing its status to
+        supervisor_status
+
+        Parameters
+        ----------
+        job_id : str
+            ID of the supervisor_ipstream entry with the command
+        data : dict
+            supervisor_ipstream entry with the command
+        '''
+        with self.state_lock:
+            job = self.jobs[job_id]
+            job['status'] = 'running'
+        start = time.monotonic()
+        ok = False
+        try:
+            self.r.xadd("supervisor_status", {"status": "Job running",
+                                              "job": job_id,
+                                              "command": job['command']})
+            ok = self.report_errors(self.parseCommands, data)
+        finally:
+            # also reached when report_errors re-raises a ConnectionError
+            with self.state_lock:
+                job['status'] = 'completed' if ok else 'failed'
+                del self.jobs[job_id]
+            self.r.xadd("supervisor_status", {"status": f"Job {job['status']}",
+                                              "job": job_id,
+                                              "command": job['command'],
+                                              "elapsed_s": round(time.monotonic() - start, 3)})
+
+    def publish_jobs(self):
+        '''
+        Publishes the queued and running jobs to supervisor_status
+        '''
+        with self.state_lock:
+            jobs = json.dumps(self.jobs)
+        self.r.xadd("supervisor_status", {"status": "Jobs", "jobs": jobs})
+
+    def main(self):
+        asyncio.run(self.main_async())
+
+    async def main_async(self):
+        '''
+        Command loop. A single blocking XREAD waits for both commands on
+        supervisor_ipstream and booter statuses. Commands are queued as jobs
+        and run one at a time in order, except those in INLINE_COMMANDS,
+        which run immediately so they are not delayed by long jobs.
+        '''
+        loop = asyncio.get_running_loop()
+        # blocking reads and jobs each run on their own daemon thread, so
+        # SIGINT exits without waiting for a blocking read or a running job
+        reader = DaemonExecutor('reader')
+        job_executor = DaemonExecutor('jobs')
+        last_id = self.r.xrevrange("supervisor_ipstream", count=1)
+        last_id = last_id[0][0] if last_id else '0-0'
+        logger.info('Listening for commands')
+        self.r.xadd("supervisor_status", {"status": "Listening for commands"})
+        # futures of queued and running jobs, checked on every iteration so
+        # errors raised by jobs (e.g. a lost Redis connection) are not lost
+        job_futures = []
+        while(True):
+            try:
+                for future in [f for f in job_futures if f.done()]:
+                    job_futures.remove(future)
+                    exc = future.exception()
+                    if isinstance(exc, redis.exceptions.ConnectionError):
+                        raise exc
+                    if exc is not None:
+                        logger.error('Job failed unexpectedly: ' + repr(exc))
+                self.report_errors(self.check_rdb_save)
+                self.report_errors(self.check_export)
+                self.report_errors(self.publish_graph_if_due)
+                # poll more often while a save or export is in progress
+                busy = self.rdb_save is not None or self.export is not None
+                streams = {"supervisor_ipstream": last_id,
+                           "booter_status": self.booter_status_id}
+                replies = await loop.run_in_executor(
+                    reader,
+                    functools.partial(
+                        self.r_read.xread, streams,
+                        block=(int(PROGRESS_INTERVAL * 1000)
+                               if busy else 5000)))
+                for stream, entries in replies:
+                    if stream == b'booter_status':
+                        self.report_errors(self.process_booter_status, entries)
+                        continue
+                    for entry_id, data in entries:
+                        last_id = entry_id
+                        if b'commands' not in data:
+                            self.r.xadd("supervisor_status", {"status": "Invalid supervisor_ipstream entry", "message": "No 'commands' key found in the supervisor_ipstream entry"})
+                            logger.error("'commands' key not in supervisor_ipstream entry")
+                            self.r.xadd("supervisor_status", {"status": "Listening for commands"})
+                            continue
+                        cmd = data[b'commands'].decode('utf-8')
+                        if cmd.lower() in INLINE_COMMANDS:
+                            self.report_errors(self.parseCommands, data)
+                            continue
+                        job_id = entry_id.decode('utf-8')
+                        with self.state_lock:
+                            self.jobs[job_id] = {'command': cmd,
+                                                 'status': 'queued'}
+                        self.r.xadd("supervisor_status", {"status": "Job queued",
+                                                          "job": job_id,
+                                                          "command": cmd})
+                        job_futures.append(
+                            loop.run_in_executor(job_executor, self.run_job,
+                                                 job_id, data))
+            except redis.exceptions.ConnectionError as exc:
+                logger.error('Could not connect to Redis: ' + repr(exc))
+                sys.exit(0)
@@ -0,0 +1,101 @@
+"""
+Synthetic source node used by the supervisor's benchmarkGraph command in
+place of a graph's real source nodes. It writes random samples to its
+output streams at a fixed rate, with sync labels and monotonic times as
+described in doc/DataSyncGuidelines.md, so downstream latencies can be
+measured with brand.latency.
+
+Parameters:
+    output_streams : list of streams to write
+    rate : entries per second written to each stream
+    n_channels : channels per sample for streams without a schema
+        (default 96)
+    samp_per_entry : samples per entry for streams without a schema
+        (default 1)
+    sample_type : data type for streams without a schema (default 'int16')
+    sync_label : name of the sync label (default '<nickname>_clock')
+
+Streams defined in the graph's streams section get random data for each of
+their typed fields instead of a single 'samples' field.
+
+Usage:
+    python -m brand.synthetic -n <nickname> -i <host> -p <port>
+"""
+import json
+import time
+
+import numpy as np
+
+from .node import BRANDNode
+
+# distinct random payloads cycled through for each stream
+N_PAYLOADS = 16
+
+
+class SyntheticSource(BRANDNode):
+
+    def __init__(self):
+        super().__init__()
+        self.output_streams = self.parameters['output_streams']
+        if isinstance(self.output_streams, str):
+            self.output_streams = [self.output_streams]
+        # BRANDNode.run calls work() every run_period seconds
+        self.parameters['run_period'] = 1 / float(self.parameters['rate'])
+        self.sync_label = self.parameters.get('sync_label',
+                                              f'{self.NAME}_clock')
+        self.payloads = {
+            stream: self.make_payloads(stream)
+            for stream in self.output_streams
+        }
+        self.i = 0
+
+    def make_payloads(self, stream) -> list:
+        """
+        Generate random entry data for a stream
+
+        Parameters
+        ----------
+        stream : str
+            Name of the stream
+
+        Returns
+        -------
+        list
+            N_PAYLOADS dictionaries of encoded fields
+        """
+        rng = np.random.default_rng()
+        schema = self.stream_schemas.get(stream)
+        if schema is not None and schema.fields:
+            layouts = {
+                field.decode(): layout
+                for field, layout in schema.fields.items()
+            }
+        else:
+            dtype = np.dtype(self.parameters.get('sample_type', 'int16'))
+            shape = (int(self.parameters.get('samp_per_entry', 1)),
+                     int(self.parameters.get('n_channels', 96)))
+            layouts = {'samples': (dtype, shape)}
+        payloads = []
+        for _ in range(N_PAYLOADS):
+            payloads.append({
+                field: (rng.standard_normal(shape) * 100).astype(
+                    dtype).tobytes()
+                for field, (dtype, shape) in layouts.items()
+            })
+        return payloads
+
+    def work(self):
+        sync = json.dumps({self.sync_label: self.i})
+        ts = np.uint64(time.monotonic_ns()).tobytes()
+        for stream in self.output_streams:
+            entry = dict(self.payloads[stream][self.i % N_PAYLOADS])
+            entry['sync'] = sync
+            entry['ts'] = ts
+            self.xadd(stream, entry)
+        self.i += 1
+        self.count_entries()
+
+
+if __name__ == '__main__':
+    node = SyntheticSource()
+    node.run()
@@ -0,0 +1,405 @@
+"""
+Clock synchronization between the machines of a multi-machine graph. The
+monotonic clocks of different machines have unrelated origins and run at
+slightly different rates, so the supervisor's clock is used as the common
+timebase and each booter estimates the offset and drift of its own clock.
+
+Each booter runs a ClockSync thread that adds a ping to time_sync_ping with
+its machine name, a sequence number, and its monotonic time t1. The
+supervisor's TimeSyncResponder reads the ping at its monotonic time t2 and
+adds a pong to time_sync_pong with the ping's machine and sequence number,
+t2, and its monotonic time t3 just before the XADD. The booter reads the
+pong at its monotonic time t4. As in NTP, each ping gives:
+    offset = ((t2 - t1) + (t3 - t4)) / 2  (supervisor clock - booter clock)
+    delay = (t4 - t1) - (t3 - t2)         (round trip through Redis)
+
+Pings delayed by scheduling or Redis load give poor offsets, so of the last
+FILTER_SIZE samples only the one with the smallest delay is kept. Drift is
+the least-squares slope of the kept offsets over the last DRIFT_WINDOW
+estimates, once they span MIN_DRIFT_SPAN seconds. Estimates are published
+to the time_sync stream with these fields:
+    machine : name of the booter's machine
+    offset_ns : supervisor clock minus booter clock at t_ref_ns
+    drift_ppm : change of the offset, in ns per ms of booter time
+    t_ref_ns : booter monotonic time at which offset_ns was measured
+    delay_ns : round trip delay of the sample behind offset_ns
+    n_samples : number of pings answered so far
+
+brand.timing.to_supervisor_time uses an estimate to map a booter's
+monotonic times onto the supervisor's clock, and get_stream_offsets gets
+the estimate that applies to each stream in the supergraph.
+"""
+import collections
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .process import _as_list
+
+logger = logging.getLogger(__name__)
+
+PING_STREAM = 'time_sync_ping'
+PONG_STREAM = 'time_sync_pong'
+SYNC_STREAM = 'time_sync'
+# approximate length of the ping, pong, and estimate streams
+STREAM_MAXLEN = 1000
+DEFAULT_SYNC_INTERVAL = 1  # seconds
+# seconds to wait for a pong before giving up on a ping
+PONG_TIMEOUT = 1
+# number of samples among which the one with the smallest delay is kept
+FILTER_SIZE = 8
+# number of filtered offsets used to estimate the drift
+DRIFT_WINDOW = 64
+# the drift is assumed to be zero until the filtered offsets span this many
+# seconds, since fits over short spans are dominated by noise
+MIN_DRIFT_SPAN = 10
+
+
+class ClockEstimator():
+    """
+    NTP-style estimate of a clock's offset and drift from ping samples
+
+    Attributes
+    ----------
+    n_samples : int
+        Number of samples added
+    """
+
+    def __init__(self, filter_size=FILTER_SIZE, drift_window=DRIFT_WINDOW):
+        """
+        Parameters
+        ----------
+        filter_size : int, optional
+            Number of recent samples among which the one with the smallest
+            delay is used, by default FILTER_SIZE
+        drift_window : int, optional
+            Number of filtered offsets used to estimate the drift, by default
+            DRIFT_WINDOW
+        """
+        self.samples = collections.deque(maxlen=filter_size)
+        self.points = collections.deque(maxlen=drift_window)
+        self.n_samples = 0
+
+    def add_sample(self, t1, t2, t3, t4) -> dict:
+        """
+        Add the times of a ping and its pong and update the estimate
+
+        Parameters
+        ----------
+        t1 : int
+            Local time at which the ping was sent (ns)
+        t2 : int
+            Reference time at which the ping was received (ns)
+        t3 : int
+            Reference time at which the pong was sent (ns)
+        t4 : int
+            Local time at which the pong was received (ns)
+
+        Returns
+        -------
+        dict
+            Current estimate, with offset_ns, drift_ppm, t_ref_ns, delay_ns,
+            and n_samples
+        """
+        delay = (t4 - t1) - (t3 - t2)
+        offset = ((t2 - t1) + (t3 - t4)) // 2
+        t_ref = (t1 + t4) // 2
+        self.samples.append((delay, t_ref, offset))
+        self.n_samples += 1
+
+        best = min(self.samples)
+        # the same sample stays the best until a better one arrives or it
+        # leaves the filter
+        if not self.points or self.points[-1] != best:
+            self.points.append(best)
+        return self.estimate()
+
+    def estimate(self) -> dict:
+        """
+        Get the current estimate
+
+        Returns
+        -------
+        dict
+            offset_ns, drift_ppm, t_ref_ns, delay_ns, and n_samples, or None
+            if no samples were added
+        """
+        if not self.points:
+            return None
+        delay, t_ref, offset = self.points[-1]
+        drift = 0.0
+        t_refs = np.array([p[1] for p in self.points], dtype=np.float64)
+        if np.ptp(t_refs) >= MIN_DRIFT_SPAN * 1e9:
+            offsets = np.array([p[2] for p in self.points], dtype=np.float64)
+            # fit relative to the latest point to keep the values small
+            drift, intercept = np.polyfit(t_refs - t_ref, offsets - offset, 1)
+            offset += int(round(intercept))
+        return {
+            'offset_ns': int(offset),
+            'drift_ppm': float(drift * 1e6),
+            't_ref_ns': int(t_ref),
+            'delay_ns': int(delay),
+            'n_samples': self.n_samples
+        }
+
+
+class ClockSync():
+    """
+    Background thread run by a booter that pings the supervisor and
+    publishes estimates of the offset and drift of the booter's clock
+    """
+
+    def __init__(self, r, machine, interval=DEFAULT_SYNC_INTERVAL,
+                 logger=logger, r_read=None):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        machine : str
+            Name of this machine
+        interval : float, optional
+            Seconds between pings, by default DEFAULT_SYNC_INTERVAL
+        logger : logging.Logger, optional
+            Logger for sync errors
+        r_read : redis.Redis, optional
+            Client for the blocking reads of pongs, by default `r`
+        """
+        self.r = r
+        self.r_read = r if r_read is None else r_read
+        self.machine = machine
+        self.interval = interval
+        self.logger = logger
+        self.estimator = ClockEstimator()
+        self.seq = 0
+        self._pong_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ping(self) -> dict:
+        """
+        Send a ping and wait for the supervisor's pong
+
+        Returns
+        -------
+        dict
+            Updated estimate, or None if no pong arrived within
+            PONG_TIMEOUT
+        """
+        if self._pong_id is None:
+            last = self.r.xrevrange(PONG_STREAM, count=1)
+            self._pong_id = last[0][0] if last else '0-0'
+        self.seq += 1
+        seq = str(self.seq).encode()
+        machine = self.machine.encode()
+        deadline = time.monotonic() + PONG_TIMEOUT
+        t1 = time.monotonic_ns()
+        self.r.xadd(PING_STREAM, {
+            'machine': machine,
+            'seq': seq,
+            't1': t1
+        },
+                    maxlen=STREAM_MAXLEN,
+                    approximate=True)
+        while True:
+            block_ms = int((deadline - time.monotonic()) * 1000)
+            if block_ms <= 0:
+                return None
+            replies = self.r_read.xread({PONG_STREAM: self._pong_id},
+                                        block=block_ms)
+            t4 = time.monotonic_ns()
+            if not replies:
+                return None
+            for entry_id, entry in replies[0][1]:
+                self._pong_id = entry_id
+                if entry[b'machine'] == machine and entry[b'seq'] == seq:
+                    return self.estimator.add_sample(
+                        t1, int(entry[b't2']), int(entry[b't3']), t4)
+
+    def sync(self) -> dict:
+        """
+        Ping the supervisor once and publish the new estimate
+
+        Returns
+        -------
+        dict
+            Published estimate, or None if the ping was not answered
+        """
+        estimate = self.ping()
+        if estimate is not None:
+            self.r.xadd(SYNC_STREAM, {
+                'machine': self.machine,
+                **estimate
+            },
+                        maxlen=STREAM_MAXLEN,
+                        approximate=True)
+        return estimate
+
+    def _run(self):
+        missed = False
+        while not self._stop.is_set():
+            try:
+                estimate = self.sync()
+            except Exception as exc:
+                self.logger.exception(f'Clock sync failed: {repr(exc)}')
+                estimate = None
+            # only log the first of a run of unanswered pings
+            if estimate is None and not missed:
+                self.logger.warning('No time sync reply from the supervisor')
+            missed = estimate is None
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """
+        Start syncing in a background thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='clock-sync',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+class TimeSyncResponder():
+    """
+    Background thread run by the supervisor that answers the booters'
+    pings with its monotonic clock times
+    """
+
+    def __init__(self, r, r_read=None):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        r_read : redis.Redis, optional
+            Client for the blocking reads of pings, by default `r`
+        """
+        self.r = r
+        self.r_read = r if r_read is None else r_read
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        last_id = '$'
+        while not self._stop.is_set():
+            try:
+                replies = self.r_read.xread({PING_STREAM: last_id},
+                                            block=500)
+                t2 = time.monotonic_ns()
+                if not replies:
+                    continue
+                p = self.r.pipeline(transaction=False)
+                for entry_id, entry in replies[0][1]:
+                    last_id = entry_id
+                    p.xadd(PONG_STREAM, {
+                        'machine': entry[b'machine'],
+                        'seq': entry[b'seq'],
+                        't2': t2,
+                        't3': time.monotonic_ns()
+                    },
+                           maxlen=STREAM_MAXLEN,
+                           approximate=True)
+                p.execute()
+            except Exception as exc:
+                logger.exception(f'Answering time sync pings failed: '
+                                 f'{repr(exc)}')
+                self._stop.wait(1)
+
+    def start(self):
+        """
+        Start answering pings in a background thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='time-sync',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+def get_clock_offsets(r, count=STREAM_MAXLEN) -> dict:
+    """
+    Get the latest clock estimate of each machine
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+    count : int, optional
+        Number of recent time_sync entries to search, by default
+        STREAM_MAXLEN
+
+    Returns
+    -------
+    dict
+        Machine names mapped to estimates with offset_ns, drift_ppm,
+        t_ref_ns, delay_ns, and n_samples
+    """
+    offsets = {}
+    for _, entry in r.xrevrange(SYNC_STREAM, count=count):
+        machine = entry[b'machine'].decode()
+        if machine in offsets:
+            continue
+        offsets[machine] = {
+            'offset_ns': int(entry[b'offset_ns']),
+            'drift_ppm': float(entry[b'drift_ppm']),
+            't_ref_ns': int(entry[b't_ref_ns']),
+            'delay_ns': int(entry[b'delay_ns']),
+            'n_samples': int(entry[b'n_samples'])
+        }
+    return offsets
+
+
+def get_stream_offsets(r) -> dict:
+    """
+    Get the clock estimate that applies to each stream written by a node on
+    a booter's machine, according to the latest supergraph and the nodes'
+    redis_outputs
+
+    Parameters
+    ----------
+    r : redis.Redis
+        instance of the redis.Redis interface
+
+    Returns
+    -------
+    dict
+        Stream names (bytes) mapped to estimates, for streams written on
+        machines with an estimate
+    """
+    offsets = get_clock_offsets(r)
+    supergraph = r.xrevrange('supergraph_stream', count=1)
+    if not offsets or not supergraph:
+        return {}
+    model = json.loads(supergraph[0][1][b'data'])
+    stream_offsets = {}
+    for node_cfg in model.get('nodes', {}).values():
+        machine = node_cfg.get('machine')
+        if machine not in offsets:
+            continue
+        for stream in _as_list(node_cfg.get('redis_outputs')):
+            stream_offsets[stream.encode()] = offsets[machine]
+    return stream_offsets
@@ -3,10 +3,17 @@ import time
 from ctypes import Structure, c_long, pointer
 from datetime import datetime
 
+import numpy as np
+
 TIMEVAL_LEN = 16  # bytes
 TIMESPEC_LEN = 16  # bytes
 TIMER_ABSTIME = 1
 
+# NumPy equivalents of the timeval and timespec structs, for decoding many
+# packed structs at once
+TIMEVAL_DTYPE = np.dtype([('tv_sec', np.int64), ('tv_usec', np.int64)])
+TIMESPEC_DTYPE = np.dtype([('tv_sec', np.int64), ('tv_nsec', np.int64)])
+
 libc = ctypes.CDLL('libc.so.6')
 
 
@@ -52,6 +59,101 @@ def clock_nanosleep(time_ns, clock=time.CLOCK_REALTIME):
     return out
 
 
+class PeriodicTimer():
+    """
+    Timer for running a loop at a fixed period. Each call to `wait` sleeps
+    until an absolute deadline with clock_nanosleep, so timing errors do not
+    accumulate across iterations. Overruns and wake-up jitter are recorded.
+
+    Attributes
+    ----------
+    period_ns : int
+        Loop period in nanoseconds
+    n_iterations : int
+        Number of calls to `wait`
+    n_overruns : int
+        Number of iterations that started after their deadline
+    n_skipped : int
+        Number of deadlines that were skipped because a whole period was
+        missed
+    jitter_max_ns : int
+        Largest delay between a deadline and the wake-up time
+    jitter_sum_ns : int
+        Sum of the delays between deadlines and wake-up times
+    """
+
+    def __init__(self, period_ns, clock=time.CLOCK_MONOTONIC):
+        """
+        Parameters
+        ----------
+        period_ns : int
+            Loop period in nanoseconds
+        clock : int, optional
+            Clock used for the deadlines, by default time.CLOCK_MONOTONIC
+        """
+        self.period_ns = int(period_ns)
+        self.clock = clock
+        self.deadline = time.clock_gettime_ns(clock) + self.period_ns
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the overrun and jitter statistics
+        """
+        self.n_iterations = 0
+        self.n_overruns = 0
+        self.n_skipped = 0
+        self.jitter_max_ns = 0
+        self.jitter_sum_ns = 0
+
+    def wait(self):
+        """
+        Sleep until the next deadline
+
+        Returns
+        -------
+        jitter : int
+            Delay (in nanoseconds) between the deadline and the wake-up time
+        """
+        now = time.clock_gettime_ns(self.clock)
+        if now > self.deadline:
+            # the previous iteration overran, so skip any fully missed periods
+            self.n_overruns += 1
+            n_missed = (now - self.deadline) // self.period_ns
+            self.deadline += n_missed * self.period_ns
+            self.n_skipped += n_missed
+        else:
+            clock_nanosleep(self.deadline, clock=self.clock)
+            now = time.clock_gettime_ns(self.clock)
+
+        jitter = now - self.deadline
+        self.n_iterations += 1
+        self.jitter_sum_ns += jitter
+        self.jitter_max_ns = max(self.jitter_max_ns, jitter)
+
+        self.deadline += self.period_ns
+        return jitter
+
+    def stats(self) -> dict:
+        """
+        Get the overrun and jitter statistics
+
+        Returns
+        -------
+        dict
+            Number of iterations, overruns, and skipped deadlines, and the
+            mean and max jitter in nanoseconds
+        """
+        n_iter = max(self.n_iterations, 1)
+        return {
+            'iterations': self.n_iterations,
+            'overruns': self.n_overruns,
+            'skipped': self.n_skipped,
+            'jitter_mean_ns': self.jitter_sum_ns // n_iter,
+            'jitter_max_ns': self.jitter_max_ns,
+        }
+
+
 def timeval_to_datetime(val):
     """
     Convert a C timeval object to a Python datetime
@@ -103,9 +205,153 @@ def timespec_to_timestamp(val):
     return timestamp
 
 
+def _unpack_structs(vals, dtype) -> np.ndarray:
+    """
+    View packed C structs as a structured array, ignoring trailing bytes
+    that do not form a whole struct
+    """
+    n_structs = len(vals) // dtype.itemsize
+    return np.frombuffer(vals, dtype=dtype, count=n_structs)
+
+
+def timevals_to_array(vals, unit='s') -> np.ndarray:
+    """
+    Convert packed C timeval objects to an array of times
+    Parameters
+    ----------
+    vals : bytes
+        timeval objects encoded as bytes
+    unit : {'s', 'ns'}, optional
+        Return float64 seconds ('s', the default) or int64 nanoseconds
+        ('ns')
+    Returns
+    -------
+    np.ndarray
+        Times in units of `unit`
+    """
+    tv = _unpack_structs(vals, TIMEVAL_DTYPE)
+    if unit == 's':
+        return tv['tv_sec'] + tv['tv_usec'] * 1e-6
+    if unit == 'ns':
+        return tv['tv_sec'] * 1_000_000_000 + tv['tv_usec'] * 1000
+    raise ValueError(f"unit must be 's' or 'ns', got {unit!r}")
+
+
+def timespecs_to_array(vals, unit='s') -> np.ndarray:
+    """
+    Convert packed C timespec objects to an array of times
+    Parameters
+    ----------
+    vals : bytes
+        timespec objects encoded as bytes
+    unit : {'s', 'ns'}, optional
+        Return float64 seconds ('s', the default) or int64 nanoseconds
+        ('ns')
+    Returns
+    -------
+    np.ndarray
+        Times in units of `unit`
+    """
+    ts = _unpack_structs(vals, TIMESPEC_DTYPE)
+    if unit == 's':
+        return ts['tv_sec'] + ts['tv_nsec'] * 1e-9
+    if unit == 'ns':
+        return ts['tv_sec'] * 1_000_000_000 + ts['tv_nsec']
+    raise ValueError(f"unit must be 's' or 'ns', got {unit!r}")
+
+
+def monotonic_ns_to_array(vals, unit='ns') -> np.ndarray:
+    """
+    Convert packed monotonic clock times, stored as unsigned 64-bit integers
+    in nanoseconds (see doc/DataSyncGuidelines.md), to an array
+    Parameters
+    ----------
+    vals : bytes
+        uint64 times encoded as bytes
+    unit : {'ns', 's'}, optional
+        Return uint64 nanoseconds ('ns', the default) or float64 seconds
+        ('s')
+    Returns
+    -------
+    np.ndarray
+        Times in units of `unit`
+    """
+    ns = np.frombuffer(vals, dtype=np.uint64, count=len(vals) // 8)
+    if unit == 'ns':
+        return ns
+    if unit == 's':
+        return ns * 1e-9
+    raise ValueError(f"unit must be 's' or 'ns', got {unit!r}")
+
+
+def to_supervisor_time(t_ns, estimate=None):
+    """
+    Map monotonic times of a booter's machine onto the supervisor's
+    monotonic clock
+    Parameters
+    ----------
+    t_ns : int or array_like
+        Monotonic times (in nanoseconds) measured on the booter's machine
+    estimate : dict, optional
+        Clock estimate of the machine, with offset_ns, drift_ppm, and
+        t_ref_ns, as published to the time_sync stream by brand.timesync.
+        If None, the times are assumed to come from the supervisor's
+        machine and are returned unchanged.
+    Returns
+    -------
+    int or np.ndarray
+        Times on the supervisor's clock in nanoseconds (int64 for arrays)
+    """
+    if estimate is None:
+        return t_ns
+    t = np.asarray(t_ns, dtype=np.int64)
+    offset = estimate['offset_ns'] + np.round(
+        (t - estimate['t_ref_ns']) * (estimate['drift_ppm'] * 1e-6))
+    mapped = t + offset.astype(np.int64)
+    if mapped.ndim == 0:
+        return int(mapped)
+    return mapped
+
+
+TIME_DECODERS = {
+    'monotonic_ns': monotonic_ns_to_array,
+    'timeval': timevals_to_array,
+    'timespec': timespecs_to_array,
+}
+
+
+def entries_to_times(entries, key=b'ts', fmt='monotonic_ns', unit='ns'):
+    """
+    Decode a time key in a list of stream entries with a single vectorized
+    conversion
+    Parameters
+    ----------
+    entries : list
+        Stream entries as returned by XRANGE or XREAD, i.e. (entry ID,
+        entry dict) pairs
+    key : bytes, optional
+        Time key in each entry, by default b'ts'
+    fmt : {'monotonic_ns', 'timeval', 'timespec'}, optional
+        How the time is encoded, by default 'monotonic_ns'. Each entry must
+        hold one time.
+    unit : {'ns', 's'}, optional
+        Return nanoseconds ('ns', the default) or float64 seconds ('s')
+    Returns
+    -------
+    np.ndarray
+        One time per entry
+    """
+    if fmt not in TIME_DECODERS:
+        raise ValueError(f'fmt must be one of {list(TIME_DECODERS)}, '
+                         f'got {fmt!r}')
+    vals = b''.join([entry[key] for _, entry in entries])
+    return TIME_DECODERS[fmt](vals, unit)
+
+
 def timevals_to_timestamps(vals):
     """
-    Convert a list of C timeval objects to a list of timestamps (in seconds)
+    Convert a list of C timeval objects to a list of timestamps (in seconds).
+    Use `timevals_to_array` to get an array instead.
     Parameters
     ----------
     vals : bytes
@@ -115,18 +361,13 @@ def timevals_to_timestamps(vals):
     list
         List of timestamps in units of seconds
     """
-    tlen = TIMEVAL_LEN
-    n_timevals = int(len(vals) / tlen)
-    ts = [
-        timeval_to_timestamp(vals[i * tlen:(i + 1) * tlen])
-        for i in range(n_timevals)
-    ]
-    return ts
+    return timevals_to_array(vals).tolist()
 
 
 def timespecs_to_timestamps(vals):
     """
-    Convert a list of C timespec objects to a list of timestamps (in seconds)
+    Convert a list of C timespec objects to a list of timestamps (in
+    seconds). Use `timespecs_to_array` to get an array instead.
     Parameters
     ----------
     vals : bytes
@@ -136,10 +377,4 @@ def timespecs_to_timestamps(vals):
     list
         List of timestamps in units of seconds
     """
-    tlen = TIMESPEC_LEN
-    n_timespecs = int(len(vals) / tlen)
-    ts = [
-        timespec_to_timestamp(vals[i * tlen:(i + 1) * tlen])
-        for i in range(n_timespecs)
-    ]
-    return ts
+    return timespecs_to_array(vals).tolist()
@@ -1,6 +1,123 @@
-import redis
 import yaml
 import argparse
+import copy
+import hashlib
+import os
+import pickle
+import shlex
+
+# brand.connection (redis) and brand.schema (NumPy) are imported by the
+# functions that need them, so that queries from shell scripts, which only
+# read the YAML file, start quickly
+
+# use the C-accelerated loader when libyaml is available
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+CACHE_DIR = os.environ.get(
+    'BRAND_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache',
+                                    'brand', 'graphs'))
+
+
+# -----------------------------------------------------------
+class GraphIndex():
+    """
+    Parsed graph settings file, indexed for fast lookups
+
+    Attributes
+    ----------
+    data : dict
+        Full contents of the YAML file
+    nodes : dict
+        Node names (without extension) mapped to their settings
+    stages : dict
+        Lower-case stage names mapped to the names of their nodes
+    streams : dict
+        Stream names mapped to their settings
+    """
+
+    def __init__(self, data):
+        """
+        Parameters
+        ----------
+        data : dict
+            Contents of the YAML file
+        """
+        self.data = data
+        self.nodes = {}
+        self.stages = {}
+        for node in data.get('Nodes') or []:
+            self.nodes.setdefault(node['Name'].split('.')[0], node)
+            if 'Stage' in node:
+                self.stages.setdefault(node['Stage'].lower(),
+                                       []).append(node['Name'])
+        self.streams = data.get('RedisStreams') or {}
+        self.parameters = {
+            record['name']: record['value']
+            for record in data.get('parameters') or []
+        }
+
+
+_graph_indexes = {}
+
+
+def load_graph_index(yaml_path, use_cache=True) -> GraphIndex:
+    """
+    Load a graph settings file. Parsed files are cached in memory and in
+    CACHE_DIR (set with the BRAND_CACHE_DIR environment variable), keyed by
+    the file's modification time and hash, so each file is only parsed once.
+
+    Parameters
+    ----------
+    yaml_path : str
+        Path of the YAML file
+    use_cache : bool, optional
+        If False, always parse the file, by default True
+
+    Returns
+    -------
+    GraphIndex
+        Indexed contents of the file. The index is shared by all callers, so
+        it must not be modified; the get_* functions return copies.
+    """
+    path = os.path.abspath(yaml_path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if use_cache and _graph_indexes.get(path, (None, ))[0] == key:
+        return _graph_indexes[path][1]
+
+    cache_path = os.path.join(
+        CACHE_DIR, hashlib.sha1(path.encode()).hexdigest() + '.pickle')
+    cached = None
+    if use_cache:
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            pass
+
+    if cached is not None and cached['key'] == key:
+        data = cached['data']
+    else:
+        with open(path, 'rb') as f:
+            contents = f.read()
+        digest = hashlib.sha1(contents).hexdigest()
+        if cached is not None and cached['hash'] == digest:
+            data = cached['data']
+        else:
+            data = yaml.load(contents, Loader=SafeLoader)
+        if use_cache:
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(cache_path + '.tmp', 'wb') as f:
+                    pickle.dump({'key': key, 'hash': digest, 'data': data},
+                                f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_path + '.tmp', cache_path)
+            except OSError:
+                pass  # caching is best-effort
+
+    index = GraphIndex(data)
+    _graph_indexes[path] = (key, index)
+    return index
 
 # -----------------------------------------------------------
 def get_parameter_value(yaml_path, field):
@@ -19,12 +136,7 @@ def get_parameter_value(yaml_path, field):
     object
         Value of the parameter
     """
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
-
-    for record in yamlData['parameters']:
-        if record['name'] == field:
-            return record['value']
+    return copy.deepcopy(load_graph_index(yaml_path).parameters.get(field))
 
 
 # -----------------------------------------------------------
@@ -46,12 +158,9 @@ def get_node_parameter_value(yaml_path, node, field):
     object
         Value of the parameter
     """
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
-
-    for node_list in yamlData['Nodes']:
-        if node_list['Name'].split('.')[0] == node:
-            return node_list['Parameters'][field]
+    graph = load_graph_index(yaml_path)
+    if node in graph.nodes:
+        return copy.deepcopy(graph.nodes[node]['Parameters'][field])
 
 
 # -----------------------------------------------------------
@@ -72,15 +181,13 @@ def get_node_parameter_dump(yaml_path, node):
         All parameters in "parameter" section
         for given node
     """
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f) # load the parameters file
+    graph = load_graph_index(yaml_path)
 
-        if node is not None:        # if we got a node name, return its parameters
-            for node_list in yamlData['Nodes']:
-                if node_list['Name'].split('.')[0] == node:
-                    return node_list['Parameters']
-        else:                       # otherwise, return the full "nodes" dictionary
-            return yamlData['Nodes']
+    if node is not None:        # if we got a node name, return its parameters
+        if node in graph.nodes:
+            return copy.deepcopy(graph.nodes[node]['Parameters'])
+    else:                       # otherwise, return the full "nodes" dictionary
+        return copy.deepcopy(graph.data['Nodes'])
 
 
 # -----------------------------------------------------------
@@ -100,24 +207,23 @@ def initializeRedisFromYAML(yaml_path, processName=None):
     redis.Redis
         Instance of the redis.Redis class
     """
+    from .connection import connect
+
     pname = f"[{processName}] " if processName is not None else ""
     print(f"{pname}connecting to Redis using: {yaml_path}")
 
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
-
-    redis_params = yamlData['RedisConnection']
+    redis_params = load_graph_index(yaml_path).data['RedisConnection']
     # connect to redis, figure out the streams of interest
     if ('redis_realtime_socket' in redis_params
             and redis_params['redis_realtime_socket'] is not None):
         redis_socket = redis_params['redis_realtime_socket']
         print(f'{pname}Redis Socket Path {redis_socket}')
-        r = redis.Redis(unix_socket_path=redis_socket)
+        r = connect(socket_path=redis_socket)
     else:
         redis_ip = redis_params['redis_realtime_ip']
         redis_port = redis_params['redis_realtime_port']
         print(f'{pname}Redis IP: {redis_ip}, Redis port: {redis_port}')
-        r = redis.Redis(host=redis_ip, port=redis_port)
+        r = connect(redis_ip, redis_port)
 
     print(f"{pname}Initialized Redis")
 
@@ -144,11 +250,8 @@ def get_redis_info(yaml_path,field):
     string
         ip or port address
     """
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
-        returnValue = yamlData['RedisConnection'][field]
-
-    return returnValue
+    return copy.deepcopy(
+        load_graph_index(yaml_path).data['RedisConnection'][field])
 
 
 # -----------------------------------------------------------
@@ -176,27 +279,27 @@ def get_node_io(yaml_path,node):
     redis_outputs = None
 
 
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
+    graph = load_graph_index(yaml_path)
 
+    # get the list of inputs and outputs for the matching node
+    if node in graph.nodes:
+        node_data = graph.nodes[node]
+        redis_inputs = node_data['redis_inputs']
+        redis_outputs = node_data['redis_outputs']
+        if type(redis_inputs) is str:
+            redis_inputs = [redis_inputs]
+        if type(redis_outputs) is str:
+            redis_outputs = [redis_outputs]
 
-        # get the list of inputs and outputs for the matching node
-        for node_data in yamlData['Nodes']:
-            if node_data['Name'].split('.')[0] == node:
-                redis_inputs = node_data['redis_inputs']
-                redis_outputs = node_data['redis_outputs']
-                if type(redis_inputs) is str:
-                    redis_inputs = [redis_inputs]
-                if type(redis_outputs) is str:
-                    redis_outputs = [redis_outputs]
+    if redis_inputs is not None:
+        for in_stream in redis_inputs:
+            io['redis_inputs'][in_stream] = copy.deepcopy(
+                graph.streams[in_stream])
+    if redis_outputs is not None:
+        for out_stream in redis_outputs:
+            io['redis_outputs'][out_stream] = copy.deepcopy(
+                graph.streams[out_stream])
 
-        if redis_inputs is not None:
-            for in_stream in redis_inputs:
-                io['redis_inputs'][in_stream] = yamlData['RedisStreams'][in_stream]
-        if redis_outputs is not None:
-            for out_stream in redis_outputs:
-                io['redis_outputs'][out_stream] = yamlData['RedisStreams'][out_stream]
-                
     return io
 
 # -----------------------------------------------------------
@@ -234,25 +337,19 @@ def unpack_string(yaml_path, stream):
     """
     Helper function to create a string for the pack/unpack struct
     functions for python to read from data written in C. Uses
-    the sample_type field in the graph settings yaml
+    the sample_type field in the graph settings yaml, which can be
+    any NumPy dtype name or C type name (see brand.schema)
     """
+    from .schema import get_dtype
 
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
-
-    sample_type = yamlData['RedisStreams'][stream]['sample_type']
-    num_chans = yamlData['RedisStreams'][stream]['chan_per_stream']
-    num_samp = yamlData['RedisStreams'][stream]['samp_per_stream']
+    stream_info = load_graph_index(yaml_path).streams[stream]
+    sample_type = stream_info['sample_type']
+    num_chans = stream_info['chan_per_stream']
+    num_samp = stream_info['samp_per_stream']
     
-    if sample_type in ['int16', 'short']:
-        packString = 'h'
-    elif sample_type in ['int32', 'int', 'Int']:
-        packString = 'i'
-    elif sample_type in ['uInt32', 'uInt']:
-        packString = 'I'
-    elif sample_type == 'char':
-        packString = 'b'
-    else:
+    try:
+        packString = get_dtype(sample_type).char
+    except TypeError:
         return -1
 
     # output string = <#values><var type> -- 10I, 960h etc
@@ -268,15 +365,9 @@ def node_stage(yaml_path, stage):
     with that stage of the run process
     """
     
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
-
     # return the list of node names that match the desired stage
-    stage_nodes = []
-    for nodes in yamlData['Nodes']:
-        if nodes['Stage'].lower() == stage.lower():
-            stage_nodes.append(nodes['Name'])
-    
+    stage_nodes = load_graph_index(yaml_path).stages.get(stage.lower(), [])
+
     return ' '.join(stage_nodes) # create a single string of all of the items with spaces between -- for bash convenience
 
 # -----------------------------------------------------------
@@ -298,12 +389,58 @@ def get_node_module(yaml_path, node_name):
         Module name for node
     """
 
-    with open(yaml_path, 'r') as f:
-        yamlData = yaml.safe_load(f)
+    graph = load_graph_index(yaml_path)
+    if node_name in graph.nodes:
+        return graph.nodes[node_name]['Module']
+
+# -----------------------------------------------------------
+# answer several queries at once -- for Bash usage
+def shell_queries(yaml_path, queries):
+    """
+    Answer several queries about a graph settings file at once, as shell
+    variable assignments. Use with `eval` to set all variables with a
+    single call, e.g.:
+
+        eval "$(python -m brand.tools graph.yaml --shell IP=ip PORT=port \
+            MAIN=stage/main GAIN=param/decoder/gain)"
+
+    Parameters
+    ----------
+    yaml_path : str
+        Path of the YAML file
+    queries : list of str
+        Queries in the form VARIABLE=QUERY, where QUERY is one of: ip, port,
+        name/<name>, param/<node>/<name>, module/<node>, stage/<stage>,
+        unpack/<stream>
+
+    Returns
+    -------
+    str
+        One VARIABLE='value' assignment per line
+    """
+    lines = []
+    for query in queries:
+        variable, _, spec = query.partition('=')
+        kind, *args = spec.split('/')
+        if kind == 'ip':
+            value = get_redis_info(yaml_path, 'redis_realtime_ip')
+        elif kind == 'port':
+            value = get_redis_info(yaml_path, 'redis_realtime_port')
+        elif kind == 'name':
+            value = get_parameter_value(yaml_path, *args)
+        elif kind == 'param':
+            value = get_node_parameter_value(yaml_path, *args)
+        elif kind == 'module':
+            value = get_node_module(yaml_path, *args)
+        elif kind == 'stage':
+            value = node_stage(yaml_path, *args)
+        elif kind == 'unpack':
+            value = unpack_string(yaml_path, *args)
+        else:
+            raise ValueError(f'Unknown query: {query}')
+        lines.append(f'{variable}={shlex.quote(str(value))}')
+    return '\n'.join(lines)
 
-    for node in yamlData['Nodes']:
-        if node['Name'].split('.')[0] == node_name:
-            return node['Module']
 
 # -----------------------------------------------------------
 # running the function as a script -- for C and Bash usage
@@ -330,13 +467,18 @@ def main():
     parser.add_argument('file', default="", type=str, help='The YAML file to be loaded')
     parser.add_argument('--redis', help="Return the port and ip for the redis instance")
     parser.add_argument('--stage', type=str, help="Returns list of Start, Main or End modules")
+    parser.add_argument('--shell', nargs='+', metavar='VARIABLE=QUERY',
+                        help="Answer several queries as shell variable assignments "
+                        "(see brand.tools.shell_queries)")
     redisGroup = parser.add_mutually_exclusive_group()
     redisGroup.add_argument('--ip', help='IP for the redis instance', action="store_true")
     redisGroup.add_argument('--port', help='port for the redis instance',  action="store_true")
 
     args = parser.parse_args()
 
-    if args.ip:
+    if args.shell:
+        print(shell_queries(args.file, args.shell))
+    elif args.ip:
         print(get_redis_info(args.file,'redis_realtime_ip'))
     elif args.port:
         print(get_redis_info(args.file,'redis_realtime_port'))
@@ -0,0 +1,263 @@
+"""
+Pool of pre-started Python worker processes for launching Python nodes.
+Each worker imports the heavy modules used by nodes (NumPy, redis, and
+brand) ahead of time, then waits for a single launch command on its stdin.
+When it receives one, it applies the node's CPU affinity and real-time
+priority, and runs the node's script in place with runpy, so the node
+starts without paying for interpreter startup and imports.
+
+Workers are started with the booter's CPU affinity and normal scheduling,
+so their imports never compete at real-time priority with running nodes.
+The node's configuration is only applied, with os.sched_setaffinity and
+os.sched_setscheduler, once the worker receives the node. It is applied to
+every thread of the worker, including those started by the preloaded
+modules (e.g. OpenBLAS threads started when NumPy is imported), so the
+node runs as if it had been launched with taskset and chrt.
+
+Launch command (one JSON line on the worker's stdin):
+    {"script": <path>, "args": [<argv[1:]>], "cpu_affinity": <str or
+    null>, "run_priority": <int or null>}
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# modules imported by every worker before it waits for a command
+PRELOAD_MODULES = ('numpy', 'redis', 'brand')
+# run with -c rather than -m, since the brand package imports this module
+WORKER_CODE = 'import sys; from brand.warmpool import run_worker; ' \
+    'run_worker(sys.argv[1:])'
+
+
+def is_python_node(binary) -> bool:
+    """
+    Check whether a node executable is a Python script that can be run by a
+    warm worker
+
+    Parameters
+    ----------
+    binary : str
+        Path to the node executable
+
+    Returns
+    -------
+    bool
+        True if the file starts with a Python shebang
+    """
+    try:
+        with open(binary, 'rb') as f:
+            first_line = f.readline(256)
+    except OSError:
+        return False
+    return first_line.startswith(b'#!') and b'python' in first_line
+
+
+def parse_cpu_list(cpu_list) -> set:
+    """
+    Parse a CPU list in the format used by taskset -c (e.g. '0-3,6')
+
+    Parameters
+    ----------
+    cpu_list : str or int
+        CPU list
+
+    Returns
+    -------
+    set
+        CPU numbers
+    """
+    cpus = set()
+    for part in str(cpu_list).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+class WarmPool():
+    """
+    Pre-started Python worker processes that run Python nodes on demand
+
+    Attributes
+    ----------
+    size : int
+        Minimum number of workers that are kept ready
+    idle : list
+        Idle workers (subprocess.Popen instances)
+    """
+
+    def __init__(self, size, preload=(), python=sys.executable):
+        """
+        Parameters
+        ----------
+        size : int
+            Minimum number of workers that are kept ready
+        preload : list, optional
+            Modules imported by the workers in addition to PRELOAD_MODULES
+        python : str, optional
+            Python interpreter used for the workers, by default the one
+            running this process
+        """
+        self.size = size
+        self.preload = list(PRELOAD_MODULES) + list(preload)
+        self.python = python
+        self.idle = []
+
+    def spawn(self):
+        """
+        Start a worker with normal scheduling
+
+        Returns
+        -------
+        proc : subprocess.Popen
+            The worker's process
+        """
+        args = [self.python, '-c', WORKER_CODE] + self.preload
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE)
+        self.idle.append(proc)
+        return proc
+
+    def _reap(self):
+        # drop workers that exited while idle
+        for proc in [p for p in self.idle if p.poll() is not None]:
+            logger.warning(f'Warm worker (pid: {proc.pid}) exited with '
+                           f'code {proc.returncode} while idle')
+            self.idle.remove(proc)
+
+    def fill(self, n_nodes=0):
+        """
+        Start workers until there are `size` idle workers, or one for each
+        Python node expected to be launched next if there are more of them.
+        Extra idle workers are stopped.
+
+        Parameters
+        ----------
+        n_nodes : int, optional
+            Number of Python nodes expected to be launched next, e.g. from
+            the current graph
+        """
+        self._reap()
+        wanted = max(self.size, n_nodes)
+        while len(self.idle) > wanted:
+            _stop_worker(self.idle.pop())
+        for _ in range(wanted - len(self.idle)):
+            self.spawn()
+
+    def launch(self, script, args, cpu_affinity=None, run_priority=None):
+        """
+        Run a Python node in an idle worker
+
+        Parameters
+        ----------
+        script : str
+            Path to the node's Python script
+        args : list
+            Command-line arguments for the node
+        cpu_affinity : str, optional
+            CPU list for the node, in the format used by taskset -c
+        run_priority : int, optional
+            SCHED_FIFO priority for the node
+
+        Returns
+        -------
+        proc : subprocess.Popen or None
+            The worker's process, which is now running the node, or None if
+            no worker is available
+        """
+        self._reap()
+        if not self.idle:
+            return None
+        proc = self.idle.pop(0)
+        command = {
+            'script': script,
+            'args': [str(arg) for arg in args],
+            'cpu_affinity': str(cpu_affinity) if cpu_affinity else None,
+            'run_priority': int(run_priority) if run_priority else None
+        }
+        try:
+            proc.stdin.write(json.dumps(command).encode() + b'\n')
+            proc.stdin.close()
+        except BrokenPipeError:
+            logger.warning(f'Warm worker (pid: {proc.pid}) exited before '
+                           'receiving a node')
+            return None
+        return proc
+
+    def close(self):
+        """
+        Stop all idle workers
+        """
+        for proc in self.idle:
+            _stop_worker(proc)
+        self.idle = []
+
+
+def _stop_worker(proc):
+    # idle workers exit when their stdin is closed
+    if proc.poll() is None:
+        proc.stdin.close()
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _for_threads(threads, func, *args):
+    for tid in threads:
+        try:
+            func(tid, *args)
+        except ProcessLookupError:
+            pass  # the thread exited
+
+
+def run_worker(preload):
+    """
+    Import modules, wait for a launch command on stdin, and run the node
+
+    Parameters
+    ----------
+    preload : list
+        Names of the modules to import before waiting
+    """
+    import importlib
+    import runpy
+    for module in preload:
+        importlib.import_module(module)
+
+    line = sys.stdin.buffer.readline()
+    if not line:  # pool closed
+        return
+    t_received = time.monotonic()
+    command = json.loads(line)
+
+    # detach from the pool's pipe like a normally launched node
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    # the sched_* calls apply to a single thread, so apply them to all
+    # threads, and threads started later inherit them
+    threads = [int(tid) for tid in os.listdir('/proc/self/task')]
+    if command['cpu_affinity']:
+        cpus = parse_cpu_list(command['cpu_affinity'])
+        _for_threads(threads, os.sched_setaffinity, cpus)
+    if command['run_priority']:
+        param = os.sched_param(int(command['run_priority']))
+        _for_threads(threads, os.sched_setscheduler, os.SCHED_FIFO, param)
+
+    script = command['script']
+    sys.argv = [script] + command['args']
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    logger.debug(f'Starting {script} {time.monotonic() - t_received:.6f} s '
+                 'after receiving it')
+    runpy.run_path(script, run_name='__main__')
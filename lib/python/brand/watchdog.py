@@ -0,0 +1,360 @@
+"""
+Node health watchdog. A background thread checks the nodes launched by a
+Supervisor or Booter for three kinds of failure:
+    - the node's process exited (checked with Popen.poll)
+    - the node reported a fatal error on its <nickname>_state stream
+    - none of the node's redis_outputs streams received an entry within
+      heartbeat_timeout seconds (the node is 'stale')
+
+Changes in health are published to the node_health stream, and nodes that
+exit or report a fatal error can be restarted with exponential backoff.
+
+Settings are read from the graph's 'watchdog' section and can be
+overridden for each node with a 'watchdog' key in the node's entry:
+    interval : seconds between checks (graph-level only), default 0.5
+    heartbeat_timeout : seconds, default None (no heartbeat check)
+    restart : 'never' (default), 'on-failure' (non-zero exit code or fatal
+        error), or 'always' (any exit or fatal error)
+    max_restarts : restarts allowed per node before giving up, default 3
+    backoff : seconds before the first restart, doubled for each later
+        restart, default 1
+    max_backoff : maximum seconds before a restart, default 30
+"""
+import logging
+import threading
+import time
+
+from .process import (_as_list, parse_node_state, redis_time_id,
+                      stop_processes)
+
+logger = logging.getLogger(__name__)
+
+HEALTH_STREAM = 'node_health'
+RESTART_POLICIES = ('never', 'on-failure', 'always')
+DEFAULT_SETTINGS = {
+    'heartbeat_timeout': None,
+    'restart': 'never',
+    'max_restarts': 3,
+    'backoff': 1.0,
+    'max_backoff': 30.0
+}
+DEFAULT_INTERVAL = 0.5
+# seconds a node has to exit after SIGINT before a restart uses SIGKILL
+FATAL_STOP_TIMEOUT = 5
+
+
+def get_node_settings(graph_cfg, node_cfg) -> dict:
+    """
+    Get the watchdog settings for a node
+
+    Parameters
+    ----------
+    graph_cfg : dict
+        The graph's 'watchdog' section
+    node_cfg : dict
+        The node's configuration in the supergraph
+
+    Returns
+    -------
+    dict
+        Settings from DEFAULT_SETTINGS, overridden by the graph's and then
+        the node's 'watchdog' settings
+
+    Raises
+    ------
+    ValueError
+        If a setting is invalid
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    for cfg in (graph_cfg, node_cfg.get('watchdog')):
+        if not cfg:
+            continue
+        if not isinstance(cfg, dict):
+            raise ValueError('watchdog settings must be a dictionary')
+        settings.update({k: v for k, v in cfg.items() if k != 'interval'})
+    unknown = set(settings) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f'Unknown watchdog settings: {sorted(unknown)}')
+    if settings['restart'] not in RESTART_POLICIES:
+        raise ValueError(f"Invalid restart policy '{settings['restart']}', "
+                         f'must be one of {RESTART_POLICIES}')
+    return settings
+
+
+class Watchdog():
+    """
+    Background thread that monitors node health and restarts failed nodes
+
+    Attributes
+    ----------
+    health : dict
+        Node nicknames mapped to their current health: 'running', 'stale',
+        'exited', 'crashed', 'fatal error', 'restarting', or 'failed'
+    restarts : dict
+        Node nicknames mapped to the number of times they were restarted
+    """
+
+    def __init__(self,
+                 r,
+                 procs,
+                 nodes,
+                 launch,
+                 graph_cfg=None,
+                 source='supervisor',
+                 logger=logger):
+        """
+        Parameters
+        ----------
+        r : redis.Redis
+            instance of the redis.Redis interface
+        procs : dict
+            Node nicknames mapped to their subprocess.Popen objects. Restarted
+            nodes replace their entry in this dictionary, so the owner must
+            stop the watchdog before stopping the nodes.
+        nodes : dict
+            Node nicknames mapped to their configuration in the supergraph,
+            for the nodes in `procs`
+        launch : callable
+            Function called as launch(nickname, node_cfg) to restart a node,
+            returning its new subprocess.Popen object
+        graph_cfg : dict, optional
+            The graph's 'watchdog' section
+        source : str, optional
+            Name of the process running the watchdog, included in
+            node_health entries
+        logger : logging.Logger, optional
+            Logger used to report changes in health
+        """
+        graph_cfg = graph_cfg or {}
+        self.r = r
+        self.procs = procs
+        self.nodes = nodes
+        self.launch = launch
+        self.source = source
+        self.logger = logger
+        self.interval = float(graph_cfg.get('interval', DEFAULT_INTERVAL))
+        self.settings = {
+            node: get_node_settings(graph_cfg, cfg)
+            for node, cfg in nodes.items()
+        }
+
+        self.health = {}
+        self.restarts = {node: 0 for node in nodes}
+        # time (from time.monotonic) of each node's last launch
+        self.launched = {node: time.monotonic() for node in nodes}
+        # time at which each node waiting for a restart will be restarted
+        self.pending = {}
+        self.state_ids = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_health(self, node, health, message=''):
+        """
+        Update a node's health, publishing it to the node_health stream if
+        it changed
+
+        Parameters
+        ----------
+        node : str
+            Nickname of the node
+        health : str
+            New health of the node
+        message : str, optional
+            Details about the change
+        """
+        if self.health.get(node) == health:
+            return
+        self.health[node] = health
+        log = self.logger.info if health == 'running' else self.logger.warning
+        log(f"'{node}' health: {health}" +
+            (f': {message}' if message else ''))
+        self.r.xadd(
+            HEALTH_STREAM, {
+                'nickname': node,
+                'health': health,
+                'source': self.source,
+                'pid': self.procs[node].pid,
+                'restarts': self.restarts[node],
+                'message': message
+            })
+
+    def fail(self, node, health, message, failure=True):
+        """
+        Handle a node that exited or reported a fatal error, scheduling a
+        restart if its policy allows it
+
+        Parameters
+        ----------
+        node : str
+            Nickname of the node
+        health : str
+            'exited', 'crashed', or 'fatal error'
+        message : str
+            Details about the failure
+        failure : bool, optional
+            False if the node exited cleanly, which only triggers a restart
+            under the 'always' policy
+        """
+        self.set_health(node, health, message)
+        settings = self.settings[node]
+        if settings['restart'] == 'never' or (
+                not failure and settings['restart'] != 'always'):
+            return
+        n = self.restarts[node]
+        if n >= settings['max_restarts']:
+            self.set_health(node, 'failed',
+                            f'gave up after {n} restarts')
+            return
+        delay = min(settings['backoff'] * 2**n, settings['max_backoff'])
+        self.pending[node] = time.monotonic() + delay
+        self.set_health(node, 'restarting', f'restart in {delay:.3f} s')
+
+    def check_processes(self):
+        """
+        Check for nodes whose process exited
+        """
+        for node, proc in self.procs.items():
+            if node in self.pending or self.health.get(node) in (
+                    'exited', 'crashed', 'failed'):
+                continue
+            code = proc.poll()
+            if code is not None:
+                if code == 0:
+                    self.fail(node, 'exited', 'exit code 0', failure=False)
+                else:
+                    self.fail(node, 'crashed', f'exit code {code}')
+
+    def check_states(self):
+        """
+        Check the nodes' <nickname>_state streams for fatal errors
+        """
+        streams = {
+            f'{node}_state': self.state_ids[node]
+            for node in self.procs if node not in self.pending
+        }
+        if not streams:
+            return
+        for stream, entries in self.r.xread(streams):
+            node = stream.decode('utf-8')[:-len('_state')]
+            self.state_ids[node] = entries[-1][0]
+            for _, entry in entries:
+                state = parse_node_state(entry)
+                if state.startswith('fatal error'):
+                    # stop the node before it is restarted
+                    proc = self.procs[node]
+                    if (self.settings[node]['restart'] != 'never'
+                            and proc.poll() is None):
+                        stop_processes({node: proc},
+                                       self.logger,
+                                       timeout=FATAL_STOP_TIMEOUT)
+                    self.fail(node, 'fatal error', state)
+                    break
+
+    def check_heartbeats(self):
+        """
+        Check the age of the last entry in each node's output streams
+        """
+        nodes = [
+            node for node in self.procs
+            if self.settings[node]['heartbeat_timeout'] and self.health.get(
+                node) in ('running', 'stale')
+            and _as_list(self.nodes[node].get('redis_outputs'))
+        ]
+        if not nodes:
+            return
+        p = self.r.pipeline(transaction=False)
+        p.time()
+        for node in nodes:
+            for stream in _as_list(self.nodes[node].get('redis_outputs')):
+                p.xrevrange(stream, count=1)
+        replies = p.execute()
+        sec, usec = replies[0]
+        now_ms = sec * 1000 + usec // 1000
+        replies = iter(replies[1:])
+        t_now = time.monotonic()
+        for node in nodes:
+            timeout = self.settings[node]['heartbeat_timeout']
+            last_ms = None
+            for _ in _as_list(self.nodes[node].get('redis_outputs')):
+                last = next(replies)
+                if last:
+                    entry_ms = int(last[0][0].split(b'-')[0])
+                    last_ms = max(last_ms or entry_ms, entry_ms)
+            # streams must have been written since the node was launched
+            launch_age = t_now - self.launched[node]
+            if last_ms is None or (now_ms - last_ms) / 1000 > launch_age:
+                age = launch_age
+            else:
+                age = (now_ms - last_ms) / 1000
+            if age > timeout:
+                self.set_health(node, 'stale',
+                                f'no output for {age:.3f} s')
+            else:
+                self.set_health(node, 'running')
+
+    def restart_due(self):
+        """
+        Restart nodes whose backoff delay has passed
+        """
+        now = time.monotonic()
+        for node, due in list(self.pending.items()):
+            if due > now:
+                continue
+            del self.pending[node]
+            self.state_ids[node] = redis_time_id(self.r)
+            try:
+                self.procs[node] = self.launch(node, self.nodes[node])
+            except Exception as exc:
+                self.logger.exception(f"Could not restart '{node}'")
+                self.restarts[node] += 1
+                self.fail(node, 'crashed', f'restart failed: {repr(exc)}')
+                continue
+            self.restarts[node] += 1
+            self.launched[node] = time.monotonic()
+            self.health[node] = None
+            self.set_health(node, 'running',
+                            f'restart {self.restarts[node]}')
+
+    def check(self):
+        """
+        Run all health checks once
+        """
+        self.check_processes()
+        self.check_states()
+        self.check_heartbeats()
+        self.restart_due()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as exc:
+                self.logger.exception(f'Watchdog check failed: {repr(exc)}')
+
+    def start(self):
+        """
+        Start monitoring the nodes in a background thread
+        """
+        start_id = redis_time_id(self.r)
+        self.state_ids = {node: start_id for node in self.procs}
+        for node in self.procs:
+            self.set_health(node, 'running')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='watchdog',
+                                        daemon=True)
+        self._thread.start()
+        self.logger.info(f'Watching {len(self.procs)} nodes every '
+                         f'{self.interval} s')
+
+    def stop(self):
+        """
+        Stop the background thread. Pending restarts are cancelled.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.pending = {}